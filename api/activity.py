@@ -0,0 +1,94 @@
+# api/activity.py
+"""
+ApiClient 活跃度 write-behind：
+  ApiKeyAuth 每个请求只在进程内 dict 里记一笔（加锁 O(1)，不碰 DB / Redis）
+  后台线程每 API_ACTIVITY_FLUSH_SECONDS 秒把攒下的 last_seen_at / 请求数用一条 UPDATE 写回
+  进程退出时 atexit 再刷一次
+多个 worker 各刷各的：request_count 用 F() 累加，last_seen_at 取较大值，不会互相覆盖
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import ApiClient
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityTracker:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._pending = {}  # client_id -> [last_seen_at, count]
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.flushed = 0
+        self.errors = 0
+
+    def record(self, client_id: int):
+        now = timezone.now()
+        with self._lock:
+            item = self._pending.get(client_id)
+            if item is None:
+                self._pending[client_id] = [now, 1]
+            else:
+                item[0] = now
+                item[1] += 1
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        # 第一次 record 时才起线程：gunicorn/uvicorn fork 出来的 worker 各有一个
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="api-activity-flusher", daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        seen = Case(*[When(id=cid, then=Value(ts)) for cid, (ts, _) in pending.items()])
+        counts = Case(*[When(id=cid, then=Value(n)) for cid, (_, n) in pending.items()], default=Value(0))
+        try:
+            ApiClient.objects.filter(id__in=list(pending)).update(
+                last_seen_at=Greatest(Coalesce("last_seen_at", seen), seen),
+                request_count=F("request_count") + counts,
+            )
+        except Exception:
+            # 写失败：把这批加回去，下次再刷
+            logger.exception("api activity flush failed")
+            self.errors += 1
+            with self._lock:
+                for cid, (ts, n) in pending.items():
+                    item = self._pending.setdefault(cid, [ts, 0])
+                    item[0] = max(item[0], ts)
+                    item[1] += n
+            return 0
+        finally:
+            # 刷新线程自己的连接用完就关，别占着
+            if threading.current_thread() is self._thread:
+                connection.close()
+        self.flushed += len(pending)
+        return len(pending)
+
+
+activity_tracker = ActivityTracker(interval=settings.API_ACTIVITY_FLUSH_SECONDS)
@@ -1,8 +1,111 @@
 # auth.py
+import hmac
+import logging
+import threading
+import time
+
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
+
+from .activity import activity_tracker
 from .models import ApiClient
+from .utils.api_key import hash_api_key, key_prefix
+
+logger = logging.getLogger(__name__)
+
+# ApiClient 保存/删除时 +1（signals），各 worker 看到版本变了就重新加载
+API_KEY_VERSION_KEY = "auth:apikey_version"
+
+
+def get_api_key_version() -> int:
+    version = cache.get(API_KEY_VERSION_KEY)
+    if version is None:
+        cache.add(API_KEY_VERSION_KEY, 1, timeout=None)
+        version = cache.get(API_KEY_VERSION_KEY, 1)
+    return int(version)
+
+
+def bump_api_key_version() -> int:
+    try:
+        return cache.incr(API_KEY_VERSION_KEY)
+    except ValueError:
+        cache.set(API_KEY_VERSION_KEY, 2, timeout=None)
+        return 2
+
+
+class ApiKeyRegistry:
+    """
+    启用中的 key 全部放内存：{key_prefix: [(key_hash, client_id, name), ...]}
+    校验 = 按前缀取候选 + HMAC 后 compare_digest（常数时间），不查库
+    """
+
+    def __init__(self, rows):
+        self.by_prefix = {}
+        for prefix, digest, client_id, name in rows:
+            self.by_prefix.setdefault(prefix, []).append((digest.encode("ascii"), client_id, name))
+
+    def __len__(self):
+        return sum(len(v) for v in self.by_prefix.values())
+
+    def verify(self, key: str):
+        """
+        返回 (client_id, name)，无效返回 None
+        """
+        candidates = self.by_prefix.get(key_prefix(key))
+        if not candidates:
+            return None
+        digest = hash_api_key(key).encode("ascii")
+        found = None
+        # 候选都比一遍，不提前退出
+        for stored, client_id, name in candidates:
+            if hmac.compare_digest(stored, digest):
+                found = (client_id, name)
+        return found
+
+
+_registry = None
+_registry_version = None
+_registry_checked_at = 0.0
+_registry_lock = threading.Lock()
+
+
+def get_api_key_registry() -> ApiKeyRegistry:
+    """
+    每个 worker 一份；api key version 变了就重新加载（最多每 API_KEY_REFRESH_SECONDS 秒检查一次）
+    """
+    global _registry, _registry_version, _registry_checked_at
+
+    now = time.monotonic()
+    if _registry is not None and now - _registry_checked_at < settings.API_KEY_REFRESH_SECONDS:
+        return _registry
+
+    with _registry_lock:
+        if _registry is not None and now - _registry_checked_at < settings.API_KEY_REFRESH_SECONDS:
+            return _registry
+        try:
+            version = get_api_key_version()
+        except Exception:
+            logger.warning("api key registry: redis unavailable", exc_info=True)
+            version = _registry_version
+        if _registry is None or version != _registry_version:
+            rows = ApiClient.objects.filter(is_active=True).values_list("key_prefix", "key_hash", "id", "name")
+            _registry = ApiKeyRegistry(rows)
+            _registry_version = version
+        _registry_checked_at = now
+        return _registry
+
+
+def reset_api_key_registry():
+    """
+    本进程立刻失效（signals 调用；别的进程靠 version 刷新）
+    """
+    global _registry
+    with _registry_lock:
+        _registry = None
+
 
 class ApiKeyAuth(BaseAuthentication):
     def authenticate(self, request):
@@ -12,9 +115,16 @@ class ApiKeyAuth(BaseAuthentication):
         if not key:
             raise AuthenticationFailed("Missing API Key")
 
-        client = ApiClient.objects.filter(api_key=key, is_active=True).first()
-        if not client:
+        found = get_api_key_registry().verify(key)
+        if found is None:
             raise AuthenticationFailed("Invalid API Key")
 
+        # 不查库：拼一个只有 id/name 的 ApiClient（views 只用 request.auth.id）
+        client_id, name = found
+        activity_tracker.record(client_id)
+        client = ApiClient(id=client_id, name=name, is_active=True)
+        client._state.adding = False
+        client._state.db = "default"
+
         # ✅ 不依赖 user：user 用 AnonymousUser 占位，auth 放 ApiClient
         return (AnonymousUser(), client)
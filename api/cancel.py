@@ -0,0 +1,213 @@
+# api/cancel.py
+"""
+会话中断（推送式，定向到持有会话的 worker）：
+  cancel_watch()      开流时注册一个 asyncio.Event，并把本 worker 登记到 cancel:owners:{session_id}
+                      每个 event loop 一个后台任务 SUBSCRIBE 自己的频道 chat:cancel:{worker_id}
+  request_cancel()    写 cancel:{session_id}（带 TTL，pub/sub 断线重连后补查用），
+                      再只往登记过的 worker 频道 PUBLISH
+  until_cancelled()   包住上游的逐行读取：Event 一 set 立刻停，不等上游下一行（ADP 思考时可能很久没数据）
+流式循环里每行零 Redis 往返；退出 async with 就关掉上游响应，连接还给连接池
+"""
+import asyncio
+import logging
+import uuid
+import weakref
+from collections import defaultdict
+from contextlib import asynccontextmanager, suppress
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CANCEL_CHANNEL = "chat:cancel:{}"
+CANCEL_KEY = "cancel:{}"
+CANCEL_TTL = 60
+# 会话 -> 正在跑它的 worker 集合；兜底过期时间要比最长的一轮对话长
+OWNERS_KEY = "cancel:owners:{}"
+OWNERS_TTL = 3600
+# pub/sub 断线后重连的等待（秒）
+RESUBSCRIBE_DELAY = 1.0
+
+
+def _redis_kwargs() -> dict:
+    return {
+        "host": settings.REDIS_HOST,
+        "port": int(settings.REDIS_PORT),
+        "db": int(settings.REDIS_DB),
+        "decode_responses": True,
+    }
+
+
+_sync_redis = None
+
+
+def _get_sync_redis() -> redis.Redis:
+    global _sync_redis
+    if _sync_redis is None:
+        _sync_redis = redis.Redis(**_redis_kwargs())
+    return _sync_redis
+
+
+def request_cancel(session_id: str, ttl: int = CANCEL_TTL) -> int:
+    """
+    同步视图里调：返回收到通知的 worker 数（0 说明这个会话眼下没有在跑的流）
+    """
+    r = _get_sync_redis()
+    pipe = r.pipeline(transaction=False)
+    pipe.setex(CANCEL_KEY.format(session_id), ttl, "1")
+    pipe.smembers(OWNERS_KEY.format(session_id))
+    _, owners = pipe.execute()
+    if not owners:
+        return 0
+    pipe = r.pipeline(transaction=False)
+    for worker_id in owners:
+        pipe.publish(CANCEL_CHANNEL.format(worker_id), session_id)
+    return sum(pipe.execute())
+
+
+class CancelRegistry:
+    """
+    一个 event loop 一个：session_id -> 本 loop 上正在跑的流的 Event
+    """
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self.channel = CANCEL_CHANNEL.format(self.worker_id)
+        self.events = defaultdict(set)
+        self.redis = aioredis.Redis(**_redis_kwargs())
+        self.task = None
+        self.subscribed = asyncio.Event()
+
+    def notify(self, session_id: str):
+        for event in self.events.get(session_id, ()):
+            event.set()
+
+    async def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                self.subscribed.set()
+                # 断线期间可能漏了消息：重新订阅后把在跑的会话按标记补查一遍
+                sessions = list(self.events)
+                if sessions:
+                    flags = await self.redis.mget([CANCEL_KEY.format(s) for s in sessions])
+                    for s, flag in zip(sessions, flags):
+                        if flag == "1":
+                            self.notify(s)
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self.notify(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("cancel registry: pub/sub lost, resubscribing", exc_info=True)
+                self.subscribed.clear()
+                await asyncio.sleep(RESUBSCRIBE_DELAY)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    def ensure_listening(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._listen(), name="chat-cancel-listener")
+
+    async def aclose(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        await self.redis.aclose()
+
+
+_registries = weakref.WeakKeyDictionary()
+
+
+def get_cancel_registry() -> CancelRegistry:
+    loop = asyncio.get_running_loop()
+    registry = _registries.get(loop)
+    if registry is None:
+        registry = _registries[loop] = CancelRegistry()
+    registry.ensure_listening()
+    return registry
+
+
+@asynccontextmanager
+async def cancel_watch(session_id: str):
+    """
+    async with cancel_watch(session_id) as cancelled:
+        async for line in until_cancelled(resp.aiter_lines(), cancelled): ...
+    开流 / 收流各一次 Redis pipeline，中间全靠 pub/sub 推
+    """
+    registry = get_cancel_registry()
+    event = asyncio.Event()
+    registry.events[session_id].add(event)
+    owners_key = OWNERS_KEY.format(session_id)
+    try:
+        try:
+            pipe = registry.redis.pipeline(transaction=False)
+            # 上一轮留下的标记不能把这一轮也停了：开流时清掉
+            pipe.delete(CANCEL_KEY.format(session_id))
+            pipe.sadd(owners_key, registry.worker_id)
+            pipe.expire(owners_key, OWNERS_TTL)
+            await pipe.execute()
+        except Exception:
+            logger.warning("cancel registry: owner registration failed", exc_info=True)
+        yield event
+    finally:
+        watchers = registry.events.get(session_id)
+        if watchers is not None:
+            watchers.discard(event)
+            if not watchers:
+                del registry.events[session_id]
+                # 本 worker 上这个会话的流都结束了才注销（同一会话可能在同一 worker 上开了两个流）
+                try:
+                    await registry.redis.srem(owners_key, registry.worker_id)
+                except Exception:
+                    logger.warning("cancel registry: owner cleanup failed", exc_info=True)
+
+
+async def until_cancelled(aiterable, cancelled: asyncio.Event):
+    """
+    逐个产出 aiterable 的元素，cancelled 一 set 就停：正在等的那次读取直接取消，不等上游下一行
+    调用方退出 client.stream() 的 async with 时关掉响应
+    """
+    it = aiterable.__aiter__()
+    waiter = asyncio.ensure_future(cancelled.wait())
+    step = None
+    try:
+        while not cancelled.is_set():
+            step = asyncio.ensure_future(it.__anext__())
+            await asyncio.wait((step, waiter), return_when=asyncio.FIRST_COMPLETED)
+            if not step.done():
+                return
+            try:
+                item = step.result()
+            except StopAsyncIteration:
+                return
+            finally:
+                step = None
+            yield item
+    finally:
+        waiter.cancel()
+        # 外层被取消（客户端断开 / coalesce 取消这一步）时，正在等的读取也要停，不能留在后台读已关的响应
+        if step is not None:
+            step.cancel()
+            with suppress(asyncio.CancelledError, Exception):
+                await step
+        aclose = getattr(it, "aclose", None)
+        if aclose is not None:
+            with suppress(Exception):
+                await aclose()
+
+
+async def aclose_cancel_registry():
+    registry = _registries.pop(asyncio.get_running_loop(), None)
+    if registry is not None:
+        await registry.aclose()
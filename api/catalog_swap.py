@@ -0,0 +1,163 @@
+# api/catalog_swap.py
+"""
+酒店目录蓝绿切换（MySQL）：
+  1) 每张目录表建 {table}__shadow（CREATE TABLE ... LIKE），导入全程写 shadow，线上表不加锁不改动
+  2) 校验 shadow 行数
+  3) 一条 RENAME TABLE 把所有表一起换上线（原子），旧表改名 {table}__old 留着
+  4) 导坏了：rollback_catalog() 一条 RENAME 换回 __old，瞬间回滚
+其它库（SQLite 开发环境）没有多表原子 RENAME：退化成整个导入一个事务，校验不过就回滚
+LIKE 不复制外键：建完 shadow 按 model 定义补上（add_foreign_keys），换上线的表和迁移里的约束一致
+删表一律子表在前：__old 里的子表外键指向 hotel__old，先删 hotel 会被 InnoDB 拒绝（3730）
+"""
+import uuid
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+
+from .models import Hotel, HotelCommentStar, HotelOfferSummary, HotelPOI, HotelRoomOffer
+
+CATALOG_MODELS = [Hotel, HotelCommentStar, HotelPOI, HotelRoomOffer, HotelOfferSummary]
+SHADOW_SUFFIX = "__shadow"
+OLD_SUFFIX = "__old"
+
+
+class CatalogValidationError(Exception):
+    pass
+
+
+def _qn(name: str) -> str:
+    return connection.ops.quote_name(name)
+
+
+def _count(table: str) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {_qn(table)}")
+        return cursor.fetchone()[0]
+
+
+def _table_exists(table: str) -> bool:
+    return table in connection.introspection.table_names()
+
+
+def add_foreign_keys(model, table: str):
+    """
+    按 model 的外键定义给 table（LIKE 出来的 shadow / staging）补上外键约束
+    被引用的表按当前 db_table 解析：在 _point_models_at 里调用就指向对应的 shadow 表
+    约束名整库唯一，__old 上还留着上一次的名字：每次建表都带一个随机后缀
+    """
+    with connection.cursor() as cursor:
+        for field in model._meta.local_fields:
+            if not field.is_relation or not field.db_constraint:
+                continue
+            name = f"{table[:40]}_{field.column[:10]}_fk_{uuid.uuid4().hex[:8]}"
+            cursor.execute(
+                f"ALTER TABLE {_qn(table)} ADD CONSTRAINT {_qn(name)} FOREIGN KEY ({_qn(field.column)}) "
+                f"REFERENCES {_qn(field.related_model._meta.db_table)} ({_qn(field.target_field.column)})"
+            )
+
+
+def _drop_tables(cursor, tables, suffix: str):
+    # 子表在前（CATALOG_MODELS 里 Hotel 排第一）
+    for t in reversed(tables):
+        cursor.execute(f"DROP TABLE IF EXISTS {_qn(t + suffix)}")
+
+
+def validate_catalog(new_counts: dict, live_counts: dict, min_ratio: float):
+    """
+    新目录行数不能是 0，也不能比线上少太多（min_ratio=0.5：最多缩水一半）
+    """
+    for table in ("hotel", "hotel_room_offer"):
+        new, live = new_counts.get(table, 0), live_counts.get(table, 0)
+        if new == 0:
+            raise CatalogValidationError(f"{table}: new catalog is empty")
+        if live and new < live * min_ratio:
+            raise CatalogValidationError(f"{table}: {new} rows vs {live} live (< {min_ratio:.0%})")
+
+
+@contextmanager
+def _point_models_at(suffix: str):
+    """
+    导入进程内把目录 model 的 db_table 临时指向 shadow 表，ORM 读写（含 join）都落到 shadow
+    只在 import 命令进程里用，web 进程不受影响
+    """
+    originals = {m: m._meta.db_table for m in CATALOG_MODELS}
+    try:
+        for m, table in originals.items():
+            m._meta.db_table = table + suffix
+        yield
+    finally:
+        for m, table in originals.items():
+            m._meta.db_table = table
+
+
+@contextmanager
+def catalog_swap(*, log, seed: bool = False, min_ratio: float = 0.5):
+    """
+    with catalog_swap(log=...):
+        ...整个导入...
+    正常退出：校验通过后换表；异常或校验失败：shadow 丢掉，线上不动
+    seed=True：shadow 先复制一份线上数据（--delta 在 shadow 上做增量）
+    """
+    tables = [m._meta.db_table for m in CATALOG_MODELS]
+    live_counts = {t: _count(t) for t in tables}
+
+    if connection.vendor != "mysql":
+        with transaction.atomic():
+            yield
+            new_counts = {t: _count(t) for t in tables}
+            validate_catalog(new_counts, live_counts, min_ratio)
+            log(f"  validated: {new_counts}")
+        return
+
+    with connection.cursor() as cursor:
+        _drop_tables(cursor, tables, SHADOW_SUFFIX)
+        for t in tables:
+            cursor.execute(f"CREATE TABLE {_qn(t + SHADOW_SUFFIX)} LIKE {_qn(t)}")
+    with _point_models_at(SHADOW_SUFFIX):
+        # 外键在灌数据之前加：空表上加约束不用扫表，seed 按 CATALOG_MODELS 顺序先灌 hotel
+        for m in CATALOG_MODELS:
+            add_foreign_keys(m, m._meta.db_table)
+    if seed:
+        with connection.cursor() as cursor:
+            for t in tables:
+                cursor.execute(f"INSERT INTO {_qn(t + SHADOW_SUFFIX)} SELECT * FROM {_qn(t)}")
+
+    try:
+        with _point_models_at(SHADOW_SUFFIX):
+            yield
+        new_counts = {t: _count(t + SHADOW_SUFFIX) for t in tables}
+        validate_catalog(new_counts, live_counts, min_ratio)
+        log(f"  validated: {new_counts}")
+    except BaseException:
+        with connection.cursor() as cursor:
+            _drop_tables(cursor, tables, SHADOW_SUFFIX)
+        raise
+
+    with connection.cursor() as cursor:
+        _drop_tables(cursor, tables, OLD_SUFFIX)
+        # 一条语句换所有表：查询要么看到整套旧目录，要么看到整套新目录
+        renames = []
+        for t in tables:
+            renames.append(f"{_qn(t)} TO {_qn(t + OLD_SUFFIX)}")
+            renames.append(f"{_qn(t + SHADOW_SUFFIX)} TO {_qn(t)}")
+        cursor.execute("RENAME TABLE " + ", ".join(renames))
+    log("  swapped shadow catalog in (previous catalog kept as *__old)")
+
+
+def rollback_catalog():
+    """
+    把上一次换下去的 __old 表换回来（当前线上表变成 __old，可以再 rollback 回去）
+    """
+    if connection.vendor != "mysql":
+        raise CatalogValidationError("rollback needs MySQL blue/green tables")
+    tables = [m._meta.db_table for m in CATALOG_MODELS]
+    missing = [t for t in tables if not _table_exists(t + OLD_SUFFIX)]
+    if missing:
+        raise CatalogValidationError(f"no previous catalog to roll back to: {missing}")
+    renames = []
+    for t in tables:
+        renames.append(f"{_qn(t)} TO {_qn(t + SHADOW_SUFFIX)}")
+        renames.append(f"{_qn(t + OLD_SUFFIX)} TO {_qn(t)}")
+        renames.append(f"{_qn(t + SHADOW_SUFFIX)} TO {_qn(t + OLD_SUFFIX)}")
+    with connection.cursor() as cursor:
+        cursor.execute("RENAME TABLE " + ", ".join(renames))
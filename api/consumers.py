@@ -1,10 +1,11 @@
-import asyncio, json, websockets,re
+import asyncio, functools, json, websockets,re
 from channels.generic.websocket import AsyncWebsocketConsumer
 from websockets.exceptions import ConnectionClosed
 from api.utils.tencent_asr import build_tencent_asr_ws_url
 from api.utils.tencent_tts import build_tencent_tts_ws_url
+from api.cancel import cancel_watch
 from api.utils.adp_stream import adp_stream_reply
-from api.utils.tts_stream import tencent_tts_stream
+from api.utils.tts_stream import TTS_PIPELINE_DEPTH, TTS_POOL_SIZE, TTSConnectionPool, tencent_tts_stream
 import os
 from dotenv import load_dotenv
 load_dotenv()
@@ -355,6 +356,8 @@ class New_TencentPCMAsrConsumer(AsyncWebsocketConsumer):
 
 #=========================================================================
 _SENT_END_RE = re.compile(r"[。！？!?…\n]")
+# 一句合成完的标记（放进这句的音频缓冲队列）
+_TTS_EOS = object()
 
 class Final_TencentPCMAsrConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -371,6 +374,8 @@ class Final_TencentPCMAsrConsumer(AsyncWebsocketConsumer):
         self.tts_buffer = ""
         self.tts_seq = 0
         self.tts_queue = asyncio.Queue()
+        # 预开的 TTS 连接：每句不再现连腾讯
+        self.tts_pool = TTSConnectionPool()
         self.tts_task = asyncio.create_task(self._tts_worker())
 
         # === ASR ===
@@ -491,6 +496,7 @@ class Final_TencentPCMAsrConsumer(AsyncWebsocketConsumer):
 
     async def _run_adp_and_tts(self, user_text: str):
         await self.send(text_data=json.dumps({"type": "bot_start"}, ensure_ascii=False))
+        self.tts_pool.prewarm(self.tts_codec)
 
         try:
             async for delta in adp_stream_reply(
@@ -503,13 +509,16 @@ class Final_TencentPCMAsrConsumer(AsyncWebsocketConsumer):
                 # 1) 文本实时输出
                 await self.send(text_data=json.dumps({"type": "bot_delta", "delta": delta}, ensure_ascii=False))
 
-                # 2) 累积并切句给 TTS
-                self.tts_buffer += delta
+                # 2) 累积并切句给 TTS：只念正文（think / card 不念）
+                if delta["type"] != "result":
+                    continue
+                self.tts_buffer += delta["data"]
                 segs = self._pop_ready_segments()
                 for seg in segs:
                     await self.tts_queue.put(seg)
 
         except Exception as e:
+            self.tts_pool.stop_refill()
             await self.send(text_data=json.dumps({"type": "error", "detail": f"adp_failed: {e}"}))
             return
 
@@ -518,6 +527,8 @@ class Final_TencentPCMAsrConsumer(AsyncWebsocketConsumer):
         self.tts_buffer = ""
         if tail:
             await self.tts_queue.put(tail)
+        # 这一轮的句子都排上了：拿走的连接不再补，没用上的放到 max_idle 池子自己关
+        self.tts_pool.stop_refill()
 
         await self.send(text_data=json.dumps({"type": "bot_done"}, ensure_ascii=False))
 
@@ -536,7 +547,7 @@ class Final_TencentPCMAsrConsumer(AsyncWebsocketConsumer):
             await self.send(text_data=json.dumps({"type": "tts_start", "seq": seq, "text": seg}, ensure_ascii=False))
 
             try:
-                async for kind, payload in tencent_tts_stream(text=seg, codec=self.tts_codec):
+                async for kind, payload in tencent_tts_stream(text=seg, codec=self.tts_codec, pool=self.tts_pool):
                     if kind == "meta":
                         # 字幕/状态信息（可选）
                         await self.send(text_data=json.dumps({"type": "tts_meta", "seq": seq, "meta": payload}, ensure_ascii=False))
@@ -569,6 +580,11 @@ class Final_TencentPCMAsrConsumer(AsyncWebsocketConsumer):
                 self.tts_task.cancel()
         except:
             pass
+        try:
+            if hasattr(self, "tts_pool"):
+                await self.tts_pool.aclose()
+        except:
+            pass
 
 #====================================================================
 import json
@@ -578,6 +594,7 @@ from websockets.exceptions import ConnectionClosed
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from api.models import AdpChatSession
+from api.usage import UsageRecorder
 
 class Agent_interaction(AsyncWebsocketConsumer):
     @database_sync_to_async
@@ -587,16 +604,15 @@ class Agent_interaction(AsyncWebsocketConsumer):
 
     @database_sync_to_async
     def _save_chat_session(self, *, session_id: str, visitor_biz_id: str | None, app: str,
-                           user_question: str, model_answer: str) -> int:
+                           user_question: str, model_answer: str):
         from api.models import AdpChatSession
-        obj = AdpChatSession.objects.create(
+        return AdpChatSession.objects.create(
             session_id=session_id,
             visitor_biz_id=visitor_biz_id,
             app=app,
             user_question=user_question,
             model_answer=model_answer,
         )
-        return obj.id
 
     async def connect(self):
         await self.accept()
@@ -617,12 +633,23 @@ class Agent_interaction(AsyncWebsocketConsumer):
         self.tts_seq = 0
         self.tts_queue: asyncio.Queue[str | None] = asyncio.Queue()
 
-        # 当前 TTS task（用于打断/取消）
+        # 当前正在播的那句（用于打断/取消）
         self._tts_current_task: asyncio.Task | None = None
         self._tts_cancel_event = asyncio.Event()
 
+        # 流水线：最多 TTS_PIPELINE_DEPTH 句同时合成，音频先进各句的缓冲，播放按 seq 顺序放
+        self._tts_sem = asyncio.Semaphore(TTS_PIPELINE_DEPTH)
+        self._tts_synth_tasks: set[asyncio.Task] = set()
+        self.tts_play_queue: asyncio.Queue = asyncio.Queue()
+
+        # 预开的 TTS 连接（v2 接口文本不进 URL，可以先握手）：句子之间只剩合成时间
+        self.tts_pool = TTSConnectionPool(size=max(TTS_POOL_SIZE, TTS_PIPELINE_DEPTH))
+
         self.tts_task = asyncio.create_task(self._tts_worker())
+        self.tts_player_task = asyncio.create_task(self._tts_player())
         self.turn_id = 0
+        # 最近一次被打断时的 turn_id：这一轮及之前的句子都不再合成 / 播放
+        self._tts_interrupted_turn = 0
         self._tts_turn_done = asyncio.Event()
         self._tts_turn_done.set()  # 默认 done
 
@@ -824,128 +851,103 @@ class Agent_interaction(AsyncWebsocketConsumer):
 
         if reply_mode == "audio":
             self._tts_turn_done.clear()
+            # 等 ADP 首字的工夫把 TTS 连接建好
+            self.tts_pool.prewarm(tts_codec)
+
+        # 用量：websocket 没有 ApiClient，client_id 留空，按 app 归集
+        recorder = UsageRecorder(client_id="", endpoint="agent_ws", app=self.app)
 
         # ✅ 用于落库：累积本轮模型回答（只累积 result）
         answer_accum = []
-        in_json_for_db = False  # DB 也过滤 JSON 块（和 TTS 同逻辑）
+        cancelled_turn = False
 
+        # 用量在 finally 里提交：插话打断 / 连接断开时任务被取消，这一轮上游已经产生的用量也要记
         try:
-            in_json = False  # 你原来 TTS 用的
-
-            async for delta in adp_stream_reply(
-                    session_id=self.session_id,
-                    visitor_biz_id=self.visitor_biz_id,
-                    app=self.app,
-                    content=user_text,
-                    streaming_throttle=self.streaming_throttle,
-            ):
-                # 1) 前端实时输出
-                await self.send(text_data=json.dumps(
-                    {"type": delta["type"], "delta": delta["data"]},
-                    ensure_ascii=False
-                ))
-
-                # ✅ 2) DB 累积（只记录 result）
-                if delta["type"] == "result":
-                    chunk = delta["data"] if isinstance(delta["data"], str) else str(delta["data"])
-                    if chunk:
-                        # 过滤 JSON 块（避免存进回答里）
-                        if (not in_json_for_db) and ("{" in chunk):
-                            in_json_for_db = True
-                            idx = chunk.find("{")
-                            before = chunk[:idx]
-                            if before:
-                                answer_accum.append(before)
+            try:
+                # 会话可被 /api/session/cancel/ 中断（可能来自别的 worker）：上游立刻关掉，最后收到一条 cancelled
+                async with cancel_watch(self.session_id) as cancelled:
+                    async for delta in adp_stream_reply(
+                            session_id=self.session_id,
+                            visitor_biz_id=self.visitor_biz_id,
+                            app=self.app,
+                            content=user_text,
+                            streaming_throttle=self.streaming_throttle,
+                            recorder=recorder,
+                            cancelled=cancelled,
+                    ):
+                        # 1) 前端实时输出
+                        await self.send(text_data=json.dumps(
+                            {"type": delta["type"], "delta": delta["data"]},
+                            ensure_ascii=False
+                        ))
+                        if delta["type"] == "cancelled":
+                            cancelled_turn = True
                             continue
 
-                        if in_json_for_db:
-                            if "}" in chunk:
-                                in_json_for_db = False
-                                idx = chunk.find("}")
-                                after = chunk[idx + 1:]
-                                if after:
-                                    answer_accum.append(after)
+                        # adp_stream_reply 已经把 JSON 块拆成 card 事件：result 里只剩正文，不用再扫 { }
+                        if delta["type"] != "result":
                             continue
+                        text = delta["data"]
 
-                        answer_accum.append(chunk)
+                        # ✅ 2) DB 累积（只记录 result）
+                        answer_accum.append(text)
 
-                # 3) TTS 入队（你原逻辑不动）
-                if reply_mode != "audio":
-                    continue
-                if delta["type"] in ("process", "think"):
-                    continue
-                if delta["type"] != "result":
-                    continue
-
-                text = delta["data"] if isinstance(delta["data"], str) else str(delta["data"])
-                if not text:
-                    continue
-
-                # ===== 你原来的 JSON 屏蔽逻辑（给 TTS 用）=====
-                if (not in_json) and ("{" in text):
-                    in_json = True
-                    idx = text.find("{")
-                    before = text[:idx]
-                    if before:
-                        self.tts_buffer += before
+                        # 3) TTS 入队
+                        if reply_mode != "audio":
+                            continue
+                        self.tts_buffer += text
                         for seg in self._pop_ready_segments():
                             await self.tts_queue.put(("SEG", cur_turn, seg))
-                    continue
-
-                if in_json:
-                    if "}" in text:
-                        in_json = False
-                        idx = text.find("}")
-                        after = text[idx + 1:]
-                        if after:
-                            self.tts_buffer += after
-                            for seg in self._pop_ready_segments():
-                                await self.tts_queue.put(("SEG", cur_turn, seg))
-                    continue
-
-                self.tts_buffer += text
-                for seg in self._pop_ready_segments():
-                    await self.tts_queue.put(("SEG", cur_turn, seg))
-
-        except Exception as e:
-            await self.send(text_data=json.dumps({"type": "error", "detail": f"adp_failed: {e}"}))
 
-            # ✅ 即使失败也落库（记录当时已有的 answer）
-            try:
-                if self.session_id:
-                    final_answer = "".join(answer_accum).strip()
-                    await self._save_chat_session(
-                        session_key=self.session_id,
-                        visitor_biz_id=self.visitor_biz_id,
-                        app=self.app,
-                        user_question=user_text,
-                        model_answer=final_answer,
-                    )
-            except Exception:
-                pass
+            except Exception as e:
+                recorder.mark_failed()
+                await self.send(text_data=json.dumps({"type": "error", "detail": f"adp_failed: {e}"}))
+
+                # ✅ 即使失败也落库（记录当时已有的 answer）
+                try:
+                    if self.session_id:
+                        final_answer = "".join(answer_accum).strip()
+                        await self._save_chat_session(
+                            session_key=self.session_id,
+                            visitor_biz_id=self.visitor_biz_id,
+                            app=self.app,
+                            user_question=user_text,
+                            model_answer=final_answer,
+                        )
+                except Exception:
+                    pass
+
+                if reply_mode == "audio":
+                    await self.tts_queue.put(("TURN_END", cur_turn, None))
+                    await self._tts_turn_done.wait()
+                return
 
-            if reply_mode == "audio":
+            # ===== 你原来的流结束：等 TTS 播完 =====
+            if cancelled_turn:
+                # 被中断：剩下的文本不播了，正在播的也停
+                if reply_mode == "audio":
+                    await self._interrupt_tts(reason="cancelled")
+                self.tts_buffer = ""
+            elif reply_mode == "audio":
+                tail = self.tts_buffer.strip()
+                self.tts_buffer = ""
+                if tail:
+                    await self.tts_queue.put(("SEG", cur_turn, tail))
                 await self.tts_queue.put(("TURN_END", cur_turn, None))
                 await self._tts_turn_done.wait()
-            return
-
-        # ===== 你原来的流结束：等 TTS 播完 =====
-        if reply_mode == "audio":
-            tail = self.tts_buffer.strip()
-            self.tts_buffer = ""
-            if tail:
-                await self.tts_queue.put(("SEG", cur_turn, tail))
-            await self.tts_queue.put(("TURN_END", cur_turn, None))
-            await self._tts_turn_done.wait()
-        else:
-            self.tts_buffer = ""
+            else:
+                self.tts_buffer = ""
+                # 这一轮不出声：不留备用的 TTS 连接
+                self.tts_pool.release()
+        finally:
+            recorder.commit()
 
         # ✅ 流正常结束：落库并把 pk 发给前端
-        chat_pk = None
+        saved = None
         try:
             if self.session_id:
                 final_answer = "".join(answer_accum).strip()
-                chat_pk = await self._save_chat_session(
+                saved = await self._save_chat_session(
                     session_id=self.session_id,
                     visitor_biz_id=self.visitor_biz_id,
                     app=self.app,
@@ -956,10 +958,12 @@ class Agent_interaction(AsyncWebsocketConsumer):
             await self.send(text_data=json.dumps({"type": "error", "detail": f"save_session_failed: {e}"}))
 
         # ✅ 告诉前端：本轮已保存，对应 pk 是啥
-        if chat_pk is not None:
+        # created_at 原样带回给反馈接口：MySQL 上按它定位分区
+        if saved is not None:
             await self.send(text_data=json.dumps({
                 "type": "chat_saved",
-                "pk": chat_pk,
+                "pk": saved.id,
+                "created_at": saved.created_at.isoformat(),
                 "session_id": self.session_id,
             }, ensure_ascii=False))
 
@@ -969,12 +973,16 @@ class Agent_interaction(AsyncWebsocketConsumer):
         """
         用户插话/新一轮输入：打断正在播报的 TTS（barge-in）
         - 清 buffer
-        - 清队列
-        - cancel 当前 TTS task
+        - 清队列（待合成 + 待播放）
+        - cancel 所有在合成的句子和正在播的那句
+        - 标记这一轮被打断：已经出队、还没开始播的句子（player 可能正卡在发 tts_start 上）也不播
         """
+        self._tts_interrupted_turn = self.turn_id
         self.tts_buffer = ""
         await self._drain_tts_queue()
         await self._cancel_tts_current()
+        # 备用连接也关掉：下一轮开始时 prewarm 再开
+        self.tts_pool.release()
 
         # 让等待 bot_done 的那一轮别卡死
         self._tts_turn_done.set()
@@ -986,81 +994,159 @@ class Agent_interaction(AsyncWebsocketConsumer):
 
 
     async def _drain_tts_queue(self):
-        try:
-            while True:
-                item = self.tts_queue.get_nowait()
-                if item is None:
-                    # 保留退出信号
-                    await self.tts_queue.put(None)
-                    break
-        except asyncio.QueueEmpty:
-            return
+        for queue in (self.tts_queue, self.tts_play_queue):
+            try:
+                while True:
+                    item = queue.get_nowait()
+                    if item is None:
+                        # 保留退出信号
+                        await queue.put(None)
+                        break
+            except asyncio.QueueEmpty:
+                pass
 
 
     async def _cancel_tts_current(self):
         self._tts_cancel_event.set()
+        tasks = list(self._tts_synth_tasks)
         task = self._tts_current_task
         if task and not task.done():
-            task.cancel()
-            try:
-                await task
-            except:
-                pass
+            tasks.append(task)
+        for t in tasks:
+            t.cancel()
+        # 合成中途被取消的连接在 tencent_tts_stream 的 finally 里关掉
+        await asyncio.gather(*tasks, return_exceptions=True)
         self._tts_current_task = None
         self._tts_cancel_event.clear()
 
 
+    def _tts_turn_live(self, turn_id: int) -> bool:
+        """
+        这一轮的句子还该不该播：是最新一轮，且没被打断过
+        """
+        return turn_id == self.turn_id and turn_id > self._tts_interrupted_turn
+
     async def _tts_worker(self):
         """
+        调度：从 tts_queue 取句子，立刻起合成任务（受 _tts_sem 限流），按顺序交给播放队列
         队列项格式：
-          ("SEG", turn_id, text)      -> 合成/推流
-          ("TURN_END", turn_id, None) -> 本轮结束，触发 _tts_turn_done
+          ("SEG", turn_id, text)      -> 合成/推流；播放队列里是 ("SEG", turn_id, (seq, text, buf, task))
+          ("TURN_END", turn_id, None) -> 本轮结束，前面的句子播完后触发 _tts_turn_done
           None                        -> 退出 worker（disconnect 用）
         """
         while True:
             item = await self.tts_queue.get()
 
             if item is None:
+                await self.tts_play_queue.put(None)
                 return
 
             kind, turn_id, seg = item
 
             if kind == "TURN_END":
-                # 标记“当前轮结束”
-                # 只有当 turn_id == self.turn_id（最新轮）时才 set，避免旧轮干扰新轮
+                # 这一轮的句子都起了合成：后面拿走的连接不再补
                 if turn_id == self.turn_id:
-                    self._tts_turn_done.set()
+                    self.tts_pool.stop_refill()
+                await self.tts_play_queue.put(("TURN_END", turn_id, None))
                 continue
 
             # kind == "SEG"
-            if not seg:
+            if not seg or not self._tts_turn_live(turn_id):
                 continue
 
             self.tts_seq += 1
-            seq = self.tts_seq
+            buf = asyncio.Queue()
+            task = asyncio.create_task(self._tts_synth(seg=seg, codec=self.tts_codec, buf=buf))
+            self._tts_synth_tasks.add(task)
+            task.add_done_callback(self._tts_synth_tasks.discard)
+            task.add_done_callback(functools.partial(self._tts_synth_done, buf))
+            await self.tts_play_queue.put(("SEG", turn_id, (self.tts_seq, seg, buf, task)))
+
+    async def _tts_synth(self, seg: str, codec: str, buf: asyncio.Queue):
+        """
+        合成一句，音频 / 字幕原样进 buf；结尾由 _tts_synth_done 放
+        """
+        async with self._tts_sem:
+            async for item in tencent_tts_stream(text=seg, codec=codec, pool=self.tts_pool):
+                buf.put_nowait(item)
+
+    @staticmethod
+    def _tts_synth_done(buf: asyncio.Queue, task: asyncio.Task):
+        """
+        合成任务一结束（包括还没跑就被取消）buf 里一定有个结尾：正常 _TTS_EOS，出错放异常，被取消放 CancelledError
+        播放那边不会在 buf.get() 上干等
+        """
+        if task.cancelled():
+            buf.put_nowait(asyncio.CancelledError())
+        elif task.exception() is not None:
+            buf.put_nowait(task.exception())
+        else:
+            buf.put_nowait(_TTS_EOS)
+
+    async def _tts_player(self):
+        """
+        播放：严格按 seq 顺序把各句缓冲里的音频推给客户端；前一句播完，后一句往往已经合成好了
+        """
+        while True:
+            item = await self.tts_play_queue.get()
+
+            if item is None:
+                return
+
+            kind, turn_id, payload = item
+
+            if kind == "TURN_END":
+                # 只有当 turn_id == self.turn_id（最新轮）时才 set，避免旧轮干扰新轮
+                if turn_id == self.turn_id:
+                    self._tts_turn_done.set()
+                    # 这一轮播完（或没有音频）：没用上的备用连接关掉
+                    self.tts_pool.release()
+                continue
+
+            seq, seg, buf, synth = payload
+            if synth.cancelled() or not self._tts_turn_live(turn_id):
+                # 打断前已经取出来的句子 / 旧一轮的句子：不播，合成也停掉
+                synth.cancel()
+                continue
 
             await self.send(text_data=json.dumps({
                 "type": "tts_start", "seq": seq, "codec": self.tts_codec, "text": seg
             }, ensure_ascii=False))
 
+            # 发 tts_start 的时候可能被打断了（那时还没有 _tts_current_task 可取消）：开播前再查一次
+            if not self._tts_turn_live(turn_id):
+                synth.cancel()
+                continue
+
+            play = asyncio.create_task(self._tts_play_one(seq=seq, buf=buf))
+            self._tts_current_task = play
             try:
-                self._tts_current_task = asyncio.create_task(self._tts_stream_one(seg=seg, seq=seq))
-                await self._tts_current_task
-                await self.send(text_data=json.dumps({"type": "tts_done", "seq": seq}, ensure_ascii=False))
+                # 用 wait 不直接 await：打断只取消 play（跳过这句）；player 自己被取消（disconnect）照常退出
+                await asyncio.wait((play,))
             except asyncio.CancelledError:
-                continue
-            except Exception as e:
-                await self.send(text_data=json.dumps({"type": "error", "detail": f"tts_failed: {e}"}))
-                continue
+                play.cancel()
+                raise
             finally:
                 self._tts_current_task = None
 
+            if play.cancelled():
+                continue
+            if play.exception() is not None:
+                await self.send(text_data=json.dumps({"type": "error", "detail": f"tts_failed: {play.exception()}"}))
+                continue
+            await self.send(text_data=json.dumps({"type": "tts_done", "seq": seq}, ensure_ascii=False))
 
-    async def _tts_stream_one(self, seg: str, seq: int):
-        async for kind, payload in tencent_tts_stream(text=seg, codec=self.tts_codec):
+    async def _tts_play_one(self, seq: int, buf: asyncio.Queue):
+        while True:
+            item = await buf.get()
             if self._tts_cancel_event.is_set():
                 raise asyncio.CancelledError()
+            if item is _TTS_EOS:
+                return
+            if isinstance(item, BaseException):
+                raise item
 
+            kind, payload = item
             if kind == "meta":
                 await self.send(text_data=json.dumps({"type": "tts_meta", "seq": seq, "meta": payload}, ensure_ascii=False))
             else:
@@ -1091,5 +1177,14 @@ class Agent_interaction(AsyncWebsocketConsumer):
             await self.tts_queue.put(None)
             if hasattr(self, "tts_task") and self.tts_task:
                 self.tts_task.cancel()
+            if hasattr(self, "tts_player_task") and self.tts_player_task:
+                self.tts_player_task.cancel()
+        except:
+            pass
+
+        # 4) 关预开的 TTS 连接
+        try:
+            if hasattr(self, "tts_pool"):
+                await self.tts_pool.aclose()
         except:
             pass
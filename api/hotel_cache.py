@@ -0,0 +1,145 @@
+# api/hotel_cache.py
+import hashlib
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .utils.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# import_hotels 跑完会 +1，所有缓存 key 都带版本号，版本一变两级缓存同时失效
+CATALOG_VERSION_KEY = "hotel:catalog_version"
+
+# 查不到的酒店也缓存（负缓存），用 False 占位，和 "没缓存" 区分开
+NOT_FOUND = False
+
+
+def get_catalog_version() -> int:
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, 1, timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY, 1)
+    return int(version)
+
+
+def bump_catalog_version() -> int:
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        # key 不存在（Redis 清过）：直接从 2 开始，保证和旧 key 不撞
+        cache.set(CATALOG_VERSION_KEY, 2, timeout=None)
+        return 2
+
+
+class HotelSearchCache:
+    """
+    酒店查询结果的两级读穿缓存：
+      L1: 进程内 LRU（每个 worker 一份，有界）
+      L2: Redis（CACHES["default"]，所有 worker 共享）
+    key = (catalog_version, 规范化后的酒店名)
+    """
+
+    def __init__(self, local_size: int, timeout: int):
+        self.local = LRUCache(maxsize=local_size)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        return name.strip()
+
+    @staticmethod
+    def _redis_key(version: int, name: str) -> str:
+        digest = hashlib.sha1(name.encode("utf-8")).hexdigest()
+        return f"hotel:search:{version}:{digest}"
+
+    def _count(self, *, local=0, redis=0, miss=0, error=0):
+        with self._lock:
+            self.local_hits += local
+            self.redis_hits += redis
+            self.misses += miss
+            self.errors += error
+
+    def get_or_load(self, names, loader) -> dict:
+        """
+        names: 已规范化的酒店名
+        loader(missing_names) -> {name: payload}，查不到的名字不在返回值里
+        返回 {name: payload 或 NOT_FOUND}
+        """
+        names = list(dict.fromkeys(names))
+        try:
+            version = get_catalog_version()
+        except Exception:
+            # Redis 挂了：版本号拿不到就没法保证一致性，直接回源
+            logger.exception("hotel cache: read catalog version failed")
+            self._count(error=1, miss=len(names))
+            loaded = loader(names)
+            return {n: loaded.get(n, NOT_FOUND) for n in names}
+
+        found = {}
+        pending = []
+        for n in names:
+            value = self.local.get((version, n), None)
+            if value is None:
+                pending.append(n)
+            else:
+                found[n] = value
+        self._count(local=len(found))
+
+        if pending:
+            keys = {self._redis_key(version, n): n for n in pending}
+            try:
+                hits = cache.get_many(list(keys))
+            except Exception:
+                logger.exception("hotel cache: redis get_many failed")
+                self._count(error=1)
+                hits = {}
+            for key, value in hits.items():
+                n = keys[key]
+                found[n] = value
+                self.local.set((version, n), value)
+            self._count(redis=len(hits))
+            pending = [n for n in pending if n not in found]
+
+        if pending:
+            self._count(miss=len(pending))
+            loaded = loader(pending)
+            to_store = {}
+            for n in pending:
+                value = loaded.get(n, NOT_FOUND)
+                found[n] = value
+                self.local.set((version, n), value)
+                to_store[self._redis_key(version, n)] = value
+            try:
+                cache.set_many(to_store, timeout=self.timeout)
+            except Exception:
+                logger.exception("hotel cache: redis set_many failed")
+                self._count(error=1)
+
+        return found
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.local_hits + self.redis_hits + self.misses
+            return {
+                "local_hits": self.local_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "hit_rate": round((self.local_hits + self.redis_hits) / lookups, 4) if lookups else None,
+                "local_size": len(self.local),
+                "local_maxsize": self.local.maxsize,
+            }
+
+
+hotel_search_cache = HotelSearchCache(
+    local_size=settings.HOTEL_CACHE_LOCAL_SIZE,
+    timeout=settings.HOTEL_CACHE_TIMEOUT,
+)
@@ -0,0 +1,365 @@
+# api/hotel_import.py
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+import pandas as pd
+from django.db import connection, transaction
+
+from .catalog_swap import catalog_swap
+from .hotel_cache import bump_catalog_version
+from .models import Hotel, HotelCommentStar, HotelPOI, HotelRoomOffer
+from .hotel_writers import OrmWriter, fast_writer
+from .offer_summary import SUMMARY_TOP_N, build_offer_summaries
+from .utils.catalog_clean import (
+    HOTEL_COLUMNS,
+    OFFER_COLUMNS,
+    OFFER_KEY_COLUMNS,
+    POI_COLUMNS,
+    STAR_COLUMNS,
+    clean_hotels,
+    clean_pois,
+    clean_stars,
+    iter_csv_blocks,
+    offer_keys,
+    offer_slots,
+    parse_offer_block,
+    parse_offer_block_delta,
+    to_rows,
+)
+
+
+class _InlineExecutor:
+    """
+    workers<=1 时不开进程池，接口和 Future 保持一致
+    """
+
+    class _Done:
+        def __init__(self, value):
+            self._value = value
+
+        def result(self):
+            return self._value
+
+    def submit(self, fn, *args):
+        return self._Done(fn(*args))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _chunks(seq, size):
+    seq = list(seq)
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+class HotelImporter:
+    """
+    酒店目录导入引擎：
+      - 列清洗全部向量化（catalog_clean），不走 iterrows
+      - 大表（offer csv）按字节切块，进程池并行解析+清洗，主进程单线程批量写库
+      - swap（MySQL 默认，--in_place 关掉）：整套目录导进 shadow 表，校验通过后原子换表，导入期间查询不受影响（见 catalog_swap）
+      - delta：每行带内容哈希 row_hash，和库里比对后只写新增/变化的行、删掉源里没有的行
+    """
+
+    def __init__(
+        self,
+        *,
+        log,
+        batch: int = 5000,
+        workers: int = 1,
+        block_bytes: int = 8 << 20,
+        fast: bool = False,
+        delta: bool = False,
+        swap: bool = None,
+        min_ratio: float = 0.5,
+    ):
+        self.log = log
+        self.batch = batch
+        self.workers = max(1, workers)
+        self.block_bytes = block_bytes
+        # fast：offer 表整表替换，MySQL 走 LOAD DATA + 换表，其它库走 executemany
+        self.fast = fast
+        self.delta = delta
+        # swap=None：MySQL 上蓝绿换表，其它库（SQLite 开发环境）直接写
+        self.swap = connection.vendor == "mysql" if swap is None else swap
+        # 校验：新目录 hotel/offer 行数不能少于线上的 min_ratio
+        self.min_ratio = min_ratio
+        # delta 统计：{table: {"inserted","updated","deleted","unchanged"}}
+        self.diff = {}
+        # delta 下报价有变动的酒店，只重建这些酒店的汇总
+        self.touched = set()
+        self._known_ids = None
+
+    # ---------- hotel 占位 ----------
+    def _ensure_hotels(self, ids):
+        """
+        补齐 Hotel 占位行（星级/POI/报价里有、xlsx 里没有的酒店）
+        已知 id 缓存在内存里，整个导入只读一次 hotel 表
+        """
+        if self._known_ids is None:
+            self._known_ids = set(Hotel.objects.values_list("hotel_id", flat=True))
+        missing = set(ids) - self._known_ids
+        if missing:
+            Hotel.objects.bulk_create(
+                [Hotel(hotel_id=hid) for hid in missing],
+                batch_size=self.batch,
+                ignore_conflicts=True,
+            )
+            self._known_ids |= missing
+            # 新酒店也要有汇总行
+            self.touched |= missing
+        return len(missing)
+
+    def _iter_blocks(self, fn, path):
+        """
+        offer csv 按块丢给进程池，按提交顺序取回 fn(header, block) 的结果
+        同时在途的块数有上限：解析快于写库时不会把整个文件堆进内存
+        """
+        max_inflight = self.workers * 2
+        executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else _InlineExecutor()
+        with executor:
+            pending = deque()
+            for header, block in iter_csv_blocks(path, self.block_bytes):
+                pending.append(executor.submit(fn, header, block))
+                if len(pending) >= max_inflight:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _diff_by_hash(self, table, df, stored: dict):
+        """
+        df 按 hotel_id 和库里 {hotel_id: row_hash} 比对，返回需要 upsert 的行
+        """
+        old = df["hotel_id"].map(stored)
+        changed = old.ne(df["row_hash"]).to_numpy()
+        inserted = int(old.isna().sum())
+        self.diff[table] = {
+            "inserted": inserted,
+            "updated": int(changed.sum()) - inserted,
+            "deleted": 0,
+            "unchanged": int((~changed).sum()),
+        }
+        return df[changed]
+
+    # ---------- 各表 ----------
+    def import_hotels(self, path, sheet) -> int:
+        df = clean_hotels(pd.read_excel(path, sheet_name=sheet, dtype={"华住id": str}))
+        if self.delta:
+            # hotel 只增改不删：xlsx 里没有的可能是报价补出来的占位酒店
+            stored = dict(Hotel.objects.values_list("hotel_id", "row_hash").iterator(chunk_size=10000))
+            df = self._diff_by_hash("hotel", df, stored)
+            self.touched.update(df["hotel_id"][~df["hotel_id"].isin(stored)])
+        rows = to_rows(df, HOTEL_COLUMNS)
+        with transaction.atomic():
+            # upsert：已存在就更新基础信息（一条 INSERT ... ON DUPLICATE KEY UPDATE）
+            Hotel.objects.bulk_create(
+                [Hotel(**dict(zip(HOTEL_COLUMNS, r))) for r in rows],
+                batch_size=self.batch,
+                update_conflicts=True,
+                unique_fields=["hotel_id"],
+                update_fields=["name", "brand", "business_area", "row_hash"],
+            )
+        self._known_ids = None
+        return len(rows)
+
+    def import_stars(self, path) -> int:
+        df = clean_stars(pd.read_csv(path, dtype={"hotelno": str}))
+        gone = []
+        if self.delta:
+            stored = dict(HotelCommentStar.objects.values_list("hotel_id", "row_hash"))
+            gone = sorted(stored.keys() - set(df["hotel_id"]))
+            df = self._diff_by_hash("hotel_comment_star", df, stored)
+            self.diff["hotel_comment_star"]["deleted"] = len(gone)
+        rows = to_rows(df, STAR_COLUMNS)
+        with transaction.atomic():
+            for ids in _chunks(gone, self.batch):
+                HotelCommentStar.objects.filter(hotel_id__in=ids).delete()
+            self._ensure_hotels(df["hotel_id"])
+            HotelCommentStar.objects.bulk_create(
+                [HotelCommentStar(**dict(zip(STAR_COLUMNS, r))) for r in rows],
+                batch_size=self.batch,
+                update_conflicts=True,
+                unique_fields=["hotel"],
+                update_fields=["experiencescore_mix", "row_hash"],
+            )
+        return len(rows) + len(gone)
+
+    def import_pois(self, path) -> int:
+        df = clean_pois(pd.read_csv(path, dtype={"hotelno": str}))
+        gone = []
+        if self.delta:
+            # POI 整行就是业务主键，没有"变化"，只有增删
+            stored = pd.DataFrame.from_records(
+                list(HotelPOI.objects.values_list("id", *POI_COLUMNS)),
+                columns=["id", *POI_COLUMNS],
+            )
+            merged = df.astype(object).merge(stored.astype(object), on=POI_COLUMNS, how="outer", indicator=True)
+            gone = merged.loc[merged["_merge"] == "right_only", "id"].tolist()
+            unchanged = int((merged["_merge"] == "both").sum())
+            df = merged.loc[merged["_merge"] == "left_only", POI_COLUMNS]
+            self.diff["hotel_poi"] = {
+                "inserted": len(df),
+                "updated": 0,
+                "deleted": len(gone),
+                "unchanged": unchanged,
+            }
+        rows = to_rows(df, POI_COLUMNS)
+        with transaction.atomic():
+            for ids in _chunks(gone, self.batch):
+                HotelPOI.objects.filter(id__in=ids).delete()
+            self._ensure_hotels(df["hotel_id"])
+            # 由于有 uniq_hotel_poiname，重复会冲突，ignore_conflicts=True 刚好去重
+            HotelPOI.objects.bulk_create(
+                [HotelPOI(**dict(zip(POI_COLUMNS, r))) for r in rows],
+                batch_size=self.batch,
+                ignore_conflicts=True,
+            )
+        return len(rows) + len(gone)
+
+    def import_offers(self, path) -> int:
+        if self.delta:
+            return self.import_offers_delta(path)
+
+        if self.fast:
+            writer = fast_writer(HotelRoomOffer, OFFER_COLUMNS, self.batch)
+        else:
+            writer = OrmWriter(HotelRoomOffer, OFFER_COLUMNS, self.batch)
+
+        total = 0
+        with writer:
+            for i, rows in enumerate(self._iter_blocks(parse_offer_block, path), start=1):
+                if rows:
+                    self._ensure_hotels(r[0] for r in rows)
+                    total += writer.write(rows)
+                self.log(f"  block {i}: inserted {len(rows)} (total={total})")
+        return total
+
+    def import_offers_delta(self, path) -> int:
+        """
+        报价增量：库里现有报价按业务主键 (hotel_id, room_type, offer_name) + 第几次出现 算槽位，
+        源文件逐块对齐 —— 没有的插入，row_hash 不同的更新，最后没被对上的删除
+        """
+        stored = pd.DataFrame.from_records(
+            list(HotelRoomOffer.objects.order_by("id").values_list("id", *OFFER_KEY_COLUMNS, "row_hash")),
+            columns=["id", *OFFER_KEY_COLUMNS, "row_hash"],
+        )
+        keys = offer_keys(stored)
+        stored["slot"] = offer_slots(keys, keys.groupby(keys).cumcount())
+        stored = stored.set_index("slot")[["id", "hotel_id", "row_hash"]]
+        stored["seen"] = False
+
+        update_fields = OFFER_COLUMNS[3:]
+        # 每个 key 已经出现过几次（跨块累计）
+        counts = {}
+        diff = {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+
+        with transaction.atomic():
+            for i, df in enumerate(self._iter_blocks(parse_offer_block_delta, path), start=1):
+                prior = df["key"].map(counts).fillna(0).astype("int64")
+                slots = offer_slots(df["key"], prior + df.groupby("key").cumcount())
+                for key, n in df["key"].value_counts().items():
+                    counts[key] = counts.get(key, 0) + n
+
+                hit = slots.isin(stored.index).to_numpy()
+                fresh = df[~hit]
+                matched = df[hit]
+                old = stored.loc[slots[hit]]
+                stored.loc[slots[hit], "seen"] = True
+
+                changed_mask = old["row_hash"].to_numpy() != matched["row_hash"].to_numpy()
+                changed = matched[changed_mask]
+                changed_ids = old["id"].to_numpy()[changed_mask].tolist()
+
+                if len(fresh):
+                    self._ensure_hotels(fresh["hotel_id"])
+                    HotelRoomOffer.objects.bulk_create(
+                        [HotelRoomOffer(**dict(zip(OFFER_COLUMNS, r))) for r in to_rows(fresh, OFFER_COLUMNS)],
+                        batch_size=self.batch,
+                    )
+                if changed_ids:
+                    HotelRoomOffer.objects.bulk_update(
+                        [
+                            HotelRoomOffer(id=pk, **dict(zip(update_fields, r)))
+                            for pk, r in zip(changed_ids, to_rows(changed, update_fields))
+                        ],
+                        update_fields,
+                        batch_size=1000,
+                    )
+
+                self.touched.update(fresh["hotel_id"])
+                self.touched.update(changed["hotel_id"])
+                diff["inserted"] += len(fresh)
+                diff["updated"] += len(changed_ids)
+                diff["unchanged"] += len(matched) - len(changed_ids)
+                self.log(f"  block {i}: +{len(fresh)} ~{len(changed_ids)}")
+
+            gone = stored[~stored["seen"].to_numpy()]
+            self.touched.update(gone["hotel_id"])
+            for ids in _chunks(gone["id"], self.batch):
+                HotelRoomOffer.objects.filter(id__in=ids).delete()
+            diff["deleted"] = len(gone)
+
+        self.diff["hotel_room_offer"] = diff
+        return diff["inserted"] + diff["updated"] + diff["deleted"]
+
+    # ---------- 全流程 ----------
+    def _timed(self, table: str, fn, *args, **kwargs) -> int:
+        t0 = time.perf_counter()
+        n = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - t0
+        rate = n / elapsed if elapsed > 0 else 0
+        self.log(f"  {table}: {n} rows in {elapsed:.2f}s ({rate:,.0f} rows/s)")
+        return n
+
+    def run(self, *, biz_xlsx, sheet, comment_csv, poi_csv, offer_csv, summary_top: int = SUMMARY_TOP_N):
+        t0 = time.perf_counter()
+        mode = "delta" if self.delta else ("fast" if self.fast else "orm")
+
+        if self.swap:
+            # delta 在 shadow 上做：shadow 先复制一份线上数据
+            catalog = catalog_swap(log=self.log, seed=self.delta, min_ratio=self.min_ratio)
+        else:
+            catalog = nullcontext()
+
+        with catalog:
+            self.log("Step 1) Import Hotels from xlsx (base info)")
+            n = self._timed("hotel", self.import_hotels, biz_xlsx, sheet)
+            self.log(f"Hotels imported/updated: {n}")
+
+            self.log("Step 2) Import comment stars (one-to-one)")
+            n = self._timed("hotel_comment_star", self.import_stars, comment_csv)
+            self.log(f"Comment stars imported/updated: {n}")
+
+            self.log("Step 3) Import POIs (one-to-many)")
+            n = self._timed("hotel_poi", self.import_pois, poi_csv)
+            self.log(f"POIs imported: {n} (duplicates ignored)")
+
+            self.log(f"Step 4) Import room offers (large table, workers={self.workers}, mode={mode})")
+            n = self._timed("hotel_room_offer", self.import_offers, offer_csv)
+            self.log(f"Done. Total offers written: {n}")
+
+            self.log("Step 5) Build offer summaries")
+            hotel_ids = self.touched if self.delta else None
+            n = self._timed("hotel_offer_summary", build_offer_summaries, summary_top, hotel_ids=hotel_ids)
+            self.log(f"Offer summaries built: {n}")
+
+            if self.swap:
+                self.log("Step 6) Validate and swap catalog")
+
+        if self.delta:
+            self.log("Diff summary:")
+            for table, d in self.diff.items():
+                self.log(
+                    f"  {table}: +{d['inserted']} inserted, ~{d['updated']} updated, "
+                    f"-{d['deleted']} deleted, ={d['unchanged']} unchanged"
+                )
+
+        # 所有表都提交后再 bump 版本号，查询缓存（进程内 + Redis）一起失效
+        bump_catalog_version()
+        self.log(f"Import finished in {time.perf_counter() - t0:.1f}s")
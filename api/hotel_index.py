@@ -0,0 +1,186 @@
+# api/hotel_index.py
+import heapq
+import logging
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .hotel_cache import get_catalog_version
+from .models import Hotel
+
+logger = logging.getLogger(__name__)
+
+# 统一成半角后再折叠的括号
+_BRACKETS = str.maketrans({"【": "(", "】": ")", "〔": "(", "〕": ")", "[": "(", "]": ")", "{": "(", "}": ")"})
+
+
+def normalize_name(name: str) -> str:
+    """
+    酒店名规范化：NFKC（全角转半角）+ 小写 + 去掉空白和标点
+    "全季酒店（呼和浩特市政府东站店）" 和 "全季酒店(呼和浩特市政府东站店)" 得到同一个 key
+    """
+    s = unicodedata.normalize("NFKC", name or "").translate(_BRACKETS).lower()
+    return "".join(ch for ch in s if unicodedata.category(ch)[0] not in ("P", "S", "Z", "C"))
+
+
+def _grams(key: str, n: int = 2) -> frozenset:
+    if len(key) <= n:
+        return frozenset([key]) if key else frozenset()
+    return frozenset(key[i:i + n] for i in range(len(key) - n + 1))
+
+
+class HotelNameIndex:
+    """
+    内存酒店名索引：规范化 key 精确表 + 字符 bigram 倒排
+    lookup 返回按相似度（Dice 系数）排序的 top-k
+    """
+
+    # 出现在超过这个比例酒店里的 gram（"酒店"、"全季" 这种）不参与召回，只参与打分
+    MAX_DF_RATIO = 0.05
+    # 召回只用最稀有的几个 gram，倒排表越短越快
+    MAX_RECALL_GRAMS = 6
+    # 召回后最多精排多少个候选
+    MAX_CANDIDATES = 64
+    # query 的 gram 全是高频 gram 时，最短的倒排表最多扫这么多个酒店
+    MAX_SCAN = 4096
+
+    def __init__(self, rows, version=None):
+        # 建索引时的 catalog version：结果缓存的 key 要带它（索引可能比当前 version 旧一会儿）
+        self.version = version
+        self.hotel_ids = []
+        self.names = []
+        self.grams = []
+        self.keys = []
+        self.exact = {}
+        postings = defaultdict(list)
+
+        # rows 按 hotel_id 排好序：同名时保留 hotel_id 最小的，和精确查询语义一致
+        for hotel_id, name in rows:
+            key = normalize_name(name)
+            if not key:
+                continue
+            doc = len(self.hotel_ids)
+            grams = _grams(key)
+            self.hotel_ids.append(hotel_id)
+            self.names.append(name)
+            self.keys.append(key)
+            self.grams.append(grams)
+            self.exact.setdefault(key, doc)
+            for g in grams:
+                postings[g].append(doc)
+
+        self.postings = {g: tuple(docs) for g, docs in postings.items()}
+        self.max_df = max(50, int(len(self.hotel_ids) * self.MAX_DF_RATIO))
+        # 按 key 排序：高频 gram 兜底时按前缀二分查
+        order = sorted(range(len(self.keys)), key=self.keys.__getitem__)
+        self.sorted_keys = [self.keys[doc] for doc in order]
+        self.sorted_docs = order
+
+    def __len__(self):
+        return len(self.hotel_ids)
+
+    def lookup(self, query: str, k: int = 5, min_score: float = 0.0) -> list:
+        """
+        返回 [(score, hotel_id, name), ...]，score 在 0~1，越大越像
+        """
+        key = normalize_name(query)
+        if not key:
+            return []
+
+        results = {}
+        doc = self.exact.get(key)
+        if doc is not None:
+            results[doc] = 1.0
+            if k == 1:
+                return [(1.0, self.hotel_ids[doc], self.names[doc])]
+
+        q = _grams(key)
+        lists = sorted((self.postings[g] for g in q if g in self.postings), key=len)
+        rare = [docs for docs in lists if len(docs) <= self.max_df][:self.MAX_RECALL_GRAMS]
+        if rare:
+            counter = Counter()
+            for docs in rare:
+                counter.update(docs)
+            candidates = [doc for doc, _ in heapq.nlargest(self.MAX_CANDIDATES, counter.items(), key=lambda kv: kv[1])]
+        else:
+            candidates = self._common_candidates(key, q, lists)
+
+        qlen = len(q)
+        for doc in candidates:
+            if doc in results:
+                continue
+            dg = self.grams[doc]
+            score = 2.0 * len(q & dg) / (qlen + len(dg))
+            # 前缀命中（LLM 常把分店名写短）稍微加一点分，但不超过精确匹配
+            if self.keys[doc].startswith(key):
+                score = min(0.99, score + 0.1)
+            if score >= min_score:
+                results[doc] = score
+
+        top = heapq.nlargest(k, results.items(), key=lambda kv: (kv[1], -kv[0]))
+        return [(round(score, 4), self.hotel_ids[doc], self.names[doc]) for doc, score in top]
+
+    def _common_candidates(self, key: str, q: frozenset, lists: list) -> list:
+        """
+        query 的 gram 全是高频的（"全季酒店" 这种）：倒排表都很长，不整条拿来召回
+        先按前缀二分找；不够再在最短的倒排表里扫最多 MAX_SCAN 个，按 gram 重合数取前几个
+        """
+        docs = []
+        i = bisect_left(self.sorted_keys, key)
+        while i < len(self.sorted_keys) and len(docs) < self.MAX_CANDIDATES and self.sorted_keys[i].startswith(key):
+            docs.append(self.sorted_docs[i])
+            i += 1
+        if len(docs) < self.MAX_CANDIDATES and lists:
+            seen = set(docs)
+            scored = ((len(q & self.grams[doc]), -doc) for doc in islice(lists[0], self.MAX_SCAN) if doc not in seen)
+            docs += [-doc for _, doc in heapq.nlargest(self.MAX_CANDIDATES - len(docs), scored)]
+        return docs
+
+
+_index = None
+_index_version = None
+_index_checked_at = 0.0
+_index_lock = threading.Lock()
+
+
+def get_name_index() -> HotelNameIndex:
+    """
+    每个 worker 一份；catalog version 变了就重建（最多每 HOTEL_INDEX_REFRESH_SECONDS 秒检查一次）
+    """
+    global _index, _index_version, _index_checked_at
+
+    now = time.monotonic()
+    if _index is not None and now - _index_checked_at < settings.HOTEL_INDEX_REFRESH_SECONDS:
+        return _index
+
+    with _index_lock:
+        if _index is not None and now - _index_checked_at < settings.HOTEL_INDEX_REFRESH_SECONDS:
+            return _index
+        try:
+            version = get_catalog_version()
+        except Exception:
+            version = _index_version
+        if _index is None or version != _index_version:
+            rows = Hotel.objects.exclude(name__isnull=True).order_by("hotel_id").values_list("hotel_id", "name")
+            _index = HotelNameIndex(rows.iterator(), version=version)
+            _index_version = version
+        _index_checked_at = now
+        return _index
+
+
+async def warm_name_index():
+    """
+    ASGI lifespan startup 时建好索引：每个 worker 的第一条模糊查询不用等建索引
+    """
+    try:
+        index = await sync_to_async(get_name_index)()
+    except Exception:
+        logger.exception("hotel name index warmup failed")
+        return
+    logger.info("hotel name index warmed: %d hotels (catalog version %s)", len(index), index.version)
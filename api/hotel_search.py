@@ -0,0 +1,160 @@
+# api/hotel_search.py
+from django.db.models import F, Min, Window
+from django.db.models.functions import RowNumber
+
+from .hotel_cache import hotel_search_cache
+from .hotel_index import get_name_index, normalize_name
+from .models import Hotel, HotelOfferSummary, HotelRoomOffer
+from .offer_summary import SUMMARY_TOP_N
+
+# 每个酒店最多返回多少条报价（按价格从低到高）
+OFFERS_PER_HOTEL = SUMMARY_TOP_N
+
+
+def _to_float(v):
+    return float(v) if v else None
+
+
+def _offer_dict(room_type, offer_name, origin, price, breakfast) -> dict:
+    return {
+        "room_type": room_type,
+        "offer_name": offer_name,
+        "origin_price": _to_float(origin),
+        "offer_price": _to_float(price),
+        "breakfast_policy": breakfast,
+    }
+
+
+def _load_from_summary(hotel_ids) -> dict:
+    """
+    读 hotel_offer_summary：一条主键 IN 查询，和 offer 表大小无关
+    返回 {hotel_id: (min_price, offers)}
+    """
+    return {
+        s.hotel_id: (s.min_price, [_offer_dict(*o) for o in s.top_offers])
+        for s in HotelOfferSummary.objects.filter(pk__in=hotel_ids).only("hotel_id", "min_price", "top_offers")
+    }
+
+
+def _load_from_offers(hotel_ids) -> dict:
+    """
+    汇总表还没建（或缺行）时回源 offer 表
+    一条窗口函数 SQL：每个酒店按价格取前 N 条报价，同时带出该酒店最低价
+    """
+    rows = (
+        HotelRoomOffer.objects.filter(hotel_id__in=hotel_ids)
+        .annotate(
+            rn=Window(
+                RowNumber(),
+                partition_by=[F("hotel_id")],
+                order_by=[F("room_offer_price").asc(nulls_last=True), F("id").asc()],
+            ),
+            min_price=Window(Min("room_offer_price"), partition_by=[F("hotel_id")]),
+        )
+        .filter(rn__lte=OFFERS_PER_HOTEL)
+        .order_by("hotel_id", "rn")
+        .values_list(
+            "hotel_id",
+            "min_price",
+            "room_type",
+            "offer_name",
+            "room_price_origin",
+            "room_offer_price",
+            "offer_breakfast_policy",
+        )
+    )
+
+    result = {}
+    for hid, min_price, *offer in rows:
+        result.setdefault(hid, (min_price, []))[1].append(_offer_dict(*offer))
+    return result
+
+
+def fetch_hotels(hotels) -> dict:
+    """
+    批量组装酒店结果：优先读汇总表，缺的再回源 offer 表
+    返回 {hotel_id: {...}}
+    """
+    hotels = list(hotels)
+    if not hotels:
+        return {}
+
+    # hotel_id 导入时已统一成 canonical 格式，offer/汇总表直接按 hotel_id 等值查
+    hotel_ids = {h.hotel_id for h in hotels}
+    offers = _load_from_summary(hotel_ids)
+    missing = hotel_ids - offers.keys()
+    if missing:
+        offers.update(_load_from_offers(missing))
+
+    result = {}
+    for hotel in hotels:
+        min_price, hotel_offers = offers.get(hotel.hotel_id, (None, []))
+        result[hotel.hotel_id] = {
+            "hotel_id": hotel.hotel_id,
+            "name": hotel.name,
+            "brand": hotel.brand,
+            "business_area": hotel.business_area,
+            "min_offer_price": _to_float(min_price),
+            "offers": hotel_offers,
+        }
+    return result
+
+
+def _load_by_names(names) -> dict:
+    """
+    name__in 一次查出所有酒店，再批量组装结果
+    返回 {name: payload}，查不到的名字不在结果里
+    """
+    # 同名酒店保持原来 .first() 的语义：取 hotel_id 最小的那个
+    by_name = {}
+    for hotel in Hotel.objects.filter(name__in=set(names)).order_by("hotel_id"):
+        by_name.setdefault(hotel.name, hotel)
+
+    payloads = fetch_hotels(by_name.values())
+    return {n: payloads[h.hotel_id] for n, h in by_name.items()}
+
+
+def search_hotels(hotel_names, use_cache: bool = True) -> list:
+    """
+    按酒店名精确查询（批量版）
+    先走两级缓存；缓存没命中的才回源，固定 2 条 SQL：name__in 查酒店 + 窗口函数查报价
+    """
+    names = [hotel_search_cache.normalize(n) for n in hotel_names]
+    if use_cache:
+        found = hotel_search_cache.get_or_load(names, _load_by_names)
+    else:
+        found = _load_by_names(names)
+    return [found[n] for n in names if found.get(n)]
+
+
+def search_hotels_fuzzy(hotel_names, top_k: int = 1, min_score: float = 0.5, use_cache: bool = True) -> list:
+    """
+    模糊查询：内存 bigram 索引召回 top-k，再按 hotel_id 批量组装
+    每条结果额外带 query（原始入参）和 match_score（0~1）
+    """
+    queries = [n.strip() for n in hotel_names]
+    index = get_name_index()
+    # 缓存 key 带上 top_k/min_score，和精确查询的 key 不会撞；
+    # 再带上索引自己的 version：catalog 刚 bump、本 worker 的索引还没重建时，旧索引的结果不会写进新 version 的缓存
+    keys = {q: f"fuzzy:{top_k}:{min_score}:{index.version}:{normalize_name(q)}" for q in queries}
+    names = {key: normalize_name(q) for q, key in keys.items()}
+
+    def load(missing_keys) -> dict:
+        matches = {key: index.lookup(names[key], k=top_k, min_score=min_score) for key in missing_keys}
+        ids = {hid for found in matches.values() for _, hid, _ in found}
+        payloads = fetch_hotels(Hotel.objects.filter(hotel_id__in=ids)) if ids else {}
+        return {
+            key: [(score, payloads[hid]) for score, hid, _ in found if hid in payloads]
+            for key, found in matches.items()
+        }
+
+    if use_cache:
+        found = hotel_search_cache.get_or_load(keys.values(), load)
+    else:
+        found = load(set(keys.values()))
+
+    result = []
+    for q in queries:
+        for score, payload in found.get(keys[q]) or []:
+            result.append({**payload, "query": q, "match_score": score})
+    return result
@@ -0,0 +1,151 @@
+# api/hotel_writers.py
+"""
+导入引擎的写库方式（按表）：
+  OrmWriter          默认：bulk_create，追加写
+  ExecutemanyWriter  --fast（SQLite 等）：清空后 cursor.executemany 直写
+  LoadDataWriter     --fast（MySQL）：TSV -> LOAD DATA LOCAL INFILE 进 staging 表，成功后 RENAME 换上线
+用法：
+    with writer:
+        writer.write(rows)   # rows: [tuple, ...]，列顺序 = columns
+"""
+import os
+import tempfile
+
+from django.db import connection, transaction
+
+from .catalog_swap import add_foreign_keys
+
+# LoadDataWriter 换表时线上表临时改的名字；不能用 catalog_swap 的 __old（那是留给 rollback_catalog 的上一版目录）
+LOAD_OLD_SUFFIX = "__ldtmp"
+
+
+def _qn(name: str) -> str:
+    return connection.ops.quote_name(name)
+
+
+class OrmWriter:
+    def __init__(self, model, columns, batch: int = 5000):
+        self.model = model
+        self.columns = columns
+        self.batch = batch
+        self._atomic = transaction.atomic()
+
+    def __enter__(self):
+        self._atomic.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._atomic.__exit__(*exc)
+
+    def write(self, rows) -> int:
+        self.model.objects.bulk_create(
+            [self.model(**dict(zip(self.columns, r))) for r in rows],
+            batch_size=self.batch,
+        )
+        return len(rows)
+
+
+class ExecutemanyWriter(OrmWriter):
+    """
+    跳过 ORM 实例化，整表替换：进事务先清空，再 executemany 直写
+    """
+
+    def __enter__(self):
+        super().__enter__()
+        table = self.model._meta.db_table
+        cols = [self.model._meta.get_field(c).column for c in self.columns]
+        self._sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            _qn(table), ", ".join(_qn(c) for c in cols), ", ".join(["%s"] * len(cols))
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {_qn(table)}")
+        return self
+
+    def write(self, rows) -> int:
+        with connection.cursor() as cursor:
+            for i in range(0, len(rows), self.batch):
+                cursor.executemany(self._sql, rows[i:i + self.batch])
+        return len(rows)
+
+
+def _tsv_value(v) -> str:
+    if v is None:
+        return "\\N"
+    if isinstance(v, str):
+        return v.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+    return str(v)
+
+
+def _infile_connection():
+    """
+    LOAD DATA LOCAL INFILE 专用连接：导入时现开、用完就关，autocommit
+    默认连接（web / ASGI 共用）不开 local_infile：服务端不可信时客户端的本地文件读不到
+    """
+    params = connection.get_connection_params()
+    params["local_infile"] = 1
+    raw = connection.get_new_connection(params)
+    raw.autocommit(True)
+    return raw
+
+
+class LoadDataWriter(OrmWriter):
+    """
+    MySQL 专用：写进 {table}__staging（CREATE TABLE ... LIKE，索引一起带过来），
+    全部成功后一条 RENAME TABLE 原子换表，失败就丢掉 staging，线上表不受影响
+    LIKE 不复制外键：建完 staging 按 model 补上（到 hotel 的约束和迁移一致）
+    LOAD DATA 走单独开的一条 local_infile=1 连接（见 _infile_connection），需要服务端开启 local_infile
+    """
+
+    def __enter__(self):
+        self.table = self.model._meta.db_table
+        self.staging = f"{self.table}__staging"
+        self.old = f"{self.table}{LOAD_OLD_SUFFIX}"
+        self._cols = ", ".join(_qn(self.model._meta.get_field(c).column) for c in self.columns)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {_qn(self.staging)}")
+            cursor.execute(f"CREATE TABLE {_qn(self.staging)} LIKE {_qn(self.table)}")
+        add_foreign_keys(self.model, self.staging)
+        self._infile = None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._infile is not None:
+            self._infile.close()
+            self._infile = None
+        with connection.cursor() as cursor:
+            if exc_type is None:
+                cursor.execute(f"DROP TABLE IF EXISTS {_qn(self.old)}")
+                cursor.execute(
+                    f"RENAME TABLE {_qn(self.table)} TO {_qn(self.old)}, {_qn(self.staging)} TO {_qn(self.table)}"
+                )
+                cursor.execute(f"DROP TABLE {_qn(self.old)}")
+            else:
+                cursor.execute(f"DROP TABLE IF EXISTS {_qn(self.staging)}")
+        return False
+
+    def write(self, rows) -> int:
+        if not rows:
+            return 0
+        fd, path = tempfile.mkstemp(suffix=".tsv")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8", newline="\n") as f:
+                for r in rows:
+                    f.write("\t".join(_tsv_value(v) for v in r))
+                    f.write("\n")
+            if self._infile is None:
+                self._infile = _infile_connection()
+            with self._infile.cursor() as cursor:
+                cursor.execute(
+                    f"LOAD DATA LOCAL INFILE %s INTO TABLE {_qn(self.staging)} CHARACTER SET utf8mb4 "
+                    f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({self._cols})",
+                    [path.replace("\\", "/")],
+                )
+        finally:
+            os.remove(path)
+        return len(rows)
+
+
+def fast_writer(model, columns, batch: int = 5000):
+    if connection.vendor == "mysql":
+        return LoadDataWriter(model, columns, batch)
+    return ExecutemanyWriter(model, columns, batch)
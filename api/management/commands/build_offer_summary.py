@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api.hotel_cache import bump_catalog_version
+from api.offer_summary import SUMMARY_TOP_N, build_offer_summaries
+
+
+class Command(BaseCommand):
+    help = "Rebuild hotel_offer_summary from hotel_room_offer (import_hotels runs this as its last step)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=SUMMARY_TOP_N)
+        parser.add_argument("--batch", type=int, default=2000)
+
+    def handle(self, *args, **opts):
+        total = build_offer_summaries(top_n=int(opts["top"]), batch=int(opts["batch"]))
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f"Offer summaries built: {total}"))
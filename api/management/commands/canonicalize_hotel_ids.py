@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.hotel_cache import bump_catalog_version
+from api.models import Hotel, HotelCommentStar, HotelOfferSummary, HotelPOI, HotelRoomOffer
+from api.offer_summary import build_offer_summaries
+from api.utils.hotel_id import canonical_hotel_id
+
+
+class Command(BaseCommand):
+    help = (
+        "One-off migration: rewrite existing hotel ids to the canonical form used by import_hotels "
+        "(no leading zeros), merging duplicated hotel rows and re-pointing stars/POIs/offers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        dry_run = opts["dry_run"]
+
+        mapping = {}
+        for hid in Hotel.objects.values_list("hotel_id", flat=True).iterator(chunk_size=10000):
+            new = canonical_hotel_id(hid)
+            if new and new != hid:
+                mapping[hid] = new
+
+        self.stdout.write(self.style.SUCCESS(f"Non-canonical hotel ids: {len(mapping)}"))
+        if dry_run or not mapping:
+            return
+
+        merged = created = 0
+        for old, new in mapping.items():
+            with transaction.atomic():
+                src = Hotel.objects.select_for_update().get(hotel_id=old)
+                dst = Hotel.objects.select_for_update().filter(hotel_id=new).first()
+                if dst is None:
+                    dst = Hotel.objects.create(
+                        hotel_id=new,
+                        name=src.name,
+                        brand=src.brand,
+                        business_area=src.business_area,
+                    )
+                    created += 1
+                else:
+                    # 之前 offer 导入时补的占位酒店没有名字：用 xlsx 那行的基础信息补齐
+                    changed = []
+                    for field in ("name", "brand", "business_area"):
+                        if getattr(dst, field) is None and getattr(src, field) is not None:
+                            setattr(dst, field, getattr(src, field))
+                            changed.append(field)
+                    if changed:
+                        dst.save(update_fields=changed)
+                    merged += 1
+
+                HotelRoomOffer.objects.filter(hotel_id=old).update(hotel_id=new)
+
+                # POI 有 (hotel, poiname) 唯一约束：目标已有的先删掉
+                dup = HotelPOI.objects.filter(hotel_id=new).values_list("poiname", flat=True)
+                HotelPOI.objects.filter(hotel_id=old, poiname__in=list(dup)).delete()
+                HotelPOI.objects.filter(hotel_id=old).update(hotel_id=new)
+
+                if HotelCommentStar.objects.filter(hotel_id=new).exists():
+                    HotelCommentStar.objects.filter(hotel_id=old).delete()
+                else:
+                    HotelCommentStar.objects.filter(hotel_id=old).update(hotel_id=new)
+
+                HotelOfferSummary.objects.filter(hotel_id=old).delete()
+                src.delete()
+
+        self.stdout.write(self.style.SUCCESS(f"Hotels re-keyed: {created} created, {merged} merged"))
+
+        total = build_offer_summaries()
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f"Offer summaries rebuilt: {total}"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import ApiClient
+from api.utils.api_key import generate_api_key
+
+
+class Command(BaseCommand):
+    help = "Create an ApiClient (or rotate the key of an existing one) and print the new key once; only its hash is stored."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--name", type=str)
+        parser.add_argument("--rotate", type=int, help="ApiClient id to issue a new key for")
+
+    def handle(self, *args, **opts):
+        if opts["rotate"]:
+            client = ApiClient.objects.filter(pk=opts["rotate"]).first()
+            if client is None:
+                raise CommandError(f"ApiClient {opts['rotate']} not found")
+        elif opts["name"]:
+            client = ApiClient(name=opts["name"])
+        else:
+            raise CommandError("--name or --rotate is required")
+
+        key = generate_api_key()
+        client.set_key(key)
+        client.save()
+        self.stdout.write(self.style.SUCCESS(f"ApiClient {client.id} ({client.name}): {key}"))
+        self.stdout.write("Store this key now, it cannot be shown again.")
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from api.retention import run_retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Monthly retention for usage_record and AdpChatSession: pre-create future MySQL partitions and "
+        "drop (or --archive) partitions past USAGE_RETENTION_MONTHS / CHAT_RETENTION_MONTHS. "
+        "On SQLite (dev only, best effort: rows are copied and deleted month by month) rotates the table into "
+        "{table}__archYYYYMM and drops expired archives. "
+        "Also prunes usage_rollup minute buckets past USAGE_ROLLUP_MINUTE_RETENTION_DAYS. Run daily from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--archive", action="store_true", help="MySQL: exchange expired partitions into archive tables before dropping")
+        parser.add_argument("--ahead", type=int, default=3, help="MySQL: how many future monthly partitions to keep ready")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        run_retention(
+            log=lambda msg: self.stdout.write(self.style.SUCCESS(msg)),
+            archive=opts["archive"],
+            ahead=int(opts["ahead"]),
+            dry_run=opts["dry_run"],
+        )
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.catalog_swap import CatalogValidationError, rollback_catalog
+from api.hotel_cache import bump_catalog_version
+
+
+class Command(BaseCommand):
+    help = "Swap the previous hotel catalog (*__old tables left by import_hotels) back in. Run again to undo."
+
+    def handle(self, *args, **opts):
+        try:
+            rollback_catalog()
+        except CatalogValidationError as e:
+            raise CommandError(str(e))
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS("Catalog rolled back to the previous import"))
@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.usage_rollup import rebuild_horizon, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute usage_rollup from usage_record for the last N hours (backfill / repair). "
+        "Normal traffic is rolled up incrementally by the usage sink."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=24)
+        parser.add_argument("--batch", type=int, default=20000)
+
+    def handle(self, *args, **opts):
+        until = timezone.now()
+        since = until - timedelta(hours=int(opts["hours"]))
+        total = rebuild_rollups(since, until, batch=int(opts["batch"]))
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {total} usage records from {since:%Y-%m-%d %H:00} to {rebuild_horizon():%Y-%m-%d %H:00} "
+            f"(newer buckets are maintained by the usage sink)"
+        ))
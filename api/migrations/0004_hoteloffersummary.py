@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_remove_apiclient_user_adpchatsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotelOfferSummary',
+            fields=[
+                ('hotel', models.OneToOneField(db_column='hotel_id', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='offer_summary', serialize=False, to='api.hotel')),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True, verbose_name='最低优惠价')),
+                ('max_price', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True, verbose_name='最高优惠价')),
+                ('offer_count', models.IntegerField(default=0, verbose_name='报价数')),
+                ('has_breakfast', models.BooleanField(default=False, verbose_name='是否有含早报价')),
+                ('top_offers', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'hotel_offer_summary',
+            },
+        ),
+    ]
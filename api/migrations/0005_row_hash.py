@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_hoteloffersummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hotel',
+            name='row_hash',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='hotelcommentstar',
+            name='row_hash',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='hotelroomoffer',
+            name='row_hash',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+    ]
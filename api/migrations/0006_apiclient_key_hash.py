@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+def hash_existing_keys(apps, schema_editor):
+    from api.utils.api_key import hash_api_key, key_prefix
+
+    ApiClient = apps.get_model("api", "ApiClient")
+    for client in ApiClient.objects.all():
+        client.key_prefix = key_prefix(client.api_key)
+        client.key_hash = hash_api_key(client.api_key)
+        client.save(update_fields=["key_prefix", "key_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_row_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apiclient',
+            name='key_prefix',
+            field=models.CharField(db_index=True, default='', max_length=16),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='apiclient',
+            name='key_hash',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        # 明文 key 不可逆地换成 hash，回滚不了
+        migrations.RunPython(hash_existing_keys, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='apiclient',
+            name='api_key',
+        ),
+        migrations.AlterField(
+            model_name='apiclient',
+            name='key_hash',
+            field=models.CharField(max_length=64, unique=True),
+        ),
+    ]
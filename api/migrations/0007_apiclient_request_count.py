@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_apiclient_key_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apiclient',
+            name='request_count',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
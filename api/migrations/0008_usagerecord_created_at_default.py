@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_apiclient_request_count'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='usagerecord',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_usagerecord_created_at_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usagerecord',
+            name='app',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='usagerecord',
+            name='cost_cents',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=14),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_usagerecord_app_cost'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('m', 'minute'), ('h', 'hour')], max_length=1)),
+                ('bucket_start', models.DateTimeField()),
+                ('client_id', models.CharField(max_length=64)),
+                ('endpoint', models.CharField(max_length=64)),
+                ('success', models.BooleanField(default=True)),
+                ('count', models.IntegerField(default=0)),
+                ('latency_sum_ms', models.BigIntegerField(default=0)),
+                ('latency_max_ms', models.IntegerField(default=0)),
+                ('latency_hist', models.JSONField(default=list)),
+                ('tool_calls', models.IntegerField(default=0)),
+                ('llm_in_tokens', models.BigIntegerField(default=0)),
+                ('llm_out_tokens', models.BigIntegerField(default=0)),
+                ('cost_cents', models.DecimalField(decimal_places=4, default=0, max_digits=16)),
+            ],
+            options={
+                'db_table': 'usage_rollup',
+                'indexes': [models.Index(fields=['client_id', 'granularity', 'bucket_start'], name='idx_rollup_client_time')],
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'bucket_start', 'client_id', 'endpoint', 'success'), name='uniq_usage_rollup_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:09
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def _add_months(d, n):
+    m = d.year * 12 + d.month - 1 + n
+    return datetime.date(m // 12, m % 12 + 1, 1)
+
+
+def partition_by_month(apps, schema_editor):
+    """
+    MySQL：usage_record / AdpChatSession 改成按 TO_DAYS(created_at) 的月分区（一次性重建表）
+    主键换成 (id, created_at)（分区表的唯一键必须包含分区列）；其它库什么都不做
+
+    停机说明：这两条 ALTER 都是 COPY 算法整表重建，重建期间表只读（写入会等锁），耗时和表大小成正比
+    表大的话别在高峰直接 migrate：维护窗口里跑，或者先用 pt-online-schema-change / gh-ost 把同样的
+    主键、分区改好（usage_record.session 的外键约束一并去掉），再 `manage.py migrate api 0011 --fake` 标记已执行
+    """
+    if schema_editor.connection.vendor != "mysql":
+        return
+    qn = schema_editor.quote_name
+    today = datetime.date.today()
+    for model_name in ("UsageRecord", "AdpChatSession"):
+        model = apps.get_model("api", model_name)
+        table = model._meta.db_table
+        oldest = model.objects.order_by("created_at").values_list("created_at", flat=True).first()
+        first = datetime.date(oldest.year, oldest.month, 1) if oldest else datetime.date(today.year, today.month, 1)
+        last = _add_months(datetime.date(today.year, today.month, 1), 3)
+        parts = []
+        m = first
+        while m <= last:
+            parts.append(f"PARTITION p{m:%Y%m} VALUES LESS THAN (TO_DAYS('{_add_months(m, 1):%Y-%m-%d}'))")
+            m = _add_months(m, 1)
+        parts.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+        schema_editor.execute(f"ALTER TABLE {qn(table)} DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `created_at`)")
+        schema_editor.execute(f"ALTER TABLE {qn(table)} PARTITION BY RANGE (TO_DAYS(`created_at`)) ({', '.join(parts)})")
+
+
+def unpartition(apps, schema_editor):
+    if schema_editor.connection.vendor != "mysql":
+        return
+    qn = schema_editor.quote_name
+    for model_name in ("UsageRecord", "AdpChatSession"):
+        table = apps.get_model("api", model_name)._meta.db_table
+        schema_editor.execute(f"ALTER TABLE {qn(table)} REMOVE PARTITIONING")
+        schema_editor.execute(f"ALTER TABLE {qn(table)} DROP PRIMARY KEY, ADD PRIMARY KEY (`id`)")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_usagerollup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='usagerecord',
+            name='session',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.conversationsession'),
+        ),
+        migrations.RunPython(partition_by_month, unpartition),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:20
+
+from django.db import migrations
+
+
+def trim_short_key_prefixes(apps, schema_editor):
+    """
+    0006 按 key[:12] 取 prefix：不超过 12 位的老 key 整个存进了 key_prefix
+    prefix 本身就能算出 key_hash 的，说明它就是完整 key：按新规则截成一半
+    """
+    from api.utils.api_key import hash_api_key, key_prefix
+
+    ApiClient = apps.get_model("api", "ApiClient")
+    for client in ApiClient.objects.all():
+        if hash_api_key(client.key_prefix) == client.key_hash:
+            client.key_prefix = key_prefix(client.key_prefix)
+            client.save(update_fields=["key_prefix"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_usage_retention_partitions'),
+    ]
+
+    operations = [
+        migrations.RunPython(trim_short_key_prefixes, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class Hotel(models.Model):
@@ -8,6 +9,8 @@ class Hotel(models.Model):
     name = models.CharField("酒店名称", max_length=255, null=True, blank=True)
     brand = models.CharField("品牌", max_length=100, null=True, blank=True)
     business_area = models.CharField("商业区", max_length=255, null=True, blank=True)
+    # 源数据行内容哈希（import_hotels --delta 用来判断是否变化）
+    row_hash = models.CharField(max_length=16, blank=True, default="")
 
     class Meta:
         db_table = "hotel"
@@ -35,6 +38,7 @@ class HotelCommentStar(models.Model):
         null=True,
         blank=True,
     )
+    row_hash = models.CharField(max_length=16, blank=True, default="")
 
     class Meta:
         db_table = "hotel_comment_star"
@@ -78,6 +82,8 @@ class HotelRoomOffer(models.Model):
 
     offer_discount_text = models.CharField("折扣文案", max_length=255, null=True, blank=True)
     offer_breakfast_policy = models.CharField("早餐政策", max_length=255, null=True, blank=True)
+    # 业务主键 (hotel, room_type, offer_name) 之外的内容哈希，--delta 只改哈希变了的行
+    row_hash = models.CharField(max_length=16, blank=True, default="")
 
     class Meta:
         db_table = "hotel_room_offer"
@@ -89,6 +95,29 @@ class HotelRoomOffer(models.Model):
         ]
 
 
+class HotelOfferSummary(models.Model):
+    """
+    每个酒店的报价汇总（import_hotels 最后一步生成），查询时按主键直接读，不再扫 offer 表
+    """
+    hotel = models.OneToOneField(
+        Hotel,
+        db_column="hotel_id",
+        on_delete=models.CASCADE,
+        related_name="offer_summary",
+        primary_key=True,
+    )
+    min_price = models.DecimalField("最低优惠价", max_digits=12, decimal_places=2, null=True, blank=True)
+    max_price = models.DecimalField("最高优惠价", max_digits=12, decimal_places=2, null=True, blank=True)
+    offer_count = models.IntegerField("报价数", default=0)
+    has_breakfast = models.BooleanField("是否有含早报价", default=False)
+    # 最便宜的 N 条报价，紧凑格式：[[room_type, offer_name, origin_price, offer_price, breakfast_policy], ...]
+    top_offers = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "hotel_offer_summary"
+
+
 # =========================================================
 # models.py
 from django.db import models
@@ -114,45 +143,98 @@ class Message(models.Model):
         db_table = "conversation_message"
 
 class UsageRecord(models.Model):
+    # MySQL 上 usage_record 按月分区（api/retention.py），分区表不能有外键：只保留 Django 层的关联
     session = models.ForeignKey(
         ConversationSession,
         on_delete=models.SET_NULL,
         null=True,
         blank=True,
+        db_constraint=False,
     )
     client_id = models.CharField(max_length=64)
 
     endpoint = models.CharField(max_length=64)      # chat_stream / hotel_search / tool_exec
+    app = models.CharField(max_length=32, blank=True, default="")  # ADP 应用："s" / "d"
     success = models.BooleanField(default=True)
     latency_ms = models.IntegerField(default=0)
     tool_calls = models.IntegerField(default=0)
 
     llm_in_tokens = models.IntegerField(default=0)
     llm_out_tokens = models.IntegerField(default=0)
-    cost_cents = models.IntegerField(default=0)
+    # 按 settings.ADP_PRICE_TABLE 算的费用（分）；单次对话常常不到 1 分，保留 4 位小数
+    cost_cents = models.DecimalField(max_digits=14, decimal_places=4, default=0)
 
-    created_at = models.DateTimeField(auto_now_add=True)
+    # 不用 auto_now_add：记录是攒批写的，时间取 commit() 那一刻
+    created_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         db_table = "usage_record"
 
 
+class UsageRollup(models.Model):
+    """
+    usage_record 的预聚合（api/usage_rollup.py 维护），统计接口只读这张表
+    一行 = (粒度, 时间桶, client_id, endpoint, success)
+    """
+    MINUTE = "m"
+    HOUR = "h"
+    GRANULARITY_CHOICES = [(MINUTE, "minute"), (HOUR, "hour")]
+
+    granularity = models.CharField(max_length=1, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    client_id = models.CharField(max_length=64)
+    endpoint = models.CharField(max_length=64)
+    success = models.BooleanField(default=True)
+
+    count = models.IntegerField(default=0)
+    latency_sum_ms = models.BigIntegerField(default=0)
+    latency_max_ms = models.IntegerField(default=0)
+    # 固定对数分桶的计数，边界见 usage_rollup.LATENCY_BUCKETS_MS
+    latency_hist = models.JSONField(default=list)
+    tool_calls = models.IntegerField(default=0)
+    llm_in_tokens = models.BigIntegerField(default=0)
+    llm_out_tokens = models.BigIntegerField(default=0)
+    cost_cents = models.DecimalField(max_digits=16, decimal_places=4, default=0)
+
+    class Meta:
+        db_table = "usage_rollup"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["granularity", "bucket_start", "client_id", "endpoint", "success"],
+                name="uniq_usage_rollup_bucket",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["client_id", "granularity", "bucket_start"], name="idx_rollup_client_time"),
+        ]
+
+
 # models.py 里追加
 from django.conf import settings
 from django.db import models
 
 class ApiClient(models.Model):
     name = models.CharField(max_length=64)
-    api_key = models.CharField(max_length=128, unique=True, db_index=True)
+    # 不存明文 key：prefix 用来定位，hash = HMAC-SHA256(pepper, key)，见 api/utils/api_key.py
+    key_prefix = models.CharField(max_length=16, db_index=True)
+    key_hash = models.CharField(max_length=64, unique=True)
     is_active = models.BooleanField(default=True)
     # user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
 
     created_at = models.DateTimeField(auto_now_add=True)
     last_seen_at = models.DateTimeField(null=True, blank=True)
+    # last_seen_at / request_count 由 api/activity.py 攒批写回，不是每个请求都写
+    request_count = models.PositiveBigIntegerField(default=0)
 
     class Meta:
         db_table = "api_client"
 
+    def set_key(self, key: str):
+        from .utils.api_key import hash_api_key, key_prefix
+
+        self.key_prefix = key_prefix(key)
+        self.key_hash = hash_api_key(key)
+
 from django.db import models
 
 
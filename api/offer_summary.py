@@ -0,0 +1,106 @@
+# api/offer_summary.py
+import itertools
+import re
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import Hotel, HotelOfferSummary, HotelRoomOffer
+
+# 每个酒店存多少条最便宜的报价（和查询接口返回的条数一致）
+SUMMARY_TOP_N = 50
+
+_NO_BREAKFAST_RE = re.compile(r"无早|不含早|无餐|早餐自理")
+# 只认明确的早餐写法：单独一个"早"会把 早鸟 / 早订 这种价格名也算进来
+_BREAKFAST_RE = re.compile(r"含.{0,2}早|[单双三两一二1-9]份?早|早餐|早饭|早点")
+
+
+def has_breakfast(policy) -> bool:
+    if not policy:
+        return False
+    return bool(_BREAKFAST_RE.search(policy)) and not _NO_BREAKFAST_RE.search(policy)
+
+
+def _num(v):
+    return float(v) if v is not None else None
+
+
+def _summarize(hotel_id, rows, top_n: int) -> HotelOfferSummary:
+    # rows 已按价格升序（NULL 在最后）
+    prices = [r[4] for r in rows if r[4] is not None]
+    return HotelOfferSummary(
+        hotel_id=hotel_id,
+        min_price=min(prices) if prices else None,
+        max_price=max(prices) if prices else None,
+        offer_count=len(rows),
+        has_breakfast=any(has_breakfast(r[5]) for r in rows),
+        top_offers=[[r[1], r[2], _num(r[3]), _num(r[4]), r[5]] for r in rows[:top_n]],
+    )
+
+
+def build_offer_summaries(top_n: int = SUMMARY_TOP_N, batch: int = 2000, hotel_ids=None) -> int:
+    """
+    重建 hotel_offer_summary：按 (hotel_id, 价格) 顺序扫一遍 offer 表，按酒店分组汇总
+    没有报价的酒店也写一行 offer_count=0，这样查询时 "没汇总行" 只意味着还没建过
+    hotel_ids 不为空时只重建这些酒店（增量导入用），否则全量
+    """
+    if hotel_ids is None:
+        return _build(top_n, batch, None)
+    ids = sorted(hotel_ids)
+    total = 0
+    for i in range(0, len(ids), batch):
+        total += _build(top_n, batch, ids[i:i + batch])
+    return total
+
+
+def _build(top_n: int, batch: int, hotel_ids) -> int:
+    offers = HotelRoomOffer.objects.all()
+    hotels = Hotel.objects.all()
+    summaries = HotelOfferSummary.objects.all()
+    if hotel_ids is not None:
+        offers = offers.filter(hotel_id__in=hotel_ids)
+        hotels = hotels.filter(hotel_id__in=hotel_ids)
+        summaries = summaries.filter(hotel_id__in=hotel_ids)
+
+    rows = (
+        offers.order_by("hotel_id", F("room_offer_price").asc(nulls_last=True), "id")
+        .values_list(
+            "hotel_id",
+            "room_type",
+            "offer_name",
+            "room_price_origin",
+            "room_offer_price",
+            "offer_breakfast_policy",
+        )
+        .iterator(chunk_size=10000)
+    )
+
+    total = 0
+    seen = set()
+    with transaction.atomic():
+        summaries.delete()
+
+        buf = []
+        for hotel_id, group in itertools.groupby(rows, key=itemgetter(0)):
+            buf.append(_summarize(hotel_id, list(group), top_n))
+            seen.add(hotel_id)
+            if len(buf) >= batch:
+                HotelOfferSummary.objects.bulk_create(buf, batch_size=batch)
+                total += len(buf)
+                buf = []
+
+        for hotel_id in hotels.values_list("hotel_id", flat=True).iterator(chunk_size=10000):
+            if hotel_id in seen:
+                continue
+            buf.append(HotelOfferSummary(hotel_id=hotel_id))
+            if len(buf) >= batch:
+                HotelOfferSummary.objects.bulk_create(buf, batch_size=batch)
+                total += len(buf)
+                buf = []
+
+        if buf:
+            HotelOfferSummary.objects.bulk_create(buf, batch_size=batch)
+            total += len(buf)
+
+    return total
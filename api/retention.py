@@ -0,0 +1,209 @@
+# api/retention.py
+"""
+usage_record / AdpChatSession 的按月保留：
+  MySQL：按 TO_DAYS(created_at) 做月分区（p202610 = 2026-10 的数据），
+         过期数据 DROP PARTITION（或 EXCHANGE 到归档表）都是改元数据，O(1)，不跑大 DELETE
+         分区表的主键必须包含分区列：库里主键是 (id, created_at)，Django 这边仍然把 id 当主键用
+  SQLite（只用于开发环境，尽力而为）：没有分区，改成按月归档表 —— 本月之前的行按月搬进 {table}__arch{YYYYMM}，
+         本月的行留在线上表；过期的归档表直接 DROP
+         搬的时候是逐月 INSERT…SELECT + DELETE，也就是 MySQL 上要避免的大 DELETE；数据量大的库不要用 SQLite 跑
+usage_rollup 的分钟桶按天清（USAGE_ROLLUP_MINUTE_RETENTION_DAYS），小时桶不清
+"""
+import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import AdpChatSession, UsageRecord
+from .usage_rollup import prune_minute_rollups
+
+MAXVALUE_PARTITION = "pmax"
+
+
+def retained_models() -> dict:
+    """
+    {model: 保留月数}
+    """
+    return {
+        UsageRecord: settings.USAGE_RETENTION_MONTHS,
+        AdpChatSession: settings.CHAT_RETENTION_MONTHS,
+    }
+
+
+def _qn(name: str) -> str:
+    return connection.ops.quote_name(name)
+
+
+def month_start(d) -> datetime.date:
+    return datetime.date(d.year, d.month, 1)
+
+
+def add_months(d: datetime.date, n: int) -> datetime.date:
+    m = d.year * 12 + d.month - 1 + n
+    return datetime.date(m // 12, m % 12 + 1, 1)
+
+
+def partition_name(month: datetime.date) -> str:
+    return f"p{month:%Y%m}"
+
+
+def _partition_clause(month: datetime.date) -> str:
+    # 分区 pYYYYMM 存这个月的数据：上界是下个月 1 号
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN (TO_DAYS('{add_months(month, 1):%Y-%m-%d}'))"
+
+
+# ---------------- MySQL ----------------
+def mysql_partitions(table: str) -> list:
+    """
+    [(分区名, 这个分区的月份)]，按月份升序；pmax 不在里面
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+            "ORDER BY PARTITION_ORDINAL_POSITION",
+            [table],
+        )
+        names = [r[0] for r in cursor.fetchall()]
+    out = []
+    for name in names:
+        if name == MAXVALUE_PARTITION:
+            continue
+        out.append((name, datetime.date(int(name[1:5]), int(name[5:7]), 1)))
+    return out
+
+
+def ensure_future_partitions(table: str, ahead: int = 3, dry_run: bool = False) -> list:
+    """
+    从 pmax 里切出未来 ahead 个月的分区（pmax 一般是空的，REORGANIZE 很快）
+    """
+    existing = {m for _, m in mysql_partitions(table)}
+    this_month = month_start(timezone.now())
+    missing = [add_months(this_month, i) for i in range(ahead + 1)]
+    missing = [m for m in missing if m not in existing and (not existing or m > max(existing))]
+    if not missing:
+        return []
+    sql = (
+        f"ALTER TABLE {_qn(table)} REORGANIZE PARTITION {MAXVALUE_PARTITION} INTO (\n  "
+        + ",\n  ".join([_partition_clause(m) for m in missing] + [f"PARTITION {MAXVALUE_PARTITION} VALUES LESS THAN MAXVALUE"])
+        + "\n)"
+    )
+    if not dry_run:
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+    return [partition_name(m) for m in missing]
+
+
+def expire_mysql_partitions(table: str, keep_months: int, archive: bool = False, dry_run: bool = False) -> list:
+    """
+    删掉（archive=True 时先 EXCHANGE 到 {table}__arch{YYYYMM}）早于保留期的分区
+    保留期 = 本月 + 之前 keep_months-1 个月
+    """
+    cutoff = add_months(month_start(timezone.now()), -(keep_months - 1))
+    expired = [(name, m) for name, m in mysql_partitions(table) if m < cutoff]
+    if dry_run:
+        return [name for name, _ in expired]
+    with connection.cursor() as cursor:
+        for name, m in expired:
+            if archive:
+                arch = f"{table}__arch{m:%Y%m}"
+                cursor.execute(f"DROP TABLE IF EXISTS {_qn(arch)}")
+                cursor.execute(f"CREATE TABLE {_qn(arch)} LIKE {_qn(table)}")
+                cursor.execute(f"ALTER TABLE {_qn(arch)} REMOVE PARTITIONING")
+                cursor.execute(f"ALTER TABLE {_qn(table)} EXCHANGE PARTITION {name} WITH TABLE {_qn(arch)}")
+            cursor.execute(f"ALTER TABLE {_qn(table)} DROP PARTITION {name}")
+    return [name for name, _ in expired]
+
+
+# ---------------- SQLite ----------------
+def sqlite_archives(table: str) -> list:
+    """
+    [(归档表名, 月份)]，按月份升序
+    """
+    prefix = f"{table}__arch"
+    out = []
+    for name in connection.introspection.table_names():
+        if name.startswith(prefix) and name[len(prefix):].isdigit():
+            stamp = name[len(prefix):]
+            out.append((name, datetime.date(int(stamp[:4]), int(stamp[4:6]), 1)))
+    return sorted(out, key=lambda x: x[1])
+
+
+def _month_bounds(month: datetime.date):
+    lo = datetime.datetime(month.year, month.month, 1, tzinfo=datetime.timezone.utc)
+    nxt = add_months(month, 1)
+    return lo, datetime.datetime(nxt.year, nxt.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def rotate_sqlite_table(model, dry_run: bool = False) -> list:
+    """
+    本月之前的行按月搬进 {table}__arch{YYYYMM}（归档表已有就追加），再从线上表删掉；本月的行不动
+    只给开发环境用：搬迁是普通的 INSERT…SELECT + DELETE，一个事务里做完，表大了会长时间锁库
+    每个归档表只装它名字里那个月的数据，过期按月 DROP 不会误删
+    返回写过的归档表名；归档表里的数据业务不再读（统计走 usage_rollup）
+    """
+    table = model._meta.db_table
+    this_month = month_start(timezone.now())
+    boundary, _ = _month_bounds(this_month)
+    first = model.objects.filter(created_at__lt=boundary).order_by("created_at").values_list("created_at", flat=True).first()
+    if first is None:
+        return []
+    months = []
+    m = month_start(first.astimezone(datetime.timezone.utc))
+    while m < this_month:
+        lo, hi = _month_bounds(m)
+        if model.objects.filter(created_at__gte=lo, created_at__lt=hi).exists():
+            months.append(m)
+        m = add_months(m, 1)
+    archives = [f"{table}__arch{m:%Y%m}" for m in months]
+    if dry_run:
+        return archives
+
+    existing = set(connection.introspection.table_names())
+    adapt = connection.ops.adapt_datetimefield_value
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [table])
+        ddl = cursor.fetchone()[0]
+        for m, arch in zip(months, archives):
+            if arch not in existing:
+                # 按线上表的 DDL 建（不带索引，归档表不查）
+                cursor.execute(ddl.replace(_qn(table), _qn(arch), 1))
+            lo, hi = _month_bounds(m)
+            params = [adapt(lo), adapt(hi)]
+            where = f"WHERE {_qn('created_at')} >= %s AND {_qn('created_at')} < %s"
+            cursor.execute(f"INSERT INTO {_qn(arch)} SELECT * FROM {_qn(table)} {where}", params)
+            cursor.execute(f"DELETE FROM {_qn(table)} {where}", params)
+    return archives
+
+
+def expire_sqlite_archives(table: str, keep_months: int, dry_run: bool = False) -> list:
+    cutoff = add_months(month_start(timezone.now()), -(keep_months - 1))
+    expired = [name for name, m in sqlite_archives(table) if m < cutoff]
+    if not dry_run:
+        with connection.cursor() as cursor:
+            for name in expired:
+                cursor.execute(f"DROP TABLE {_qn(name)}")
+    return expired
+
+
+def run_retention(*, log, archive: bool = False, ahead: int = 3, dry_run: bool = False):
+    for model, keep_months in retained_models().items():
+        table = model._meta.db_table
+        if connection.vendor == "mysql":
+            if not mysql_partitions(table):
+                log(f"  {table}: not partitioned (run migrate), skipped")
+                continue
+            added = ensure_future_partitions(table, ahead=ahead, dry_run=dry_run)
+            dropped = expire_mysql_partitions(table, keep_months, archive=archive, dry_run=dry_run)
+            log(f"  {table}: added {added or '-'}, {'archived+dropped' if archive else 'dropped'} {dropped or '-'}")
+        elif connection.vendor == "sqlite":
+            rotated = rotate_sqlite_table(model, dry_run=dry_run)
+            dropped = expire_sqlite_archives(table, keep_months, dry_run=dry_run)
+            log(f"  {table}: archived into {rotated or '-'}, dropped {dropped or '-'}")
+        else:
+            log(f"  {table}: retention not supported on {connection.vendor}, skipped")
+
+    pruned = prune_minute_rollups(dry_run=dry_run)
+    log(f"  usage_rollup: {'would prune' if dry_run else 'pruned'} {pruned} minute buckets "
+        f"older than {settings.USAGE_ROLLUP_MINUTE_RETENTION_DAYS} days")
@@ -5,6 +5,10 @@ class HotelSearchSerializer(serializers.Serializer):
         child=serializers.CharField(max_length=255),
         allow_empty=False
     )
+    # exact：酒店名完全一致；fuzzy：规范化 + bigram 相似度，返回每个名字的 top_k
+    match = serializers.ChoiceField(required=False, default="exact", choices=["exact", "fuzzy"])
+    top_k = serializers.IntegerField(required=False, default=1, min_value=1, max_value=10)
+    min_score = serializers.FloatField(required=False, default=0.5, min_value=0.0, max_value=1.0)
 
 class TencentSSESerializer(serializers.Serializer):
     session_id = serializers.CharField(required=False, allow_blank=True)
@@ -22,12 +26,17 @@ class TencentSSESerializer(serializers.Serializer):
     stream = serializers.ChoiceField(required=False, default="enable", choices=["enable", "disable"])
     workflow_status = serializers.ChoiceField(required=False, default="disable", choices=["disable", "enable"])
     tcadp_user_id = serializers.CharField(required=False, default="", allow_blank=True)
+    # true：上游 SSE 字节原样透传（事件结构以 ADP 为准），不再逐行重组
+    raw = serializers.BooleanField(required=False, default=False)
 
 from api.models import AdpChatSession
 class AdpChatFeedbackSerializer(serializers.ModelSerializer):
+    # chat_saved 消息里给的 created_at：MySQL 上表按 created_at 月分区，带上它只查一个分区
+    created_at = serializers.DateTimeField(required=False, write_only=True)
+
     class Meta:
         model = AdpChatSession
-        fields = ["id", "feedback"]
+        fields = ["id", "feedback", "created_at"]
 
 
 # curl -N -X POST "http://127.0.0.1:8000/api/chat/stream/" -H "Content-Type: application/json" -H "X-API-Key: test-key-123" -d "{\"bot_app_key\":\"xxx\",\"visitor_biz_id\":\"u1\",\"content\":\"你好\"}"
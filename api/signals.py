@@ -0,0 +1,14 @@
+# api/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .auth import bump_api_key_version, reset_api_key_registry
+from .models import ApiClient
+
+
+# 注意：QuerySet.update() 不触发信号，停用 key 请走 save()
+@receiver(post_save, sender=ApiClient)
+@receiver(post_delete, sender=ApiClient)
+def _reload_api_keys(sender, instance, **kwargs):
+    reset_api_key_registry()
+    bump_api_key_version()
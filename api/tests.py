@@ -1,3 +1,1132 @@
-from django.test import TestCase
+import asyncio
+import json
+import re
+import tempfile
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone as datetime_timezone
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import pandas as pd
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api import auth, cancel, consumers, views
+from api.cancel import CancelRegistry, until_cancelled
+from api.catalog_swap import CATALOG_MODELS, catalog_swap, rollback_catalog
+from api.hotel_cache import NOT_FOUND, HotelSearchCache, bump_catalog_version, get_catalog_version
+from api.hotel_import import HotelImporter
+from api.hotel_index import HotelNameIndex, normalize_name
+from api.hotel_search import OFFERS_PER_HOTEL, search_hotels
+from api.hotel_writers import LoadDataWriter
+from api.models import AdpChatSession, ApiClient, Hotel, HotelCommentStar, HotelOfferSummary, HotelPOI, HotelRoomOffer, UsageRecord, UsageRollup
+from api.offer_summary import build_offer_summaries, has_breakfast
+from api.usage import UsageSink
+from api.usage_rollup import prune_minute_rollups, stats_window
+from api.utils.adp_stream import ReplyClassifier, thought_deltas
+from api.utils.api_key import generate_api_key, key_prefix
+from api.utils.catalog_clean import OFFER_COLUMNS
+from api.utils.hotel_id import canonical_hotel_id
+from api.utils.sse import EventTap, SSEParser, coalesce
+from api.utils.upstream import lifespan
+
+
+def _feed_all(parser, chunks):
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return [(ev.event, ev.data) for ev in events]
+
+
+class SSEParserTests(SimpleTestCase):
+    STREAM = (
+        b'event: reply\ndata: {"type":"reply","payload":{"content":"\xe4\xbd\xa0\xe5\xa5\xbd"}}\n\n'
+        b": ping\n\n"
+        b'data: {"type":"token_stat","payload":{}}\n\n'
+        b"data: line1\ndata: line2\nid: 7\n\n"
+        b"data: [DONE]\n\n"
+    )
+
+    def test_whole_stream(self):
+        parser = SSEParser()
+        events = _feed_all(parser, [self.STREAM])
+        self.assertEqual([name for name, _ in events], ["reply", "message", "message", "message"])
+        self.assertEqual(events[2][1], b"line1\nline2")
+        self.assertEqual(parser.last_event_id, "7")
+        self.assertEqual(events[3][1], b"[DONE]")
+
+    def test_any_chunk_split_gives_same_events(self):
+        expected = _feed_all(SSEParser(), [self.STREAM])
+        for i in range(1, len(self.STREAM)):
+            with self.subTest(split=i):
+                got = _feed_all(SSEParser(), [self.STREAM[:i], self.STREAM[i:]])
+                self.assertEqual(got, expected)
+        bytewise = _feed_all(SSEParser(), [self.STREAM[i:i + 1] for i in range(len(self.STREAM))])
+        self.assertEqual(bytewise, expected)
+
+    def test_cr_and_crlf_line_endings(self):
+        expected = _feed_all(SSEParser(), [self.STREAM])
+        for eol in (b"\r", b"\r\n"):
+            stream = self.STREAM.replace(b"\n", eol)
+            with self.subTest(eol=eol):
+                self.assertEqual(_feed_all(SSEParser(), [stream]), expected)
+                # \r\n 正好被切在两块之间
+                chunks = [stream[i:i + 3] for i in range(0, len(stream), 3)]
+                self.assertEqual(_feed_all(SSEParser(), chunks), expected)
+
+    def test_type_filter(self):
+        events = _feed_all(SSEParser(types={"reply"}), [self.STREAM])
+        # event: reply 保留；嗅探出 token_stat 的丢掉；嗅探不出 type 的不过滤
+        self.assertEqual([data[:5] for _, data in events], [b'{"typ', b"line1", b"[DONE"])
+
+    def test_nested_type_is_not_sniffed(self):
+        data = b'data: {"payload":{"type":"token_stat"},"type":"reply"}\n\n'
+        events = _feed_all(SSEParser(types={"reply"}), [data])
+        self.assertEqual(len(events), 1)
+        data = b'data: {"type":"token_stat","payload":{"type":"reply"}}\n\n'
+        self.assertEqual(_feed_all(SSEParser(types={"reply"}), [data]), [])
+
+
+class HotelSearchQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(1, 31):
+            hotel = Hotel.objects.create(hotel_id=str(i), name=f"酒店{i}", brand="全季")
+            HotelRoomOffer.objects.bulk_create([
+                HotelRoomOffer(hotel=hotel, room_type=f"房型{j}", offer_name="标准价", room_offer_price=Decimal(500 - j))
+                for j in range(OFFERS_PER_HOTEL + 2)
+            ])
+        # 同名酒店取 hotel_id 最小的
+        Hotel.objects.create(hotel_id="99", name="酒店1")
+
+    def test_query_count_does_not_grow_with_names(self):
+        # name__in 查酒店 + 读汇总表 + 汇总表缺行时窗口函数回源 offer 表
+        for n in (1, 30):
+            with self.subTest(names=n), self.assertNumQueries(3):
+                result = search_hotels([f"酒店{i}" for i in range(1, n + 1)] + ["不存在"], use_cache=False)
+            self.assertEqual(len(result), n)
+
+    def test_result_shape(self):
+        result = search_hotels([" 酒店1 ", "不存在", "酒店2"], use_cache=False)
+        self.assertEqual([r["hotel_id"] for r in result], ["1", "2"])
+        offers = result[0]["offers"]
+        self.assertEqual(len(offers), OFFERS_PER_HOTEL)
+        prices = [o["offer_price"] for o in offers]
+        self.assertEqual(prices, sorted(prices))
+        self.assertEqual(result[0]["min_offer_price"], prices[0])
+
+
+# 缓存相关的测试不依赖 Redis：换成进程内缓存
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class HotelSearchCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+
+    def loader(self, names):
+        self.calls.append(sorted(names))
+        return {n: {"name": n, "v": len(self.calls)} for n in names if n != "无"}
+
+    def test_local_then_shared_then_loader(self):
+        worker = HotelSearchCache(local_size=16, timeout=60)
+        found = worker.get_or_load(["a", "无", "a"], self.loader)
+        self.assertEqual(found, {"a": {"name": "a", "v": 1}, "无": NOT_FOUND})
+        self.assertEqual(self.calls, [["a", "无"]])
+
+        # 本 worker：L1 命中（含负缓存），不回源
+        worker.get_or_load(["a", "无"], self.loader)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(worker.stats()["local_hits"], 2)
+
+        # 别的 worker：L2 命中
+        other = HotelSearchCache(local_size=16, timeout=60)
+        self.assertEqual(other.get_or_load(["a", "无"], self.loader)["a"]["v"], 1)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(other.stats()["redis_hits"], 2)
+
+    def test_version_bump_invalidates_both_tiers(self):
+        worker = HotelSearchCache(local_size=16, timeout=60)
+        other = HotelSearchCache(local_size=16, timeout=60)
+        worker.get_or_load(["a"], self.loader)
+        other.get_or_load(["a"], self.loader)
+        version = get_catalog_version()
+
+        self.assertEqual(bump_catalog_version(), version + 1)
+        self.assertEqual(worker.get_or_load(["a"], self.loader)["a"]["v"], 2)
+        self.assertEqual(other.get_or_load(["a"], self.loader)["a"]["v"], 2)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_version_key_lost(self):
+        cache.delete("hotel:catalog_version")
+        self.assertEqual(bump_catalog_version(), 2)
+        cache.delete("hotel:catalog_version")
+        self.assertEqual(get_catalog_version(), 1)
+
+
+class HotelNameIndexTests(SimpleTestCase):
+    def test_normalize_name(self):
+        self.assertEqual(
+            normalize_name("全季酒店（呼和浩特市政府东站店）"),
+            normalize_name("全季酒店(呼和浩特市政府东站店)"),
+        )
+        self.assertEqual(normalize_name("  Ａｔｏｕｒ 酒店【北京】 "), "atour酒店北京")
+        self.assertEqual(normalize_name(None), "")
+
+    def test_lookup(self):
+        index = HotelNameIndex([
+            ("1", "全季酒店(呼和浩特市政府东站店)"),
+            ("2", "全季酒店(呼和浩特市政府东站店)"),
+            ("3", "汉庭酒店(呼和浩特火车站店)"),
+            ("4", "亚朵酒店(北京国贸店)"),
+        ], version=5)
+        self.assertEqual(index.version, 5)
+        self.assertEqual(len(index), 4)
+        # 精确命中：同名取 hotel_id 最小的
+        self.assertEqual(index.lookup("全季酒店（呼和浩特市政府东站店）", k=1), [(1.0, "1", "全季酒店(呼和浩特市政府东站店)")])
+        top = index.lookup("汉庭呼和浩特火车站", k=2)
+        self.assertEqual(top[0][1], "3")
+        self.assertLess(top[0][0], 1.0)
+        self.assertEqual(index.lookup("亚朵国贸", k=3, min_score=0.99), [])
+        self.assertEqual(index.lookup("  "), [])
+
+    def test_common_grams_rank_by_overlap(self):
+        # query 的每个 gram 都是高频 gram：最好的匹配在最短倒排表的末尾，也要召回得到
+        rows = [(f"a{i:05d}", f"如家酒店浦{i}") for i in range(3000)]
+        rows += [(f"b{i:05d}", f"浦东{i}大厦") for i in range(200)]
+        rows.append(("c", "浦东如家酒店"))
+        index = HotelNameIndex(rows)
+        top = index.lookup("如家酒店浦东", k=1)
+        self.assertEqual(top[0][1], "c")
+
+    def test_common_grams_prefix(self):
+        rows = [(f"{i:05d}", f"全季酒店{('北京', '上海', '广州')[i % 3]}{i}号店") for i in range(3000)]
+        index = HotelNameIndex(rows)
+        with mock.patch.object(HotelNameIndex, "MAX_SCAN", 0):
+            top = index.lookup("全季酒店上海", k=5)
+        self.assertEqual(len(top), 5)
+        self.assertTrue(all(name.startswith("全季酒店上海") for _, _, name in top))
+
+
+class LifespanStartupTests(SimpleTestCase):
+    def test_startup_hooks_run_before_startup_complete(self):
+        events = []
+
+        async def hook():
+            events.append("hook")
+
+        async def app(scope, receive, send):
+            pass
+
+        messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            events.append(message["type"])
+
+        application = lifespan(app, on_startup=[hook])
+        with mock.patch("api.utils.upstream.warmup", mock.AsyncMock(return_value=[])):
+            asyncio.run(application({"type": "lifespan"}, receive, send))
+        self.assertEqual(events, ["hook", "lifespan.startup.complete", "lifespan.shutdown.complete"])
+
+
+class HasBreakfastTests(SimpleTestCase):
+    def test_policies(self):
+        for policy in ("含早", "含双早", "双早", "单早", "含1份早餐", "早餐"):
+            with self.subTest(policy=policy):
+                self.assertTrue(has_breakfast(policy))
+        for policy in ("早鸟价", "提前7天早订特惠", "无早", "不含早", "早餐自理", "", None):
+            with self.subTest(policy=policy):
+                self.assertFalse(has_breakfast(policy))
+
+
+class OfferSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        hotel = Hotel.objects.create(hotel_id="1", name="汉庭酒店")
+        HotelRoomOffer.objects.bulk_create([
+            HotelRoomOffer(hotel=hotel, room_type="大床房", offer_name="早鸟价", room_offer_price=Decimal("199"), offer_breakfast_policy="无早"),
+            HotelRoomOffer(hotel=hotel, room_type="双床房", offer_name="标准价", room_offer_price=Decimal("259"), offer_breakfast_policy="含双早"),
+            HotelRoomOffer(hotel=hotel, room_type="套房", offer_name="标准价", room_offer_price=None),
+        ])
+        Hotel.objects.create(hotel_id="2", name="没有报价的酒店")
+
+    def test_build_and_search_from_summary(self):
+        build_offer_summaries()
+        summary = HotelOfferSummary.objects.get(pk="1")
+        self.assertEqual((summary.min_price, summary.max_price, summary.offer_count), (Decimal("199"), Decimal("259"), 3))
+        self.assertTrue(summary.has_breakfast)
+        self.assertEqual(summary.top_offers[0][:2], ["大床房", "早鸟价"])
+
+        # 汇总表齐了：name__in 查酒店 + 读汇总表，不再回源 offer 表
+        with self.assertNumQueries(2):
+            result = search_hotels(["汉庭酒店", "没有报价的酒店"], use_cache=False)
+        self.assertEqual(result[0]["min_offer_price"], 199.0)
+        self.assertEqual(result[1]["offers"], [])
+
+
+class CanonicalHotelIdTests(SimpleTestCase):
+    def test_formats(self):
+        self.assertEqual(canonical_hotel_id("0123456"), "123456")
+        self.assertEqual(canonical_hotel_id(123456), "123456")
+        self.assertEqual(canonical_hotel_id(" 123456.0 "), "123456")
+        self.assertEqual(canonical_hotel_id("000"), "0")
+        self.assertEqual(canonical_hotel_id("H0123"), "H0123")
+
+    def test_empty_values(self):
+        for value in (None, "", "  ", "nan", "NaN", "None", "null", float("nan")):
+            with self.subTest(value=value):
+                self.assertIsNone(canonical_hotel_id(value))
+
+
+def _write_catalog(root, hotels, stars, pois, offers) -> dict:
+    """
+    导入命令的四个源文件写到 root 下，返回 HotelImporter.run 的参数
+    """
+    root = Path(root)
+    pd.DataFrame(hotels, columns=["华住id", "酒店名称", "品牌", "商业区"]).to_excel(root / "biz.xlsx", sheet_name="s", index=False)
+    pd.DataFrame(stars, columns=["hotelno", "experiencescore_mix"]).to_csv(root / "star.csv", index=False)
+    pd.DataFrame(pois, columns=["hotelno", "poiname"]).to_csv(root / "poi.csv", index=False)
+    pd.DataFrame(offers, columns=[
+        "hotel_id", "room_type", "offer_name", "room_price_origin", "room_offer_price",
+        "offer_discount_text", "offer_breakfast_policy",
+    ]).to_csv(root / "offer.csv", index=False)
+    return {
+        "biz_xlsx": root / "biz.xlsx",
+        "sheet": "s",
+        "comment_csv": root / "star.csv",
+        "poi_csv": root / "poi.csv",
+        "offer_csv": root / "offer.csv",
+    }
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DeltaImportTests(TestCase):
+    V1 = {
+        "hotels": [("0001", "全季A", "全季", "东站"), ("0002", "汉庭B", "汉庭", "西站")],
+        "stars": [("1", 4.5), ("2.0", 4.0)],
+        "pois": [("1", "地铁站"), ("2", "机场")],
+        "offers": [
+            ("1", "大床房", "标准价", 100, 90, None, "无早"),
+            ("1", "大床房", "标准价", 100, 95, None, "无早"),
+            ("2", "双床房", "含早价", 200, 180, None, "含双早"),
+        ],
+    }
+    V2 = {
+        "hotels": [("0001", "全季A", "全季", "东站"), ("0002", "汉庭B(新)", "汉庭", "西站")],
+        "stars": [("1", 4.8)],
+        "pois": [("1", "地铁站"), ("1", "商场")],
+        "offers": [
+            ("1", "大床房", "标准价", 100, 90, None, "无早"),
+            ("1", "大床房", "标准价", 100, 99, None, "无早"),
+            ("3", "套房", "标准价", 300, 280, None, "含早"),
+        ],
+    }
+
+    def _import(self, data, **kwargs):
+        importer = HotelImporter(log=lambda msg: None, workers=1, **kwargs)
+        with tempfile.TemporaryDirectory() as root:
+            importer.run(**_write_catalog(root, **data))
+        return importer
+
+    def test_delta_writes_only_changes(self):
+        self._import(self.V1)
+        kept = HotelRoomOffer.objects.get(hotel_id="1", room_offer_price=90).pk
+
+        importer = self._import(self.V2, delta=True)
+        self.assertEqual(importer.diff["hotel"], {"inserted": 0, "updated": 1, "deleted": 0, "unchanged": 1})
+        self.assertEqual(importer.diff["hotel_comment_star"], {"inserted": 0, "updated": 1, "deleted": 1, "unchanged": 0})
+        self.assertEqual(importer.diff["hotel_poi"], {"inserted": 1, "updated": 0, "deleted": 1, "unchanged": 1})
+        self.assertEqual(importer.diff["hotel_room_offer"], {"inserted": 1, "updated": 1, "deleted": 1, "unchanged": 1})
+        self.assertEqual(importer.touched, {"1", "2", "3"})
+
+        self.assertEqual(Hotel.objects.get(pk="2").name, "汉庭B(新)")
+        self.assertEqual(list(HotelCommentStar.objects.values_list("hotel_id", "experiencescore_mix")), [("1", Decimal("4.80"))])
+        self.assertEqual(sorted(HotelPOI.objects.values_list("poiname", flat=True)), ["商场", "地铁站"])
+        # 没变的报价原地保留（主键不变），变了的原地更新
+        self.assertEqual(
+            sorted(HotelRoomOffer.objects.values_list("hotel_id", "room_offer_price")),
+            [("1", Decimal("90.00")), ("1", Decimal("99.00")), ("3", Decimal("280.00"))],
+        )
+        self.assertTrue(HotelRoomOffer.objects.filter(pk=kept).exists())
+        # 只重建变动酒店的汇总：hotel 2 的报价没了，hotel 3 是新的
+        self.assertEqual(HotelOfferSummary.objects.get(pk="2").offer_count, 0)
+        self.assertEqual(HotelOfferSummary.objects.get(pk="3").min_price, Decimal("280.00"))
+
+    def test_second_delta_is_a_no_op(self):
+        self._import(self.V1)
+        self._import(self.V2, delta=True)
+        importer = self._import(self.V2, delta=True)
+        for table, diff in importer.diff.items():
+            with self.subTest(table=table):
+                self.assertEqual((diff["inserted"], diff["updated"], diff["deleted"]), (0, 0, 0))
+        self.assertEqual(importer.touched, set())
+
+
+class FakeMySQLSchema:
+    """
+    只认导入用到的几条 DDL，记录表名、外键指向和每张表是第几次建的（gen）
+    和 InnoDB 一样：RENAME 时指向它的外键跟着改名，被外键引用的表不让 DROP（3730）
+    """
+
+    vendor = "mysql"
+
+    def __init__(self, tables):
+        self.tables = {}
+        self.gen = 0
+        for table, refs in tables.items():
+            self._create(table, refs)
+        self.ops = mock.Mock(quote_name=lambda name: f"`{name}`")
+        self.introspection = mock.Mock(table_names=lambda: list(self.tables))
+
+    def _create(self, table, refs=()):
+        assert table not in self.tables, table
+        self.gen += 1
+        self.tables[table] = {"gen": self.gen, "refs": list(refs)}
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def fetchone(self):
+        return (10,)
+
+    def execute(self, sql, params=None):
+        names = re.findall(r"`([^`]+)`", sql)
+        if sql.startswith("CREATE TABLE"):
+            self._create(names[0])
+        elif sql.startswith("ALTER TABLE"):
+            assert names[-2] in self.tables, names
+            self.tables[names[0]]["refs"].append(names[-2])
+        elif sql.startswith("DROP TABLE"):
+            table = names[0]
+            if table not in self.tables:
+                assert "IF EXISTS" in sql, table
+                return
+            children = [t for t, info in self.tables.items() if t != table and table in info["refs"]]
+            if children:
+                raise AssertionError(f"3730: cannot drop {table} referenced by {children}")
+            del self.tables[table]
+        elif sql.startswith("RENAME TABLE"):
+            for old, new in zip(names[::2], names[1::2]):
+                assert old in self.tables and new not in self.tables, (old, new)
+                self.tables[new] = self.tables.pop(old)
+                for info in self.tables.values():
+                    info["refs"] = [new if r == old else r for r in info["refs"]]
+        else:
+            assert sql.startswith(("SELECT COUNT", "INSERT INTO", "LOAD DATA")), sql
+
+    def close(self):
+        pass
+
+    def gens(self, suffix=""):
+        return {m._meta.db_table: self.tables[m._meta.db_table + suffix]["gen"] for m in CATALOG_MODELS}
+
+
+class CatalogSwapTests(SimpleTestCase):
+    def setUp(self):
+        self.db = FakeMySQLSchema({
+            "hotel": [],
+            "hotel_comment_star": ["hotel"],
+            "hotel_poi": ["hotel"],
+            "hotel_room_offer": ["hotel"],
+            "hotel_offer_summary": ["hotel"],
+        })
+        for target in ("api.catalog_swap.connection", "api.hotel_writers.connection"):
+            patcher = mock.patch(target, self.db)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch("api.hotel_writers._infile_connection", return_value=self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def swap_import(self):
+        with catalog_swap(log=lambda msg: None):
+            pass
+
+    def test_swap_keeps_foreign_keys_and_repeats(self):
+        self.swap_import()
+        # 第二次导入：__old 里的子表还引用着 hotel__old，要先删子表
+        self.swap_import()
+        for table in ("hotel_comment_star", "hotel_poi", "hotel_room_offer", "hotel_offer_summary"):
+            self.assertEqual(self.db.tables[table]["refs"], ["hotel"])
+            self.assertEqual(self.db.tables[table + "__old"]["refs"], ["hotel__old"])
+        self.assertFalse([t for t in self.db.tables if "__shadow" in t])
+
+    def test_swap_is_the_default_on_mysql(self):
+        with mock.patch("api.hotel_import.connection", self.db):
+            self.assertTrue(HotelImporter(log=print).swap)
+            self.assertFalse(HotelImporter(log=print, swap=False).swap)
+        # SQLite 开发环境默认直接写
+        self.assertFalse(HotelImporter(log=print).swap)
+
+    def test_rollback_after_in_place_fast_load(self):
+        self.swap_import()
+        self.swap_import()
+        previous = self.db.gens("__old")
+
+        # 不换目录的 --fast：报价表自己 staging + 换表，不能动 rollback 用的 __old
+        with LoadDataWriter(HotelRoomOffer, OFFER_COLUMNS) as writer:
+            writer.write([("1", "大床房", "标准价", 100, 90, None, "无早", "")])
+        self.assertEqual(self.db.tables["hotel_room_offer"]["refs"], ["hotel"])
+        self.assertEqual(self.db.gens("__old"), previous)
+
+        rollback_catalog()
+        self.assertEqual(self.db.gens(), previous)
+        self.assertEqual(self.db.tables["hotel_room_offer"]["refs"], ["hotel"])
+
+
+class KeyPrefixTests(SimpleTestCase):
+    def test_prefix_never_reveals_whole_key(self):
+        self.assertEqual(key_prefix("sk_" + "a" * 43), "sk_aaaaaaaaa")
+        for n in range(1, 30):
+            with self.subTest(length=n):
+                key = "k" * n
+                self.assertLessEqual(len(key_prefix(key)), n // 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, API_KEY_REFRESH_SECONDS=60)
+class ApiKeyRegistryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        auth.reset_api_key_registry()
+        self.key = generate_api_key()
+        self.client_row = ApiClient(name="c1")
+        self.client_row.set_key(self.key)
+        self.client_row.save()
+
+    def tearDown(self):
+        auth.reset_api_key_registry()
+
+    def test_verify_without_queries(self):
+        registry = auth.get_api_key_registry()
+        with self.assertNumQueries(0):
+            self.assertEqual(auth.get_api_key_registry().verify(self.key), (self.client_row.id, "c1"))
+            self.assertIsNone(registry.verify(self.key[:-1] + "x"))
+            self.assertIsNone(registry.verify("nope"))
+
+    def test_save_reloads_this_worker(self):
+        self.assertIsNotNone(auth.get_api_key_registry().verify(self.key))
+        self.client_row.is_active = False
+        self.client_row.save()
+        self.assertIsNone(auth.get_api_key_registry().verify(self.key))
+
+    def test_other_worker_follows_version(self):
+        self.assertIsNotNone(auth.get_api_key_registry().verify(self.key))
+        # 别的 worker 停用了 key：本进程只看到库 + version 变了
+        ApiClient.objects.filter(pk=self.client_row.pk).update(is_active=False)
+        auth.bump_api_key_version()
+        # 检查间隔内仍用旧的
+        self.assertIsNotNone(auth.get_api_key_registry().verify(self.key))
+        auth._registry_checked_at -= 60
+        self.assertIsNone(auth.get_api_key_registry().verify(self.key))
+
+    def test_unchanged_version_does_not_reload(self):
+        auth.get_api_key_registry()
+        auth._registry_checked_at -= 60
+        with self.assertNumQueries(0):
+            auth.get_api_key_registry()
+
+
+def _usage_row(client_id="c1", **extra):
+    row = {
+        "session_id": None, "client_id": client_id, "endpoint": "chat", "app": "s", "success": True,
+        "latency_ms": 120, "tool_calls": 0, "llm_in_tokens": 10, "llm_out_tokens": 20,
+        "cost_cents": Decimal("0.5"), "created_at": timezone.now(),
+    }
+    row.update(extra)
+    return row
+
+
+class UsageSinkTests(TestCase):
+    def setUp(self):
+        self.sink = UsageSink(maxsize=3, batch=2, flush_ms=50)
+        # 不起后台线程，测试线程自己 drain
+        patcher = mock.patch.object(UsageSink, "_start")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        results = [self.sink.put(_usage_row()) for _ in range(4)]
+        self.assertEqual(results, [True, True, True, False])
+        self.assertEqual(self.sink.stats()["dropped"], 1)
+
+    def test_stop_drains_queue_in_batches(self):
+        for i in range(3):
+            self.sink.put(_usage_row(client_id=f"c{i}"))
+        self.sink.stop()
+        stats = self.sink.stats()
+        self.assertEqual((stats["queued"], stats["flushed"], stats["batches"]), (0, 3, 2))
+        self.assertEqual(UsageRecord.objects.count(), 3)
+        # 同一批顺手合并进 rollup：每条记录一个分钟桶 + 一个小时桶
+        self.assertEqual(UsageRollup.objects.filter(granularity=UsageRollup.MINUTE).count(), 3)
+
+    def test_lost_connection_retries_batch_once(self):
+        real = UsageRecord.objects.bulk_create
+        calls = []
+
+        def flaky(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                raise OperationalError(2006, "MySQL server has gone away")
+            return real(*args, **kwargs)
+
+        self.sink.put(_usage_row())
+        with mock.patch.object(UsageRecord.objects, "bulk_create", side_effect=flaky), \
+                mock.patch("api.usage.connection.close"), self.assertLogs("api.usage", "WARNING"):
+            self.assertEqual(self.sink.drain(), 1)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(UsageRecord.objects.count(), 1)
+        self.assertEqual(self.sink.stats()["errors"], 0)
+
+
+async def _agent():
+    """
+    不走 channels：accept / send 换成记录到 agent.sent
+    """
+    agent = consumers.Agent_interaction()
+    agent.sent = []
+
+    async def accept(*args, **kwargs):
+        pass
+
+    async def send(text_data=None, bytes_data=None, **kwargs):
+        agent.sent.append(json.loads(text_data) if text_data else bytes_data)
+
+    agent.accept, agent.send = accept, send
+    await agent.connect()
+    agent.session_id, agent.visitor_biz_id = "s1", "v1"
+    return agent
+
+
+@asynccontextmanager
+async def _no_cancel_watch(session_id):
+    yield asyncio.Event()
+
+
+class AgentUsageTests(SimpleTestCase):
+    async def test_usage_committed_when_turn_cancelled(self):
+        started = asyncio.Event()
+
+        async def hanging_reply(**kwargs):
+            kwargs["recorder"].add_output_text("半句")
+            yield {"type": "result", "data": "半句"}
+            started.set()
+            await asyncio.sleep(60)
+            yield {"type": "result", "data": "不会到这"}
+
+        agent = await _agent()
+        with mock.patch.object(consumers, "adp_stream_reply", hanging_reply), \
+                mock.patch.object(consumers, "cancel_watch", _no_cancel_watch), \
+                mock.patch("api.usage.usage_sink") as sink:
+            turn = asyncio.create_task(agent._run_adp_and_optional_tts("你好", reply_mode="text", tts_codec="pcm"))
+            await started.wait()
+            # 插话 / 断开：这一轮的任务被取消
+            turn.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await turn
+            await agent.disconnect(1000)
+
+        sink.put.assert_called_once()
+        record = sink.put.call_args.args[0]
+        self.assertEqual(record["endpoint"], "agent_ws")
+        self.assertGreater(record["llm_out_tokens"], 0)
+
+
+class StatsWindowTests(SimpleTestCase):
+    def test_whole_buckets(self):
+        since = datetime(2026, 10, 1, 10, 0, 30, tzinfo=datetime_timezone.utc)
+        until = datetime(2026, 10, 1, 10, 5, 10, tzinfo=datetime_timezone.utc)
+        g, start, end = stats_window(since, until, now=until)
+        self.assertEqual(g, UsageRollup.MINUTE)
+        self.assertEqual(start, datetime(2026, 10, 1, 10, 1, tzinfo=datetime_timezone.utc))
+        self.assertEqual(end, datetime(2026, 10, 1, 10, 6, tzinfo=datetime_timezone.utc))
+
+    def test_long_window_uses_hours(self):
+        since = datetime(2026, 10, 1, 0, 0, tzinfo=datetime_timezone.utc)
+        g, start, end = stats_window(since, since + timedelta(days=1, minutes=1), now=since + timedelta(days=2))
+        self.assertEqual(g, UsageRollup.HOUR)
+        self.assertEqual(start, since)
+        self.assertEqual(end, since + timedelta(days=1, hours=1))
+
+    @override_settings(USAGE_ROLLUP_MINUTE_RETENTION_DAYS=7)
+    def test_pruned_minutes_fall_back_to_hours(self):
+        since = datetime(2026, 10, 1, 10, 0, tzinfo=datetime_timezone.utc)
+        g, _, _ = stats_window(since, since + timedelta(minutes=5), now=since + timedelta(days=8))
+        self.assertEqual(g, UsageRollup.HOUR)
+
+
+@override_settings(USAGE_ROLLUP_MINUTE_RETENTION_DAYS=7)
+class PruneMinuteRollupsTests(TestCase):
+    def _bucket(self, granularity, age):
+        return UsageRollup.objects.create(
+            granularity=granularity, bucket_start=timezone.now().replace(second=0, microsecond=0) - age,
+            client_id="c1", endpoint="chat", latency_hist=[],
+        )
+
+    def test_only_old_minute_buckets_go(self):
+        old_minute = self._bucket(UsageRollup.MINUTE, timedelta(days=8))
+        self._bucket(UsageRollup.MINUTE, timedelta(days=1))
+        self._bucket(UsageRollup.HOUR, timedelta(days=8))
+        self.assertEqual(prune_minute_rollups(dry_run=True), 1)
+        self.assertTrue(UsageRollup.objects.filter(pk=old_minute.pk).exists())
+        self.assertEqual(prune_minute_rollups(batch=1), 1)
+        self.assertFalse(UsageRollup.objects.filter(pk=old_minute.pk).exists())
+        self.assertEqual(UsageRollup.objects.count(), 2)
+
+
+class ChatFeedbackTests(TestCase):
+    def setUp(self):
+        self.chat = AdpChatSession.objects.create(session_id="s1", user_question="q", model_answer="a")
+        self.url = f"/api/chat/feedback/{self.chat.pk}/"
+
+    def test_created_at_in_update_filter(self):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = APIClient().patch(
+                self.url, {"feedback": True, "created_at": self.chat.created_at.isoformat()}, format="json",
+            )
+        self.assertEqual(resp.status_code, 200)
+        self.chat.refresh_from_db()
+        self.assertIs(self.chat.feedback, True)
+        update = [q["sql"] for q in ctx.captured_queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(update), 1)
+        self.assertIn("created_at", update[0].split("WHERE", 1)[1])
+
+    def test_without_created_at_still_works(self):
+        resp = APIClient().patch(self.url, {"feedback": False}, format="json")
+        self.assertEqual(resp.status_code, 200)
+        self.chat.refresh_from_db()
+        self.assertIs(self.chat.feedback, False)
+
+    def test_wrong_created_at_is_not_found(self):
+        resp = APIClient().patch(
+            self.url, {"feedback": True, "created_at": "2020-01-01T00:00:00+00:00"}, format="json",
+        )
+        self.assertEqual(resp.status_code, 404)
+        self.chat.refresh_from_db()
+        self.assertIsNone(self.chat.feedback)
+
+
+ADP_SSE = (
+    b'event: reply\ndata: {"type":"reply","payload":{"content":"\xe4\xbd\xa0\xe5\xa5\xbd","is_from_self":false}}\n\n'
+    b'data: {"type":"thought","payload":{"content":"reply token_stat"}}\n\n'
+    b'data: {"type":"token_stat","payload":{"token_count":30,"procedures":[]}}\n\n'
+)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, SSE_COALESCE_MS=0)
+class ChatStreamTestCase(TestCase):
+    """
+    上游用 httpx.MockTransport 假装 ADP；chunks 决定上游怎么分块
+    """
+
+    def setUp(self):
+        cache.clear()
+        auth.reset_api_key_registry()
+        self.key = generate_api_key()
+        row = ApiClient(name="c1")
+        row.set_key(self.key)
+        row.save()
+        self.addCleanup(auth.reset_api_key_registry)
+
+    async def _post(self, chunks, **body):
+        class Body(httpx.AsyncByteStream):
+            async def __aiter__(self):
+                for chunk in chunks:
+                    yield chunk
+
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, stream=Body()))
+        upstream = httpx.AsyncClient(transport=transport)
+        with mock.patch.object(views, "get_async_client", lambda url: upstream), \
+                mock.patch.object(views, "cancel_watch", _no_cancel_watch), \
+                mock.patch("api.usage.usage_sink") as sink:
+            resp = await AsyncClient().post(
+                "/api/chat/stream/", {"content": "你好", "app": "s", **body},
+                content_type="application/json", headers={"X-Api-Key": self.key},
+            )
+            content = b"".join([chunk async for chunk in resp.streaming_content])
+        return content, sink.put.call_args.args[0]
+
+
+class ChatStreamTests(ChatStreamTestCase):
+    async def test_events_forwarded_as_data_lines(self):
+        # 一个事件拆在两块里
+        content, record = await self._post([ADP_SSE[:30], ADP_SSE[30:]], session_id="s1")
+        events = [e for e in content.split(b"\n\n") if e]
+        self.assertEqual(len(events), 3)
+        self.assertTrue(all(e.startswith(b"data: {") for e in events))
+        self.assertIn("你好".encode(), events[0])
+        # 只有 reply / token_stat 算用量：thought 里出现这两个词不算
+        self.assertEqual(record["llm_out_tokens"] + record["llm_in_tokens"], 30)
+
+
+class _FakePubSub:
+    def __init__(self, messages):
+        self.messages = messages
+        self.channel = None
+
+    async def subscribe(self, channel):
+        self.channel = channel
+
+    async def listen(self):
+        for message in self.messages:
+            yield message
+        # 订阅一直挂着，直到 listener 被取消
+        await asyncio.Event().wait()
+
+    async def aclose(self):
+        pass
+
+
+def _fake_registry(messages=(), flags=None):
+    """
+    不连 Redis 的 CancelRegistry：pub/sub 收到 messages，重新订阅时 MGET 返回 flags
+    """
+    registry = CancelRegistry()
+    registry.redis = mock.MagicMock()
+    registry.pubsub = _FakePubSub(list(messages))
+    registry.redis.pubsub.return_value = registry.pubsub
+    registry.redis.mget = mock.AsyncMock(side_effect=lambda keys: flags or [None] * len(keys))
+    return registry
+
+
+class CancelRegistryTests(SimpleTestCase):
+    async def _listen(self, registry, *sessions):
+        events = {}
+        for session_id in sessions:
+            events[session_id] = asyncio.Event()
+            registry.events[session_id].add(events[session_id])
+        registry.ensure_listening()
+        await asyncio.wait_for(registry.subscribed.wait(), 1)
+        return events
+
+    async def _stop(self, registry):
+        registry.task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await registry.task
+
+    async def test_published_cancel_sets_only_that_session(self):
+        registry = _fake_registry(messages=[{"type": "message", "data": "s1"}])
+        events = await self._listen(registry, "s1", "s2")
+        await asyncio.wait_for(events["s1"].wait(), 1)
+        self.assertFalse(events["s2"].is_set())
+        self.assertEqual(registry.pubsub.channel, registry.channel)
+        await self._stop(registry)
+
+    async def test_resubscribe_replays_cancel_flags(self):
+        # 断线期间漏掉的 cancel：重新订阅后按 cancel:{session_id} 标记补上
+        registry = _fake_registry(flags=["1", None])
+        events = await self._listen(registry, "s1", "s2")
+        await asyncio.wait_for(events["s1"].wait(), 1)
+        self.assertFalse(events["s2"].is_set())
+        registry.redis.mget.assert_awaited_once_with(["cancel:s1", "cancel:s2"])
+        await self._stop(registry)
+
+
+class _SlowSource:
+    """
+    上游：先给 items，然后一直不来数据（ADP 在思考）；记录有没有被关掉
+    """
+
+    def __init__(self, *items):
+        self.items = list(items)
+        self.closed = False
+        self.read_cancelled = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.items:
+            return self.items.pop(0)
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            self.read_cancelled = True
+            raise
+
+    async def aclose(self):
+        self.closed = True
+
+
+class CancelPropagationTests(SimpleTestCase):
+    async def test_cancel_stops_silent_upstream(self):
+        source, cancelled = _SlowSource(b"a"), asyncio.Event()
+        got = []
+
+        async def consume():
+            async for item in until_cancelled(source, cancelled):
+                got.append(item)
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.01)
+        cancelled.set()
+        await asyncio.wait_for(task, 1)
+        self.assertEqual(got, [b"a"])
+        self.assertTrue(source.read_cancelled)
+        self.assertTrue(source.closed)
+
+    async def test_outer_cancel_closes_source(self):
+        # 客户端断开：外层任务被取消，正在等的读取也要停、上游要关
+        source = _SlowSource()
+        task = asyncio.create_task(anext(until_cancelled(source, asyncio.Event())))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertTrue(source.read_cancelled)
+        self.assertTrue(source.closed)
+
+    def test_request_cancel_publishes_to_owners_only(self):
+        r = mock.MagicMock()
+        r.pipeline.return_value.execute.side_effect = [[True, {"w1", "w2"}], [1, 1]]
+        with mock.patch.object(cancel, "_get_sync_redis", return_value=r):
+            self.assertEqual(cancel.request_cancel("s1"), 2)
+        published = sorted(c.args for c in r.pipeline.return_value.publish.call_args_list)
+        self.assertEqual(published, [("chat:cancel:w1", "s1"), ("chat:cancel:w2", "s1")])
+
+    def test_request_cancel_without_owner(self):
+        r = mock.MagicMock()
+        r.pipeline.return_value.execute.return_value = [True, set()]
+        with mock.patch.object(cancel, "_get_sync_redis", return_value=r):
+            self.assertEqual(cancel.request_cancel("s1"), 0)
+        r.pipeline.return_value.publish.assert_not_called()
+
+    async def test_cancel_watch_registers_owner(self):
+        registry = CancelRegistry()
+        registry.redis = mock.MagicMock()
+        registry.redis.pipeline.return_value.execute = mock.AsyncMock()
+        registry.redis.srem = mock.AsyncMock()
+        with mock.patch.object(cancel, "get_cancel_registry", return_value=registry):
+            async with cancel.cancel_watch("s1") as first, cancel.cancel_watch("s1") as second:
+                pipe = registry.redis.pipeline.return_value
+                # 上一轮留下的 cancel 标记清掉，本 worker 登记为 owner
+                pipe.delete.assert_called_with("cancel:s1")
+                pipe.sadd.assert_called_with("cancel:owners:s1", registry.worker_id)
+                registry.notify("s1")
+                self.assertTrue(first.is_set() and second.is_set())
+            # 这个会话在本 worker 上的流都结束了才注销
+            registry.redis.srem.assert_awaited_once_with("cancel:owners:s1", registry.worker_id)
+        self.assertNotIn("s1", registry.events)
+
+
+class EventTapTests(SimpleTestCase):
+    def test_only_marked_data_lines(self):
+        stream = b'data: {"type":"reply"}\n\ndata: {"type":"token_stat","n":1}\n\ndata: {"type":"thought"}\n\n'
+        tap = EventTap(b"token_stat")
+        got = []
+        for i in range(0, len(stream), 5):
+            got.extend(tap.feed(stream[i:i + 5]))
+        self.assertEqual(got, [b'{"type":"token_stat","n":1}'])
+
+    def test_several_markers(self):
+        stream = b'event: reply\ndata: {"type":"reply"}\n\ndata: {"type":"thought"}\n\ndata: {"type":"token_stat"}\n\n'
+        self.assertEqual(
+            EventTap(b"token_stat", b"reply").feed(stream),
+            [b'{"type":"reply"}', b'{"type":"token_stat"}'],
+        )
+
+    def test_incomplete_line_waits_for_newline(self):
+        tap = EventTap(b"token_stat")
+        self.assertEqual(tap.feed(b'data: {"type":"token_stat"'), [])
+        self.assertEqual(tap.feed(b"}\n"), [b'{"type":"token_stat"}'])
+
+
+class CoalesceTests(SimpleTestCase):
+    async def _collect(self, source, **kwargs):
+        return [chunk async for chunk in coalesce(source, **kwargs)]
+
+    async def _spaced(self, *items, gap=0.005):
+        for i, item in enumerate(items):
+            if i:
+                await asyncio.sleep(gap)
+            yield item
+
+    async def test_disabled_passes_through(self):
+        self.assertEqual(await self._collect(self._spaced(b"a", b"b", gap=0), flush_ms=0), [b"a", b"b"])
+
+    async def test_ready_chunks_go_out_together(self):
+        self.assertEqual(await self._collect(self._spaced(b"a", b"b", b"c", gap=0), flush_ms=50), [b"abc"])
+
+    async def test_first_chunk_not_delayed_rest_batched(self):
+        # 第一包不等；之后 flush_ms 之内来的合成一包
+        self.assertEqual(await self._collect(self._spaced(b"a", b"b", b"c"), flush_ms=50), [b"a", b"bc"])
+
+    async def test_max_bytes_flushes_early(self):
+        out = await self._collect(self._spaced(*[b"x" * 10] * 6, gap=0), flush_ms=50, max_bytes=25)
+        self.assertEqual(b"".join(out), b"x" * 60)
+        self.assertTrue(all(len(chunk) <= 30 for chunk in out))
+
+    async def test_close_closes_source(self):
+        source = _SlowSource(b"a")
+        stream = coalesce(source, flush_ms=50)
+        self.assertEqual(await anext(stream), b"a")
+        await stream.aclose()
+        self.assertTrue(source.read_cancelled)
+        self.assertTrue(source.closed)
+
+
+class ChatStreamRawTests(ChatStreamTestCase):
+    async def test_raw_bytes_untouched_and_stat_used(self):
+        content, record = await self._post([ADP_SSE[:30], ADP_SSE[30:]], session_id="s1", raw=True)
+        self.assertEqual(content, ADP_SSE)
+        self.assertEqual(record["llm_out_tokens"] + record["llm_in_tokens"], 30)
+
+    async def test_raw_without_token_stat_estimates_from_replies(self):
+        replies = b"".join(
+            b'data: {"type":"reply","payload":{"content":"' + text.encode() + b'"}}\n\n'
+            for text in ("hello ", "world, this is a longer reply")
+        )
+        content, record = await self._post([replies], session_id="s1", raw=True)
+        self.assertEqual(content, replies)
+        self.assertGreater(record["llm_out_tokens"], 0)
+        self.assertGreater(record["cost_cents"], 0)
+
+
+class ReplyClassifierTests(SimpleTestCase):
+    TEXT = '为您找到：{"hotel_id": 1, "name": "全季{东站}店", "note": "含\\"早\\""}，请查看{"x": {"y": 2}}完'
+
+    def _run(self, chunks):
+        c = ReplyClassifier()
+        out = []
+        for chunk in chunks:
+            out.extend(c.feed(chunk))
+        out.extend(c.finish())
+        # 正文可能被拆成几段：相邻的 result 合并后再比
+        merged = []
+        for item in out:
+            if item["type"] == "result" and merged and merged[-1]["type"] == "result":
+                merged[-1] = {"type": "result", "data": merged[-1]["data"] + item["data"]}
+            else:
+                merged.append(item)
+        return merged
+
+    def test_cards_and_text(self):
+        out = self._run([self.TEXT])
+        self.assertEqual([item["type"] for item in out], ["result", "card", "result", "card", "result"])
+        self.assertEqual(out[1]["data"], {"hotel_id": 1, "name": "全季{东站}店", "note": '含"早"'})
+        self.assertEqual(out[3]["data"], {"x": {"y": 2}})
+        self.assertEqual(out[4]["data"], "完")
+
+    def test_split_deltas_give_same_result(self):
+        expected = self._run([self.TEXT])
+        self.assertEqual(self._run(list(self.TEXT)), expected)
+        for i in range(1, len(self.TEXT)):
+            with self.subTest(split=i):
+                self.assertEqual(self._run([self.TEXT[:i], self.TEXT[i:]]), expected)
+
+    def test_unclosed_block_is_flushed_as_raw_card(self):
+        self.assertEqual(self._run(['好的{"a": 1']), [
+            {"type": "result", "data": "好的"},
+            {"type": "card", "data": '{"a": 1'},
+        ])
+
+    def test_thought_sent_once_per_change(self):
+        seen = {}
+
+        def thought(*contents):
+            return {"procedures": [{"debugging": {"content": c}} for c in contents]}
+
+        self.assertEqual(thought_deltas(thought("查询酒店", ""), seen), ["查询酒店"])
+        self.assertEqual(thought_deltas(thought("查询酒店", "整理结果"), seen), ["整理结果"])
+        # 太长的是调试输出，不当提示发
+        self.assertEqual(thought_deltas(thought("查询酒店", "x" * 31), seen), [])
+
+
+class AgentTTSPipelineTests(SimpleTestCase):
+    """
+    tencent_tts_stream 换成假的：每句 delays[text] 秒后吐一块音频
+    """
+
+    def setUp(self):
+        self.delays = {}
+        self.active = 0
+        self.max_active = 0
+
+        async def fake_tts(*, text, codec="pcm", pool=None):
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            try:
+                await asyncio.sleep(self.delays.get(text, 0.01))
+            finally:
+                self.active -= 1
+            yield ("audio", text.encode())
+
+        patcher = mock.patch.object(consumers, "tencent_tts_stream", fake_tts)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def _turn(self, agent, *segments):
+        agent.turn_id += 1
+        agent._tts_turn_done.clear()
+        for seg in segments:
+            await agent.tts_queue.put(("SEG", agent.turn_id, seg))
+        await agent.tts_queue.put(("TURN_END", agent.turn_id, None))
+        await asyncio.wait_for(agent._tts_turn_done.wait(), 2)
+
+    def _audio(self, agent):
+        return [m.decode() for m in agent.sent if isinstance(m, bytes)]
+
+    async def test_parallel_synthesis_plays_in_order(self):
+        # 第一句合成最慢：后面的先合成好也要排在它后面播
+        self.delays = {"一。": 0.05, "二。": 0.0, "三。": 0.01}
+        agent = await _agent()
+        await self._turn(agent, "一。", "二。", "三。")
+        self.assertEqual(self._audio(agent), ["一。", "二。", "三。"])
+        self.assertGreater(self.max_active, 1)
+        seqs = [m["seq"] for m in agent.sent if isinstance(m, dict) and m["type"] == "tts_start"]
+        self.assertEqual(seqs, sorted(seqs))
+        await agent.disconnect(1000)
+
+    async def test_barge_in_while_sending_tts_start(self):
+        # 句子已经合成好、player 正在发 tts_start 时用户插话：这句不能再播
+        agent = await _agent()
+        send = agent.send
+
+        async def send_and_barge(text_data=None, bytes_data=None, **kwargs):
+            await send(text_data=text_data, bytes_data=bytes_data, **kwargs)
+            if text_data and json.loads(text_data)["type"] == "tts_start" and agent.turn_id == 1:
+                # 发得慢：这期间合成已经结束，打断时没有在跑的合成任务可取消
+                await asyncio.sleep(0.03)
+                await agent._interrupt_tts(reason="barge_in_test")
+
+        agent.send = send_and_barge
+        agent.turn_id = 1
+        await agent.tts_queue.put(("SEG", 1, "旧的。"))
+        await asyncio.sleep(0.05)
+        await self._turn(agent, "新的。")
+        self.assertEqual(self._audio(agent), ["新的。"])
+        await agent.disconnect(1000)
+
+    async def test_interrupt_stops_turn_and_player_survives(self):
+        self.delays = {"慢。": 0.05}
+        agent = await _agent()
+        agent.turn_id = 1
+        agent._tts_turn_done.clear()
+        for seg in ("慢。", "后面。"):
+            await agent.tts_queue.put(("SEG", 1, seg))
+        await asyncio.sleep(0.01)
+        await agent._interrupt_tts(reason="barge_in_test")
+        # 打断之后这一轮还在往队列里放的句子也不播
+        await agent.tts_queue.put(("SEG", 1, "打断后。"))
+        await self._turn(agent, "下一轮。")
+        self.assertEqual(self._audio(agent), ["下一轮。"])
+        self.assertFalse(agent.tts_player_task.done())
+        await agent.disconnect(1000)
+        await asyncio.sleep(0)
+        self.assertTrue(agent.tts_player_task.done() and agent.tts_task.done())
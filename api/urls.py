@@ -1,6 +1,9 @@
 from django.urls import path
 from .views import (
     HotelSearchAPIView,
+    HotelCacheStatsAPIView,
+    UsageSinkStatsAPIView,
+    UsageStatsAPIView,
     ChatStreamAPIView,
     CancelSessionAPIView,
     AdpChatFeedbackAPIView
@@ -9,6 +12,9 @@ from . import views
 app_name = "poc"
 urlpatterns = [
     path("hotel/search/", HotelSearchAPIView.as_view()),
+    path("hotel/cache/stats/", HotelCacheStatsAPIView.as_view()),
+    path("usage/sink/stats/", UsageSinkStatsAPIView.as_view()),
+    path("usage/stats/", UsageStatsAPIView.as_view()),
     path("chat/stream/", ChatStreamAPIView.as_view()),
     path("session/cancel/", CancelSessionAPIView.as_view()),
     path("chat/stream/", views.adp_chat_stream),
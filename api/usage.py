@@ -1,15 +1,210 @@
+import atexit
+import logging
+import queue
+import threading
 import time
+from decimal import Decimal
 from typing import Optional
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, connection
+from django.utils import timezone
+
 from .models import UsageRecord, ConversationSession
+from .usage_rollup import aggregate, apply_rollups, sink_horizon
+from .utils.tokens import estimate_tokens, token_usage_from_stat
+
+logger = logging.getLogger(__name__)
+
+
+class UsageSink:
+    """
+    用量记录异步落库：
+      commit() 只把一条轻量记录塞进有界队列（满了直接丢，计数 dropped）
+      后台线程攒够 batch 条或等满 flush_ms 毫秒就 bulk_create 一次
+      进程退出时 atexit 把队列里剩下的刷完
+    """
+
+    def __init__(self, maxsize: int, batch: int, flush_ms: int):
+        self.batch = batch
+        self.flush_interval = flush_ms / 1000
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.enqueued = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.batches = 0
+        self.errors = 0
+        self.rollup_errors = 0
+        self.rollup_late = 0
+
+    def put(self, record: dict) -> bool:
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def _start(self):
+        # 第一次 put 时才起线程：fork 出来的每个 worker 各有一个
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="usage-sink-flusher", daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _take_batch(self) -> list:
+        """
+        阻塞到第一条，然后最多再等 flush_interval 秒凑满 batch 条
+        """
+        try:
+            items = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(items) < self.batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                items = self._take_batch()
+                if items:
+                    self._write(items)
+        finally:
+            connection.close()
+
+    def _insert(self, items: list):
+        # 刷新线程的连接一直不还：过了 CONN_MAX_AGE / 出过错的先关掉，超过 wait_timeout 被服务端断开的
+        # 第一次写会报 OperationalError，关掉重连再写一次（一批 <= batch 条，是一条 INSERT，重试不会重复）
+        close_old_connections()
+        try:
+            UsageRecord.objects.bulk_create([UsageRecord(**r) for r in items], batch_size=self.batch)
+        except OperationalError:
+            logger.warning("usage sink: db connection lost, retrying batch once", exc_info=True)
+            connection.close()
+            UsageRecord.objects.bulk_create([UsageRecord(**r) for r in items], batch_size=self.batch)
+
+    def _write(self, items: list):
+        try:
+            self._insert(items)
+        except Exception:
+            logger.exception("usage sink: bulk_create of %d records failed", len(items))
+            with self._lock:
+                self.errors += 1
+                self.dropped += len(items)
+            return
+        with self._lock:
+            self.flushed += len(items)
+            self.batches += 1
+
+        # 同一批顺手合并进 usage_rollup；失败不影响明细，rollup_usage 命令可以补
+        # 在队列里积压太久的记录不合并：那些桶可能正在被 rollup_usage 重算，留给它算
+        if settings.USAGE_ROLLUPS_ENABLED:
+            horizon = sink_horizon()
+            live = [r for r in items if r["created_at"] >= horizon]
+            if len(live) < len(items):
+                with self._lock:
+                    self.rollup_late += len(items) - len(live)
+            try:
+                if live:
+                    apply_rollups(aggregate(live))
+            except Exception:
+                logger.exception("usage sink: rollup of %d records failed", len(items))
+                with self._lock:
+                    self.rollup_errors += 1
+
+    def drain(self) -> int:
+        """
+        当前线程把队列里剩下的全部写掉（停机 / 测试用）
+        """
+        total = 0
+        while True:
+            items = []
+            try:
+                while len(items) < self.batch:
+                    items.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not items:
+                return total
+            self._write(items)
+            total += len(items)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.drain()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "maxsize": self._queue.maxsize,
+                "enqueued": self.enqueued,
+                "dropped": self.dropped,
+                "flushed": self.flushed,
+                "batches": self.batches,
+                "errors": self.errors,
+                "rollup_errors": self.rollup_errors,
+                "rollup_late": self.rollup_late,
+            }
+
+
+usage_sink = UsageSink(
+    maxsize=settings.USAGE_BUFFER_SIZE,
+    batch=settings.USAGE_FLUSH_BATCH,
+    flush_ms=settings.USAGE_FLUSH_MS,
+)
+
+
+def compute_cost_cents(app: str, in_tokens: int, out_tokens: int) -> Decimal:
+    """
+    ADP_PRICE_TABLE：{app: {"in": 每千 token 分, "out": 每千 token 分}}，没配的 app 用 "default"
+    """
+    table = settings.ADP_PRICE_TABLE
+    price = table.get(app) or table.get("default") or {}
+    cost = (in_tokens * Decimal(str(price.get("in", 0))) + out_tokens * Decimal(str(price.get("out", 0)))) / 1000
+    return cost.quantize(Decimal("0.0001"))
+
 
 class UsageRecorder:
-    def __init__(self, *, client_id: str, endpoint: str, session: Optional[ConversationSession] = None):
+    def __init__(
+        self,
+        *,
+        client_id: str,
+        endpoint: str,
+        session: Optional[ConversationSession] = None,
+        app: str = "",
+    ):
         self.client_id = client_id
         self.endpoint = endpoint
         self.session = session
+        self.app = app or ""
         self.start_ts = time.time()
         self.tool_calls = 0
         self.success = True
+        # ADP token_stat 给的准确值（累计值，后来的覆盖前面的）；没有就用文本估算
+        self.stat_tokens = None
+        self.est_in_tokens = 0
+        self.est_out_tokens = 0
 
     def inc_tool(self, n: int = 1):
         self.tool_calls += n
@@ -17,13 +212,49 @@ class UsageRecorder:
     def mark_failed(self):
         self.success = False
 
+    def add_input_text(self, text: str):
+        self.est_in_tokens += estimate_tokens(text)
+
+    def add_output_text(self, text: str):
+        self.est_out_tokens += estimate_tokens(text)
+
+    def observe_adp_event(self, obj: dict):
+        """
+        喂一条解析好的 ADP SSE 事件：token_stat 取准确用量，reply 文本留着兜底估算
+        """
+        kind = obj.get("type")
+        payload = obj.get("payload") or {}
+        if kind == "token_stat":
+            usage = token_usage_from_stat(payload)
+            if usage is not None:
+                self.stat_tokens = usage
+        elif kind == "reply":
+            flag = payload.get("is_from_self", False)
+            if flag is True or flag == 1 or (isinstance(flag, str) and flag.lower() in ("true", "1", "yes")):
+                return
+            content = payload.get("content")
+            if isinstance(content, str):
+                self.add_output_text(content)
+
+    def token_usage(self):
+        if self.stat_tokens is not None:
+            return self.stat_tokens
+        return self.est_in_tokens, self.est_out_tokens
+
     def commit(self):
         latency_ms = int((time.time() - self.start_ts) * 1000)
-        UsageRecord.objects.create(
-            session=self.session,
-            client_id=self.client_id,
-            endpoint=self.endpoint,
-            success=self.success,
-            latency_ms=latency_ms,
-            tool_calls=self.tool_calls,
-        )
+        in_tokens, out_tokens = self.token_usage()
+        # 不在请求线程写库：入队，后台批量 bulk_create
+        usage_sink.put({
+            "session_id": self.session.pk if self.session is not None else None,
+            "client_id": self.client_id,
+            "endpoint": self.endpoint,
+            "app": self.app,
+            "success": self.success,
+            "latency_ms": latency_ms,
+            "tool_calls": self.tool_calls,
+            "llm_in_tokens": in_tokens,
+            "llm_out_tokens": out_tokens,
+            "cost_cents": compute_cost_cents(self.app, in_tokens, out_tokens),
+            "created_at": timezone.now(),
+        })
@@ -0,0 +1,320 @@
+# api/usage_rollup.py
+"""
+用量预聚合（分钟 / 小时两档），按 (client_id, endpoint, success) 分组：
+  次数、延迟总和/最大值、延迟直方图（固定对数分桶）、工具调用数、token、费用
+UsageSink 每写一批 usage_record 就顺手把这批合并进 usage_rollup（增量）；
+rollup_usage 命令按时间段从 usage_record 全量重算（补数 / 修复）
+两边按时间错开（USAGE_ROLLUP_LATE_SECONDS）：sink 只碰最近的桶，重算只碰更早的整小时，不会重复计数
+分钟桶只保留 USAGE_ROLLUP_MINUTE_RETENTION_DAYS 天（retention 命令清理），小时桶一直留着
+"""
+import bisect
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import UsageRecord, UsageRollup
+
+# 延迟分桶上界（毫秒，1-2-5 对数刻度）；最后一个桶是 >60s
+LATENCY_BUCKETS_MS = [
+    5, 10, 20, 50, 100, 200, 500,
+    1000, 2000, 5000, 10000, 20000, 60000,
+]
+HIST_SIZE = len(LATENCY_BUCKETS_MS) + 1
+
+GRANULARITIES = {
+    UsageRollup.MINUTE: lambda ts: ts.replace(second=0, microsecond=0),
+    UsageRollup.HOUR: lambda ts: ts.replace(minute=0, second=0, microsecond=0),
+}
+BUCKET_SIZES = {
+    UsageRollup.MINUTE: timedelta(minutes=1),
+    UsageRollup.HOUR: timedelta(hours=1),
+}
+
+# 撞唯一约束 / MySQL 死锁（1213）/ 锁等待超时（1205）时整块重试的次数
+APPLY_ATTEMPTS = 3
+_RETRY_MYSQL_ERRORS = (1213, 1205)
+
+
+def sink_horizon(now=None):
+    """
+    sink 只合并 created_at >= 这个时间的记录
+    """
+    return (now or timezone.now()) - timedelta(seconds=settings.USAGE_ROLLUP_LATE_SECONDS)
+
+
+def rebuild_horizon(now=None):
+    """
+    重算只碰这个时间之前的整小时：比 sink 的界线再早一个 LATE，sink 正在写的批不会落进来
+    """
+    return GRANULARITIES[UsageRollup.HOUR](
+        (now or timezone.now()) - timedelta(seconds=2 * settings.USAGE_ROLLUP_LATE_SECONDS)
+    )
+
+
+def minute_horizon(now=None):
+    """
+    分钟桶只保留这个时间之后的；更早的窗口统计走小时桶
+    """
+    return GRANULARITIES[UsageRollup.MINUTE](now or timezone.now()) - timedelta(
+        days=settings.USAGE_ROLLUP_MINUTE_RETENTION_DAYS
+    )
+
+
+def prune_minute_rollups(batch: int = 5000, dry_run: bool = False) -> int:
+    """
+    删掉 minute_horizon() 之前的分钟桶：按主键分批删，每批一个短事务，不长时间锁表
+    """
+    qs = UsageRollup.objects.filter(granularity=UsageRollup.MINUTE, bucket_start__lt=minute_horizon())
+    if dry_run:
+        return qs.count()
+    total = 0
+    while True:
+        ids = list(qs.values_list("pk", flat=True)[:batch])
+        if not ids:
+            return total
+        total += UsageRollup.objects.filter(pk__in=ids).delete()[0]
+
+
+def bucket_index(latency_ms: int) -> int:
+    return bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)
+
+
+def merge_hist(a: list, b: list) -> list:
+    a = list(a) + [0] * (HIST_SIZE - len(a))
+    for i, n in enumerate(b):
+        a[i] += n
+    return a
+
+
+def percentile(hist: list, q: float):
+    """
+    直方图估分位数：返回所在桶的上界（最后一个桶返回 None 表示 >60s）
+    """
+    total = sum(hist)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, n in enumerate(hist):
+        seen += n
+        if seen >= rank:
+            return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else None
+    return None
+
+
+class _Acc:
+    __slots__ = ("count", "latency_sum", "latency_max", "hist", "tool_calls", "in_tokens", "out_tokens", "cost")
+
+    def __init__(self):
+        self.count = 0
+        self.latency_sum = 0
+        self.latency_max = 0
+        self.hist = [0] * HIST_SIZE
+        self.tool_calls = 0
+        self.in_tokens = 0
+        self.out_tokens = 0
+        self.cost = Decimal(0)
+
+    def add(self, r: dict):
+        latency = int(r.get("latency_ms") or 0)
+        self.count += 1
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.hist[bucket_index(latency)] += 1
+        self.tool_calls += int(r.get("tool_calls") or 0)
+        self.in_tokens += int(r.get("llm_in_tokens") or 0)
+        self.out_tokens += int(r.get("llm_out_tokens") or 0)
+        self.cost += Decimal(r.get("cost_cents") or 0)
+
+
+def aggregate(records) -> dict:
+    """
+    records: usage_record 字段的 dict（UsageSink 的队列元素 / values() 结果）
+    返回 {(granularity, bucket_start, client_id, endpoint, success): _Acc}
+    """
+    out = defaultdict(_Acc)
+    for r in records:
+        ts = r["created_at"]
+        for g, trunc in GRANULARITIES.items():
+            out[(g, trunc(ts), r["client_id"], r["endpoint"], bool(r["success"]))].add(r)
+    return out
+
+
+def _apply(deltas: dict):
+    keys = sorted(deltas)
+    q = Q()
+    for g, start, client_id, endpoint, success in keys:
+        q |= Q(granularity=g, bucket_start=start, client_id=client_id, endpoint=endpoint, success=success)
+
+    with transaction.atomic():
+        existing = {
+            (r.granularity, r.bucket_start, r.client_id, r.endpoint, r.success): r
+            for r in UsageRollup.objects.select_for_update().filter(q)
+        }
+        to_update, to_create = [], []
+        for key, acc in deltas.items():
+            row = existing.get(key)
+            if row is None:
+                g, start, client_id, endpoint, success = key
+                row = UsageRollup(
+                    granularity=g, bucket_start=start, client_id=client_id, endpoint=endpoint, success=success,
+                    latency_hist=[0] * HIST_SIZE,
+                )
+                to_create.append(row)
+            else:
+                to_update.append(row)
+            row.count += acc.count
+            row.latency_sum_ms += acc.latency_sum
+            row.latency_max_ms = max(row.latency_max_ms, acc.latency_max)
+            row.latency_hist = merge_hist(row.latency_hist, acc.hist)
+            row.tool_calls += acc.tool_calls
+            row.llm_in_tokens += acc.in_tokens
+            row.llm_out_tokens += acc.out_tokens
+            row.cost_cents = Decimal(row.cost_cents) + acc.cost
+
+        if to_update:
+            UsageRollup.objects.bulk_update(
+                to_update,
+                ["count", "latency_sum_ms", "latency_max_ms", "latency_hist", "tool_calls",
+                 "llm_in_tokens", "llm_out_tokens", "cost_cents"],
+            )
+        if to_create:
+            UsageRollup.objects.bulk_create(to_create)
+
+
+def _retryable(e: Exception) -> bool:
+    if isinstance(e, IntegrityError):
+        return True
+    # 死锁时 MySQL 回滚的是整个事务：外面还包着事务（rebuild）就不能只重试这一块
+    return (
+        isinstance(e, OperationalError)
+        and bool(e.args) and e.args[0] in _RETRY_MYSQL_ERRORS
+        and not connection.in_atomic_block
+    )
+
+
+def apply_rollups(deltas: dict, chunk: int = 200) -> int:
+    """
+    把增量合并进 usage_rollup（读-改-写，select_for_update 锁住已有行）
+    两个 worker 同时新建同一个桶会撞唯一约束，并发的 select_for_update 可能死锁：整块重试，
+    第二次能读到对方建的行；key 排序后加锁顺序一致，死锁本身也少
+    """
+    keys = sorted(deltas)
+    for i in range(0, len(keys), chunk):
+        part = {k: deltas[k] for k in keys[i:i + chunk]}
+        for attempt in range(APPLY_ATTEMPTS):
+            try:
+                _apply(part)
+                break
+            except (IntegrityError, OperationalError) as e:
+                if attempt == APPLY_ATTEMPTS - 1 or not _retryable(e):
+                    raise
+                time.sleep(0.05 * (attempt + 1))
+    return len(keys)
+
+
+def rebuild_rollups(since, until, batch: int = 20000) -> int:
+    """
+    从 usage_record 重算 [since, until) 的 rollup；边界按小时对齐，避免把小时桶算一半
+    until 最晚到 rebuild_horizon()：更近的桶 sink 还在增量写，重算会和它重复计数
+    """
+    since = GRANULARITIES[UsageRollup.HOUR](since)
+    until = min(GRANULARITIES[UsageRollup.HOUR](until) + timedelta(hours=1), rebuild_horizon())
+    if since >= until:
+        return 0
+    # 已经过了保留期的分钟桶不再生成
+    horizon = minute_horizon()
+
+    def live(deltas):
+        return {k: v for k, v in deltas.items() if k[0] != UsageRollup.MINUTE or k[1] >= horizon}
+
+    with transaction.atomic():
+        UsageRollup.objects.filter(bucket_start__gte=since, bucket_start__lt=until).delete()
+        rows = (
+            UsageRecord.objects.filter(created_at__gte=since, created_at__lt=until)
+            .values("created_at", "client_id", "endpoint", "success", "latency_ms", "tool_calls",
+                    "llm_in_tokens", "llm_out_tokens", "cost_cents")
+            .iterator(chunk_size=batch)
+        )
+        total = 0
+        buf = []
+        for r in rows:
+            buf.append(r)
+            if len(buf) >= batch:
+                apply_rollups(live(aggregate(buf)))
+                total += len(buf)
+                buf = []
+        if buf:
+            apply_rollups(live(aggregate(buf)))
+            total += len(buf)
+    return total
+
+
+def stats_window(since, until, now=None):
+    """
+    窗口 <= 6 小时、且分钟桶还在保留期内时用分钟桶，否则用小时桶；对齐成整桶 [start, end)：
+    since 落在桶中间时从下一个桶开始（不把 since 之前的数据算进来），until 所在的桶算进来（到现在为止的数据）
+    返回 (granularity, start, end)
+    """
+    short = until - since <= timedelta(hours=6)
+    g = UsageRollup.MINUTE if short and since >= minute_horizon(now) else UsageRollup.HOUR
+    trunc, size = GRANULARITIES[g], BUCKET_SIZES[g]
+    start = trunc(since)
+    if start < since:
+        start += size
+    end = trunc(until)
+    if end < until:
+        end += size
+    return g, start, end
+
+
+def usage_stats(client_id: str, since, until, endpoint: str = None) -> list:
+    """
+    只读 usage_rollup：按 endpoint 汇总次数、失败数、延迟分位数、token、费用
+    实际统计的窗口见 stats_window()
+    """
+    g, start, end = stats_window(since, until)
+    qs = UsageRollup.objects.filter(client_id=client_id, granularity=g, bucket_start__gte=start, bucket_start__lt=end)
+    if endpoint:
+        qs = qs.filter(endpoint=endpoint)
+
+    by_endpoint = defaultdict(lambda: {
+        "count": 0, "errors": 0, "latency_sum_ms": 0, "latency_max_ms": 0, "hist": [0] * HIST_SIZE,
+        "tool_calls": 0, "llm_in_tokens": 0, "llm_out_tokens": 0, "cost_cents": Decimal(0),
+    })
+    for r in qs.iterator():
+        s = by_endpoint[r.endpoint]
+        s["count"] += r.count
+        if not r.success:
+            s["errors"] += r.count
+        s["latency_sum_ms"] += r.latency_sum_ms
+        s["latency_max_ms"] = max(s["latency_max_ms"], r.latency_max_ms)
+        s["hist"] = merge_hist(s["hist"], r.latency_hist)
+        s["tool_calls"] += r.tool_calls
+        s["llm_in_tokens"] += r.llm_in_tokens
+        s["llm_out_tokens"] += r.llm_out_tokens
+        s["cost_cents"] += Decimal(r.cost_cents)
+
+    result = []
+    for name, s in sorted(by_endpoint.items()):
+        result.append({
+            "endpoint": name,
+            "count": s["count"],
+            "errors": s["errors"],
+            "latency_avg_ms": round(s["latency_sum_ms"] / s["count"], 1) if s["count"] else None,
+            "latency_p50_ms": percentile(s["hist"], 0.50),
+            "latency_p95_ms": percentile(s["hist"], 0.95),
+            "latency_p99_ms": percentile(s["hist"], 0.99),
+            "latency_max_ms": s["latency_max_ms"],
+            "tool_calls": s["tool_calls"],
+            "llm_in_tokens": s["llm_in_tokens"],
+            "llm_out_tokens": s["llm_out_tokens"],
+            "cost_cents": str(s["cost_cents"]),
+        })
+    return result
@@ -1,19 +1,155 @@
 # api/utils/adp_stream.py
 import os
 import json
+import re
+
 import httpx
 from dotenv import load_dotenv
 load_dotenv()
 ADP_URL = os.getenv("ADP_URL")
 
+from ..cancel import until_cancelled
+from .sse import aiter_sse
+from .upstream import STREAM_TIMEOUT, get_async_client
+
+# adp_stream_reply 会用到的 ADP 事件
+ADP_EVENT_TYPES = ("reply", "thought", "token_stat")
+
+def get_adp_client() -> httpx.AsyncClient:
+    """
+    ADP 的共享 AsyncClient（见 upstream.py），流式请求记得传 timeout=STREAM_TIMEOUT
+    """
+    return get_async_client(ADP_URL)
+
+# JSON 块里只关心这几个字符：字符串引号、转义、花括号
+_JSON_TOKEN_RE = re.compile(r'["\\{}]')
+# thought 里的调试文本超过这个长度就不当"思考中"提示发给前端
+THINK_MAX_LEN = 30
+
+
+class ReplyClassifier:
+    """
+    reply 增量文本的流式分类，每个字符最多看一次：
+      正文          -> {"type": "result", "data": str}   可以直接念 / 落库
+      {...} JSON 块 -> {"type": "card", "data": dict}    酒店卡片之类，解析好再给前端；解析失败给原文 str
+    JSON 块可以跨多个 delta，字符串里的花括号、转义按 JSON 规则跳过
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_str = False
+        self.escape = False
+        self.parts = []
+
+    def feed(self, text: str) -> list:
+        out = []
+        pos = 0
+        n = len(text)
+        while pos < n:
+            if self.depth == 0:
+                i = text.find("{", pos)
+                if i < 0:
+                    out.append({"type": "result", "data": text[pos:]})
+                    break
+                if i > pos:
+                    out.append({"type": "result", "data": text[pos:i]})
+                self.depth = 1
+                self.parts = []
+                start = pos = i + 1
+                self.parts.append("{")
+            else:
+                start = pos
+            # JSON 块内部：从一个特殊字符跳到下一个
+            while True:
+                if self.escape:
+                    if pos >= n:
+                        self.parts.append(text[start:])
+                        break
+                    pos += 1
+                    self.escape = False
+                    continue
+                m = _JSON_TOKEN_RE.search(text, pos)
+                if m is None:
+                    self.parts.append(text[start:])
+                    pos = n
+                    break
+                ch = m.group()
+                pos = m.end()
+                if ch == "\\":
+                    if self.in_str:
+                        self.escape = True
+                elif ch == '"':
+                    self.in_str = not self.in_str
+                elif not self.in_str:
+                    if ch == "{":
+                        self.depth += 1
+                    else:
+                        self.depth -= 1
+                        if self.depth == 0:
+                            self.parts.append(text[start:pos])
+                            out.append(self._card())
+                            break
+        return out
+
+    def _card(self) -> dict:
+        raw = "".join(self.parts)
+        self.parts = []
+        self.depth = 0
+        self.in_str = self.escape = False
+        try:
+            return {"type": "card", "data": json.loads(raw)}
+        except ValueError:
+            return {"type": "card", "data": raw}
+
+    def finish(self) -> list:
+        """
+        流结束时还没闭合的 JSON 块：原文当 card 给出去
+        """
+        if self.depth:
+            return [self._card()]
+        return []
+
+
+def thought_deltas(payload: dict, seen: dict) -> list:
+    """
+    thought 事件 -> 要发给前端的短"思考中"文本；seen 记每个 procedure 上次发过的内容，重复的不再发
+    """
+    out = []
+    procedures = payload.get("procedures") or []
+    for index, item in enumerate(procedures):
+        if not isinstance(item, dict):
+            continue
+        content = (item.get("debugging") or {}).get("content") or ""
+        if not content or len(content) > THINK_MAX_LEN or seen.get(index) == content:
+            continue
+        seen[index] = content
+        out.append(content)
+    return out
+
+
 def pick_bot_app_key(app_flag: str) -> str:
     if app_flag == "s":
         return os.getenv("SOUTUI_APP_KEY")
     return os.getenv("DISNEY_APP_KEY")
 
-async def adp_stream_reply(*, session_id: str, visitor_biz_id: str, app: str, content: str, streaming_throttle: int = 10):
+async def adp_stream_reply(
+    *,
+    session_id: str,
+    visitor_biz_id: str,
+    app: str,
+    content: str,
+    streaming_throttle: int = 10,
+    recorder=None,
+    cancelled=None,
+):
     """
-    async generator: yield delta text from ADP SSE stream
+    async generator: yield 分好类的增量
+      {"type": "result", "data": str}   正文（可念、可落库）
+      {"type": "card", "data": dict}    回复里嵌的 JSON 块（解析失败是原文 str）
+      {"type": "think", "data": str}    思考中提示
+      {"type": "cancelled", "data": ""} 被中断（只在传了 cancelled 时）
+    recorder: 可选 UsageRecorder，token_stat / 回复文本会喂给它算用量
+    cancelled: 可选 asyncio.Event（cancel_watch 给的），set 了立刻关掉上游，最后 yield 一条 cancelled
     """
     payload = {
         "session_id": session_id,
@@ -36,45 +172,49 @@ async def adp_stream_reply(*, session_id: str, visitor_biz_id: str, app: str, co
         "Accept-Encoding": "identity",
     }
 
-    async with httpx.AsyncClient(timeout=None) as client:
-        async with client.stream("POST", ADP_URL, headers=headers, json=payload) as resp:
-            resp.raise_for_status()
-            async for line in resp.aiter_lines():
-                if not line or not line.startswith("data:"):
-                    continue
-                data_str = line[5:].strip()
-                if data_str == "[DONE]":
-                    break
+    if recorder is not None:
+        recorder.add_input_text(content)
+
+    classifier = ReplyClassifier()
+    thought_seen = {}
 
-                try:
-                    obj = json.loads(data_str)
-                except json.JSONDecodeError:
+    client = get_adp_client()
+    async with client.stream("POST", ADP_URL, headers=headers, json=payload, timeout=STREAM_TIMEOUT) as resp:
+        resp.raise_for_status()
+        chunks = resp.aiter_raw() if cancelled is None else until_cancelled(resp.aiter_raw(), cancelled)
+        # 只解析用得到的事件，其它（工作流、引用等）连 data 都不拼
+        async for event in aiter_sse(chunks, types=ADP_EVENT_TYPES):
+            if event.is_done:
+                break
+
+            try:
+                obj = event.json()
+            except ValueError:
+                continue
+            if recorder is not None:
+                recorder.observe_adp_event(obj)
+            # 这里按你 ADP 实际返回结构微调
+            kind = obj.get("type")
+            payload_obj = obj.get("payload") or {}
+            if kind == "reply":
+                flag = payload_obj.get("is_from_self", False)
+
+                # 兼容 bool / int / str
+                is_from_self = (flag is True) or (flag == 1) or (
+                            isinstance(flag, str) and flag.lower() in ("true", "1", "yes"))
+                if is_from_self:
                     continue
-                # 这里按你 ADP 实际返回结构微调
-                # yield {"type": "result", "data": json.dumps(obj, ensure_ascii=False, default=str)}
-                if obj.get("type") == "reply":
-                    # if obj.get("payload", {}).get("is_from_self", ""):
-                    #     continue
-                    flag = obj.get("payload",{}).get("is_from_self", False)
-
-                    # 兼容 bool / int / str
-                    is_from_self = (flag is True) or (flag == 1) or (
-                                isinstance(flag, str) and flag.lower() in ("true", "1", "yes"))
-                    if is_from_self:
-                        continue
-                    delta = obj.get("payload", {}).get("content", "")
-                    if isinstance(delta, str) and delta:
-                        print('delta',delta)
-                        yield {"type": "result","data": delta}
-                elif obj.get("type") == "thought":
-                    objs = obj.get("payload", {}).get("procedures",[])
-                    for index,item in enumerate(objs):
-                        try:
-                            if item.get("debugging",{}).get("content",""):
-                                delta=item.get("debugging",{}).get("content","")
-                                if len(delta)>30:
-                                    continue
-                                yield {"type": "think", "data": delta}
-                        except:
-                            continue
+                delta = payload_obj.get("content", "")
+                if isinstance(delta, str) and delta:
+                    # 正文 / JSON 卡片在这里分好类，下游不用再扫文本
+                    for item in classifier.feed(delta):
+                        yield item
+            elif kind == "thought":
+                for text in thought_deltas(payload_obj, thought_seen):
+                    yield {"type": "think", "data": text}
+
+    for item in classifier.finish():
+        yield item
 
+    if cancelled is not None and cancelled.is_set():
+        yield {"type": "cancelled", "data": ""}
@@ -0,0 +1,25 @@
+# api/utils/api_key.py
+"""
+API key 不落明文：库里只存 key_prefix（前 12 位，公开，用来定位）+ key_hash（HMAC-SHA256，带服务端 pepper）
+短 key（老数据）的 prefix 最多取一半长度：不能让 prefix 就是整个 key
+"""
+import hashlib
+import hmac
+import secrets
+
+from django.conf import settings
+
+KEY_PREFIX_LEN = 12
+
+
+def generate_api_key() -> str:
+    return "sk_" + secrets.token_urlsafe(32)
+
+
+def key_prefix(key: str) -> str:
+    return key[:min(KEY_PREFIX_LEN, len(key) // 2)]
+
+
+def hash_api_key(key: str) -> str:
+    pepper = settings.API_KEY_PEPPER.encode("utf-8")
+    return hmac.new(pepper, key.encode("utf-8"), hashlib.sha256).hexdigest()
@@ -0,0 +1,175 @@
+# api/utils/catalog_clean.py
+"""
+酒店目录导入的列清洗（纯 pandas，向量化，不依赖 Django）
+进程池 worker 只 import 这个模块，Windows 下 spawn 也不用初始化 Django
+"""
+import io
+
+import pandas as pd
+
+HOTEL_COLUMNS = ["hotel_id", "name", "brand", "business_area", "row_hash"]
+STAR_COLUMNS = ["hotel_id", "experiencescore_mix", "row_hash"]
+POI_COLUMNS = ["hotel_id", "poiname"]
+OFFER_COLUMNS = [
+    "hotel_id",
+    "room_type",
+    "offer_name",
+    "room_price_origin",
+    "room_offer_price",
+    "offer_discount_text",
+    "offer_breakfast_policy",
+    "row_hash",
+]
+# 报价的业务主键（对应 idx_offer_hotel_room_offer），--delta 按它对齐新旧数据
+OFFER_KEY_COLUMNS = ["hotel_id", "room_type", "offer_name"]
+
+_NULLS = ["", "nan", "none", "null"]
+
+
+def clean_ids(col: pd.Series) -> pd.Series:
+    """
+    向量化版 canonical_hotel_id：去空白、去 ".0"、纯数字去前导 0；空值变 NA
+    """
+    s = col.astype("string").str.strip().str.replace(r"^(\d+)\.0$", r"\1", regex=True)
+    digits = s.str.fullmatch(r"\d+").fillna(False).astype(bool)
+    stripped = s.str.lstrip("0").mask(lambda x: x == "", "0")
+    s = s.where(~digits, stripped)
+    return s.mask(s.str.lower().isin(_NULLS))
+
+
+def clean_text(col: pd.Series, strip: bool = False) -> pd.Series:
+    s = col.astype("string")
+    if strip:
+        s = s.str.strip()
+        s = s.mask(s == "")
+    return s
+
+
+def clean_decimal(col: pd.Series) -> pd.Series:
+    return pd.to_numeric(col, errors="coerce").round(2)
+
+
+def hash_rows(df: pd.DataFrame, columns) -> pd.Series:
+    """
+    每行内容的 64 位哈希（pandas 固定 hash key，跨进程/跨次导入稳定），16 位 hex
+    """
+    h = pd.util.hash_pandas_object(df[columns].astype("string"), index=False)
+    return h.map("{:016x}".format)
+
+
+def offer_keys(df: pd.DataFrame) -> pd.Series:
+    """
+    报价业务主键哈希（uint64），库里已有的行也用同一个函数算，保证能对上
+    """
+    return pd.util.hash_pandas_object(df[OFFER_KEY_COLUMNS].astype("string"), index=False)
+
+
+def offer_slots(keys: pd.Series, ordinals: pd.Series) -> pd.Series:
+    """
+    业务主键不唯一（同房型同报价名可以有多条）：(key, 第几次出现) 再哈希一次当槽位
+    源文件第 n 条和库里按 id 排第 n 条对齐
+    """
+    df = pd.DataFrame({"key": keys.to_numpy(), "n": ordinals.to_numpy()})
+    return pd.util.hash_pandas_object(df, index=False).set_axis(keys.index)
+
+
+def to_rows(df: pd.DataFrame, columns) -> list:
+    """
+    DataFrame -> [tuple, ...]，NA 统一成 None（ORM / executemany 都能直接用）
+    """
+    df = df[columns].astype(object)
+    df = df.where(df.notna(), None)
+    return list(df.itertuples(index=False, name=None))
+
+
+def clean_hotels(df: pd.DataFrame) -> pd.DataFrame:
+    # columns: 华住id, 酒店名称, 品牌, 商业区
+    df = df.rename(columns={
+        "华住id": "hotel_id",
+        "酒店名称": "name",
+        "品牌": "brand",
+        "商业区": "business_area",
+    })
+    out = pd.DataFrame({
+        "hotel_id": clean_ids(df["hotel_id"]),
+        "name": clean_text(df["name"]),
+        "brand": clean_text(df["brand"]),
+        "business_area": clean_text(df["business_area"]),
+    })
+    out = out.dropna(subset=["hotel_id"]).drop_duplicates("hotel_id", keep="last")
+    out["row_hash"] = hash_rows(out, ["name", "brand", "business_area"])
+    return out
+
+
+def clean_stars(df: pd.DataFrame) -> pd.DataFrame:
+    # columns: hotelno, experiencescore_mix
+    df = df.rename(columns={"hotelno": "hotel_id"})
+    out = pd.DataFrame({
+        "hotel_id": clean_ids(df["hotel_id"]),
+        "experiencescore_mix": clean_decimal(df["experiencescore_mix"]),
+    })
+    out = out.dropna(subset=["hotel_id"]).drop_duplicates("hotel_id", keep="last")
+    out["row_hash"] = hash_rows(out, ["experiencescore_mix"])
+    return out
+
+
+def clean_pois(df: pd.DataFrame) -> pd.DataFrame:
+    # columns: hotelno, poiname
+    df = df.rename(columns={"hotelno": "hotel_id"})
+    out = pd.DataFrame({
+        "hotel_id": clean_ids(df["hotel_id"]),
+        "poiname": clean_text(df["poiname"], strip=True),
+    })
+    # uniq_hotel_poiname：这里先去重，省得数据库报冲突
+    return out.dropna().drop_duplicates(["hotel_id", "poiname"])
+
+
+def clean_offers(df: pd.DataFrame) -> pd.DataFrame:
+    out = pd.DataFrame({
+        "hotel_id": clean_ids(df["hotel_id"]),
+        "room_type": clean_text(df["room_type"]),
+        "offer_name": clean_text(df["offer_name"]),
+        "room_price_origin": clean_decimal(df["room_price_origin"]),
+        "room_offer_price": clean_decimal(df["room_offer_price"]),
+        "offer_discount_text": clean_text(df["offer_discount_text"]),
+        "offer_breakfast_policy": clean_text(df["offer_breakfast_policy"]),
+    })
+    out = out.dropna(subset=["hotel_id"])
+    out["row_hash"] = hash_rows(out, OFFER_COLUMNS[3:-1])
+    return out
+
+
+def iter_csv_blocks(path, block_bytes: int):
+    """
+    按字节切 CSV：每块补齐到行尾，返回 (header_bytes, block_bytes)
+    要求字段内没有换行（报价 csv 满足）
+    """
+    with open(path, "rb") as f:
+        header = f.readline()
+        if header.startswith(b"\xef\xbb\xbf"):
+            header = header[3:]
+        while True:
+            block = f.read(block_bytes)
+            if not block:
+                return
+            if not block.endswith(b"\n"):
+                block += f.readline()
+            yield header, block
+
+
+def parse_offer_block(header: bytes, block: bytes) -> list:
+    """
+    进程池 worker：解析一块原始字节 + 向量化清洗，返回行 tuple
+    """
+    df = pd.read_csv(io.BytesIO(header + block), dtype=str)
+    return to_rows(clean_offers(df), OFFER_COLUMNS)
+
+
+def parse_offer_block_delta(header: bytes, block: bytes) -> pd.DataFrame:
+    """
+    --delta 用：清洗后带上业务主键哈希 key（第几次出现要跨块数，由主进程算）
+    """
+    df = pd.read_csv(io.BytesIO(header + block), dtype=str)
+    out = clean_offers(df)
+    out["key"] = offer_keys(out)
+    return out
@@ -0,0 +1,19 @@
+# api/utils/hotel_id.py
+
+
+def canonical_hotel_id(value) -> str | None:
+    """
+    酒店 ID 统一格式：去空白、去 pandas 读数字列带出的 ".0"、去前导 0
+    xlsx 里是 "0123456"，offer/星级 csv 里是 123456 / "123456.0"，统一成 "123456"
+    空值返回 None
+    """
+    if value is None:
+        return None
+    s = str(value).strip()
+    if not s or s.lower() in ("nan", "none", "null"):
+        return None
+    if s.endswith(".0") and s[:-2].isdigit():
+        s = s[:-2]
+    if s.isdigit():
+        s = s.lstrip("0") or "0"
+    return s
@@ -0,0 +1,286 @@
+# api/utils/sse.py
+"""
+SSE 转发工具：
+  coalesce()   把一串小 bytes 合并成少量大块再交给 ASGI server：
+               空闲后的第一包立即发（首字延迟不变），之后最多每 SSE_COALESCE_MS 毫秒 send 一次，
+               攒够 SSE_COALESCE_MAX_BYTES 也立即发
+  EventTap     原始字节透传时只挑出含某几个标记的 data 行（比如 token_stat 算用量），其余字节不解码不解析
+  SSEParser    增量 SSE 解析（按规范：event / data 多行 / id / retry / 注释行，\r\n、\r、\n 都认），
+               直接吃原始 bytes，不先解码成 str；types 过滤掉不要的事件（不拼 data、不 json 解析）
+               aiter_sse() / iter_sse() 是对 aiter_raw() / iter_raw() 的包装，ADP 的几个读流的地方共用
+               SSEEvent.type 是同一套类型判断（event: 字段或嗅探），转发时挑事件用
+"""
+import asyncio
+import json
+import re
+from contextlib import suppress
+
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:  # 可选依赖：装了 json 解析快几倍
+    orjson = None
+
+
+# 空闲后的第一包只等"马上就绪"的后续块（同一次 socket 读出来的几行）：最多让出这么多轮事件循环
+READY_TICKS = 8
+
+
+async def _settled(step, ticks: int = READY_TICKS) -> bool:
+    for _ in range(ticks):
+        if step.done():
+            return True
+        await asyncio.sleep(0)
+    return step.done()
+
+
+async def coalesce(chunks, flush_ms: int = None, max_bytes: int = None):
+    interval = (settings.SSE_COALESCE_MS if flush_ms is None else flush_ms) / 1000
+    max_bytes = settings.SSE_COALESCE_MAX_BYTES if max_bytes is None else max_bytes
+    it = chunks.__aiter__()
+    if interval <= 0:
+        async for chunk in it:
+            yield chunk
+        return
+
+    loop = asyncio.get_running_loop()
+    buf = []
+    size = 0
+    last_flush = float("-inf")
+    started = 0.0
+    eager = False
+    # 上游的下一次读取放在 task 里：等 flush 截止时间时不取消它，下一轮接着等
+    step = None
+    try:
+        while True:
+            if step is None:
+                step = asyncio.ensure_future(it.__anext__())
+            if not buf:
+                await asyncio.wait((step,))
+                started = loop.time()
+                # 距上次 send 已经超过 interval：这一包不等截止时间，捎上就绪的后续块就发
+                eager = started - last_flush >= interval
+            elif size < max_bytes:
+                if eager:
+                    if loop.time() - started < interval:
+                        await _settled(step)
+                else:
+                    timeout = last_flush + interval - loop.time()
+                    if timeout > 0:
+                        await asyncio.wait((step,), timeout=timeout)
+            if buf and (not step.done() or size >= max_bytes):
+                yield b"".join(buf)
+                buf, size = [], 0
+                last_flush = loop.time()
+                continue
+            try:
+                chunk = step.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                step = None
+            buf.append(chunk)
+            size += len(chunk)
+        if buf:
+            yield b"".join(buf)
+    finally:
+        if step is not None:
+            step.cancel()
+            with suppress(asyncio.CancelledError, StopAsyncIteration, Exception):
+                await step
+        # 客户端断开时上游生成器可能还停在 yield 上：关掉它，让它的 finally（关上游连接、记用量）跑完
+        aclose = getattr(it, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+class EventTap:
+    """
+    tap = EventTap(b"token_stat", b"reply")
+    for payload in tap.feed(chunk): ...   # payload 是 "data:" 后面的 bytes，类型用 sniff_type() 判断
+    只在块里出现标记时才切行；只保留最后一段不完整的行
+    """
+
+    def __init__(self, *markers: bytes):
+        self.markers = markers
+        self.tail = b""
+
+    def _marked(self, data: bytes) -> bool:
+        return any(marker in data for marker in self.markers)
+
+    def feed(self, chunk: bytes) -> list:
+        data = self.tail + chunk if self.tail else chunk
+        if not self._marked(data):
+            self.tail = data[data.rfind(b"\n") + 1:]
+            return []
+        lines = data.split(b"\n")
+        self.tail = lines.pop()
+        return [
+            line[5:].strip()
+            for line in lines
+            if line.startswith(b"data:") and self._marked(line)
+        ]
+
+
+def loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# 没有 event: 字段时从 data 里嗅探顶层 "type"（ADP 的 type 总在最前面），只看开头一小段
+# 必须是顶层对象的第一个键：嵌套对象里的 "type" 不算，嗅探不出就不过滤
+_TYPE_RE = re.compile(rb'\s*\{\s*"type"\s*:\s*"([^"]*)"')
+TYPE_SNIFF_BYTES = 64
+
+
+def sniff_type(data: bytes):
+    """
+    data 顶层的 "type"，嗅探不出返回 None
+    """
+    m = _TYPE_RE.match(data, 0, TYPE_SNIFF_BYTES)
+    return m.group(1).decode("utf-8", "replace") if m is not None else None
+
+
+class SSEEvent:
+    __slots__ = ("event", "data", "id", "retry")
+
+    def __init__(self, event: str, data: bytes, id: str = None, retry: int = None):
+        self.event = event
+        self.data = data
+        self.id = id
+        self.retry = retry
+
+    @property
+    def is_done(self) -> bool:
+        return self.data == b"[DONE]"
+
+    @property
+    def type(self):
+        """
+        event: 字段；没有就嗅探 data 里顶层的 "type"（同 SSEParser 的过滤），都没有返回 None
+        """
+        if self.event != "message":
+            return self.event
+        return sniff_type(self.data)
+
+    def json(self):
+        return loads(self.data)
+
+    def text(self) -> str:
+        return self.data.decode("utf-8", "replace")
+
+    def __repr__(self):
+        return f"SSEEvent({self.event!r}, {self.data[:60]!r})"
+
+
+class SSEParser:
+    """
+    parser = SSEParser(types={"reply", "token_stat"})
+    for ev in parser.feed(chunk): ev.json() ...
+    types=None 时全要；事件类型 = event: 字段，没有就嗅探 data 里的 "type"，
+    嗅探不出的（比如 data: [DONE]）不过滤
+    """
+
+    def __init__(self, types=None):
+        self.types = frozenset(t.encode() if isinstance(t, str) else t for t in types) if types else None
+        self.last_event_id = None
+        self._tail = b""
+        self._skip_lf = False
+        self._reset()
+
+    def _reset(self):
+        self._event = None
+        self._data = []
+        self._id = None
+        self._retry = None
+        self._skip = False
+
+    def _wanted(self, name: bytes) -> bool:
+        return self.types is None or name in self.types
+
+    def feed(self, chunk: bytes) -> list:
+        if self._skip_lf:
+            # 上一块以 \r 结尾，这一块开头的 \n 属于同一个换行
+            self._skip_lf = False
+            if chunk[:1] == b"\n":
+                chunk = chunk[1:]
+        data = self._tail + chunk if self._tail else chunk
+        if b"\r" in data:
+            lines = data.splitlines()
+            if data.endswith(b"\r"):
+                self._skip_lf = True
+                self._tail = b""
+            elif data.endswith(b"\n"):
+                self._tail = b""
+            else:
+                self._tail = lines.pop() if lines else b""
+        else:
+            lines = data.split(b"\n")
+            self._tail = lines.pop()
+
+        out = []
+        for line in lines:
+            if not line:
+                event = self._dispatch()
+                if event is not None:
+                    out.append(event)
+                continue
+            if line[0] == 58:  # b":" 注释 / 心跳
+                continue
+            field, sep, value = line.partition(b":")
+            if sep and value[:1] == b" ":
+                value = value[1:]
+            if field == b"data":
+                if not self._skip:
+                    self._data.append(value)
+            elif field == b"event":
+                self._event = value
+                # event: 在 data: 前面（ADP 就是这样）：不要的事件后面的 data 行直接丢，不拼接
+                self._skip = not self._wanted(value)
+            elif field == b"id":
+                if b"\0" not in value:
+                    self._id = value
+            elif field == b"retry":
+                if value.isdigit():
+                    self._retry = int(value)
+        return out
+
+    def _dispatch(self):
+        if self._id is not None:
+            self.last_event_id = self._id.decode("utf-8", "replace")
+        if self._skip or not self._data:
+            self._reset()
+            return None
+        data = self._data[0] if len(self._data) == 1 else b"\n".join(self._data)
+        name = self._event
+        if name is None:
+            m = _TYPE_RE.match(data, 0, TYPE_SNIFF_BYTES)
+            if m is not None and not self._wanted(m.group(1)):
+                self._reset()
+                return None
+        event = SSEEvent(
+            name.decode("utf-8", "replace") if name is not None else "message",
+            data,
+            self.last_event_id,
+            self._retry,
+        )
+        self._reset()
+        return event
+
+
+async def aiter_sse(chunks, types=None):
+    """
+    async for ev in aiter_sse(resp.aiter_raw(), types={"reply"}): ...
+    """
+    parser = SSEParser(types)
+    async for chunk in chunks:
+        for event in parser.feed(chunk):
+            yield event
+
+
+def iter_sse(chunks, types=None):
+    parser = SSEParser(types)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
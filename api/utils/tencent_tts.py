@@ -53,6 +53,46 @@ def build_tencent_tts_ws_url(
     # print('result',result)
     return result
 
+
+TTS_HOST = "tts.cloud.tencent.com"
+
+
+def build_tencent_tts_v2_ws_url(
+    appid: str,
+    secret_id: str,
+    secret_key: str,
+    codec: str,
+    expired_seconds: int = 300,
+):
+    """
+    流式文本合成 TextToStreamAudioWSv2：文本不进 URL，连上之后再发
+    所以可以先把连接（DNS/TCP/TLS/WebSocket 握手）建好，等有句子了再用
+    返回 (url, session_id)；发文本时的 session_id 要和这里的一致
+    """
+    ts = int(time.time())
+    session_id = uuid.uuid4().hex
+    params = {
+        "Action": "TextToStreamAudioWSv2",
+        "AppId": int(appid),
+        "Codec": codec,
+        "EnableSubtitle": "True",
+        "Expired": ts + int(expired_seconds),
+        "SampleRate": 16000,
+        "SecretId": secret_id,
+        "SessionId": session_id,
+        "Speed": 2,
+        "Timestamp": ts,
+        "VoiceType": 501004,
+        "Volume": 0,
+    }
+    # 参数按 key 排序、不 urlencode 拼原始签名串；HMAC-SHA1 + Base64
+    query_raw = "&".join(f"{k}={params[k]}" for k in sorted(params))
+    raw_sign = f"GET{TTS_HOST}/stream_wsv2?{query_raw}"
+    digest = hmac.new(secret_key.encode("utf-8"), raw_sign.encode("utf-8"), hashlib.sha1).digest()
+    signature = quote(base64.b64encode(digest).decode("utf-8"), safe="")
+    return f"wss://{TTS_HOST}/stream_wsv2?{query_raw}&Signature={signature}", session_id
+
+
 #
 # build_tencent_tts_ws_url(
 #     '1256218467'
@@ -0,0 +1,42 @@
+# api/utils/tokens.py
+"""
+ADP 的 token 用量：
+  - 优先用 SSE 里的 token_stat 事件（procedures[].input_count/output_count，累计值，取最后一条）
+  - 没有 token_stat 时按文本粗估：中日韩字符 1 字 ≈ 1 token，其余按 4 字符 ≈ 1 token
+"""
+import re
+
+_CJK_RE = re.compile("[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    rest = len(text) - cjk
+    return cjk + (rest + 3) // 4
+
+
+def token_usage_from_stat(payload: dict):
+    """
+    token_stat payload -> (in_tokens, out_tokens)；拿不到返回 None
+    """
+    if not isinstance(payload, dict):
+        return None
+    procedures = payload.get("procedures") or []
+    in_tokens = out_tokens = 0
+    found = False
+    for p in procedures:
+        if not isinstance(p, dict):
+            continue
+        if "input_count" in p or "output_count" in p:
+            in_tokens += int(p.get("input_count") or 0)
+            out_tokens += int(p.get("output_count") or 0)
+            found = True
+    if found:
+        return in_tokens, out_tokens
+    # 老版本只给总数：全部算输出
+    total = payload.get("token_count")
+    if total is not None:
+        return 0, int(total)
+    return None
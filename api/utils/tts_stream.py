@@ -1,46 +1,285 @@
 # api/utils/tts_stream.py
+"""
+腾讯 TTS 流式合成：
+  tencent_tts_stream()  一句一合成，yield ("audio", bytes) / ("meta", dict)
+                        不传 pool：老接口 TextToStreamAudioWS，文本签进 URL，每句现连
+                        传 pool：TextToStreamAudioWSv2，从池子里拿一条已经握手、收到 ready 的连接，连上就发文本
+  TTSConnectionPool     每个 websocket 会话一个：预开几条 v2 连接，拿走一条就在后台补一条
+                        句子之间的空档只剩合成时间，DNS/TCP/TLS/握手都提前做掉了
+                        只在一轮对话里补：stop_refill() 后不再补，release() 关掉备用的；
+                        放过 max_idle 的备用连接到点就关（腾讯按账号限并发，不能攒着）
+                        v2 一条连接就是一次合成会话（ACTION_COMPLETE 后服务端收尾），用完即关，不回池
+"""
+import asyncio
 import json
+import logging
 import os
+import time
+import uuid
+from collections import deque
+
 import websockets
 from dotenv import load_dotenv
+from websockets.protocol import State
 load_dotenv()
 
-from api.utils.tencent_tts import build_tencent_tts_ws_url
+from api.utils.tencent_tts import build_tencent_tts_ws_url, build_tencent_tts_v2_ws_url
+
+logger = logging.getLogger(__name__)
+
+# 每个会话预开的连接数（流水线合成时调用方按 TTS_PIPELINE_DEPTH 往上取）
+TTS_POOL_SIZE = int(os.getenv("TTS_POOL_SIZE", "2"))
+# 备用连接放太久服务端会断（ready 后一直不发文本）：超过这个秒数的不用，重新开
+TTS_POOL_MAX_IDLE = float(os.getenv("TTS_POOL_MAX_IDLE", "20"))
+TTS_OPEN_TIMEOUT = float(os.getenv("TTS_OPEN_TIMEOUT", "10"))
+# 同一个会话最多几句同时合成（流水线深度）；腾讯按账号限并发，别开太大
+TTS_PIPELINE_DEPTH = int(os.getenv("TTS_PIPELINE_DEPTH", "3"))
+
+
+class TTSError(Exception):
+    pass
+
 
-async def tencent_tts_stream(*, text: str, codec: str = "pcm"):
+async def _open_v2(codec: str):
     """
-    yield ("audio", bytes_chunk) 或 ("meta", dict)
+    建一条 v2 连接并等到服务端的 ready；返回 (ws, session_id)
     """
-    ws_url = build_tencent_tts_ws_url(
+    ws_url, session_id = build_tencent_tts_v2_ws_url(
         appid=os.getenv("APPID"),
         secret_id=os.getenv("SecretId"),
         secret_key=os.getenv("SecretKey"),
-        text=text,
         codec=codec,
         expired_seconds=300,
     )
+    ws = await websockets.connect(ws_url, max_size=None, open_timeout=TTS_OPEN_TIMEOUT)
 
-    async with websockets.connect(ws_url, max_size=None) as ws:
+    async def wait_ready():
         while True:
-            try:
-                msg = await ws.recv()
-            except websockets.exceptions.ConnectionClosed:
-                return
-
+            msg = await ws.recv()
             if isinstance(msg, (bytes, bytearray)):
-                if msg:
-                    yield ("audio", bytes(msg))
                 continue
+            data = json.loads(msg)
+            if data.get("code") not in (None, 0):
+                raise TTSError(f"tts open failed: {data.get('code')} {data.get('message')}")
+            if data.get("ready") == 1:
+                return
+
+    try:
+        await asyncio.wait_for(wait_ready(), TTS_OPEN_TIMEOUT)
+    except BaseException:
+        await ws.close()
+        raise
+    return ws, session_id
+
+
+class TTSConnectionPool:
+    """
+    pool = TTSConnectionPool()
+    pool.prewarm("pcm")                       # 一轮对话开始时调，等 ADP 首字的工夫把连接建好
+    async for kind, payload in tencent_tts_stream(text=seg, codec="pcm", pool=pool): ...
+    pool.stop_refill()                        # 这一轮的句子都发出去了：拿走的不再补
+    pool.release()                            # 这一轮结束：关掉没用上的
+    await pool.aclose()                       # disconnect 时
+    """
+
+    def __init__(self, size: int = TTS_POOL_SIZE, max_idle: float = TTS_POOL_MAX_IDLE):
+        self.size = max(1, size)
+        self.max_idle = max_idle
+        self.codec = None
+        self._ready = deque()  # (opened_at, codec, ws, session_id)
+        self._opening = set()
+        self._closing = set()
+        self._closed = False
+        # prewarm 打开，stop_refill / release 关掉：一轮之外拿连接不补
+        self._refill = False
+        self._reap_handle = None
+
+    def _close_later(self, ws):
+        task = asyncio.ensure_future(ws.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def _usable(self, item) -> bool:
+        opened_at, codec, ws, _ = item
+        return (
+            codec == self.codec
+            and ws.state is State.OPEN
+            and time.monotonic() - opened_at < self.max_idle
+        )
+
+    def _prune(self):
+        keep = deque()
+        while self._ready:
+            item = self._ready.popleft()
+            if self._usable(item):
+                keep.append(item)
+            else:
+                self._close_later(item[2])
+        self._ready = keep
+
+    def _reap(self):
+        self._reap_handle = None
+        self._prune()
+        self._schedule_reap()
+
+    def _schedule_reap(self):
+        """
+        最老的那条备用连接过期时清一次：不等下一次 prewarm / acquire
+        """
+        if self._reap_handle is not None or not self._ready or self._closed:
+            return
+        delay = self._ready[0][0] + self.max_idle - time.monotonic()
+        self._reap_handle = asyncio.get_running_loop().call_later(max(0.0, delay), self._reap)
 
+    def _cancel_reap(self):
+        if self._reap_handle is not None:
+            self._reap_handle.cancel()
+            self._reap_handle = None
+
+    async def _open(self, codec: str):
+        ws, session_id = await _open_v2(codec)
+        if self._closed or codec != self.codec:
+            await ws.close()
+            return
+        self._ready.append((time.monotonic(), codec, ws, session_id))
+        self._schedule_reap()
+
+    def _on_opened(self, task: asyncio.Task):
+        self._opening.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("tts prewarm failed: %r", task.exception())
+
+    def prewarm(self, codec: str):
+        """
+        一轮开始时调：补足到 size 条（已就绪 + 正在连的），之后每拿走一条补一条；不等连接建好
+        """
+        if self._closed:
+            return
+        self._refill = True
+        self._fill(codec, self.size)
+
+    def _fill(self, codec: str, size: int):
+        if codec != self.codec:
+            # 换了编码：正在连的作废
+            self.codec = codec
+            for task in list(self._opening):
+                task.cancel()
+                self._opening.discard(task)
+        self._prune()
+        for _ in range(size - len(self._ready) - len(self._opening)):
+            task = asyncio.ensure_future(self._open(codec))
+            task.add_done_callback(self._on_opened)
+            self._opening.add(task)
+
+    async def acquire(self, codec: str):
+        """
+        拿一条已就绪的连接（调用方负责关）；池子空了就等正在连的那条，没有正在连的就现连
+        """
+        self._fill(codec, self.size if self._refill else 0)
+        error = None
+        while True:
+            self._prune()
+            if self._ready:
+                _, _, ws, session_id = self._ready.popleft()
+                if self._refill:
+                    self._fill(codec, self.size)
+                return ws, session_id
+            if not self._opening:
+                # 正在连的全失败了：错误抛给调用方（这一句不播），下一句再重新预开
+                if error is not None:
+                    raise error
+                return await _open_v2(codec)
+            done, _ = await asyncio.wait(set(self._opening), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    error = task.exception()
+
+    def stop_refill(self):
+        """
+        这一轮的句子都排上了：后面拿走的不再补，已经在连的照常用
+        """
+        self._refill = False
+
+    def release(self):
+        """
+        这一轮结束（播完 / 被打断 / 不出声）：正在连的取消，备用的关掉，下一轮 prewarm 再开
+        """
+        self._refill = False
+        self._cancel_reap()
+        for task in list(self._opening):
+            task.cancel()
+        while self._ready:
+            self._close_later(self._ready.popleft()[2])
+
+    async def aclose(self):
+        self._closed = True
+        self._refill = False
+        self._cancel_reap()
+        for task in list(self._opening):
+            task.cancel()
+        while self._ready:
+            _, _, ws, _ = self._ready.popleft()
             try:
-                data = json.loads(msg)
-            except json.JSONDecodeError:
-                continue
+                await ws.close()
+            except Exception:
+                pass
 
-            yield ("meta", data)
 
-            # 错误 / 结束
-            if isinstance(data, dict) and data.get("code") not in (None, 0):
-                return
-            if isinstance(data, dict) and data.get("final") == 1:
-                return
+async def _recv_audio(ws):
+    while True:
+        try:
+            msg = await ws.recv()
+        except websockets.exceptions.ConnectionClosed:
+            return
+
+        if isinstance(msg, (bytes, bytearray)):
+            if msg:
+                yield ("audio", bytes(msg))
+            continue
+
+        try:
+            data = json.loads(msg)
+        except json.JSONDecodeError:
+            continue
+
+        yield ("meta", data)
+
+        # 错误 / 结束
+        if isinstance(data, dict) and data.get("code") not in (None, 0):
+            return
+        if isinstance(data, dict) and data.get("final") == 1:
+            return
+
+
+async def tencent_tts_stream(*, text: str, codec: str = "pcm", pool: TTSConnectionPool = None):
+    """
+    yield ("audio", bytes_chunk) 或 ("meta", dict)
+    """
+    if pool is None:
+        ws_url = build_tencent_tts_ws_url(
+            appid=os.getenv("APPID"),
+            secret_id=os.getenv("SecretId"),
+            secret_key=os.getenv("SecretKey"),
+            text=text,
+            codec=codec,
+            expired_seconds=300,
+        )
+        async with websockets.connect(ws_url, max_size=None) as ws:
+            async for item in _recv_audio(ws):
+                yield item
+        return
+
+    ws, session_id = await pool.acquire(codec)
+    try:
+        for action, data in (("ACTION_SYNTHESIS", text), ("ACTION_COMPLETE", "")):
+            await ws.send(json.dumps({
+                "session_id": session_id,
+                "message_id": uuid.uuid4().hex,
+                "action": action,
+                "data": data,
+            }, ensure_ascii=False))
+        async for item in _recv_audio(ws):
+            yield item
+    finally:
+        # 被打断时连接停在合成中途，不能再用：直接关
+        await ws.close()
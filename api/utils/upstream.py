@@ -0,0 +1,157 @@
+# api/utils/upstream.py
+"""
+上游 HTTP 客户端注册表（ADP、Django 自己的 /api/ 等）：
+  - 按 host 一个 keep-alive 连接池，整个进程复用，TCP+TLS 握手只在第一次（或 keepalive 过期后）发生
+  - AsyncClient 绑定 event loop：按 (loop, host) 存；同步视图用的 Client 按 host 存
+  - 装了 h2 就开 HTTP/2（同一条连接多路复用并发流），没装自动退回 HTTP/1.1
+  - 连接池 / 超时全走环境变量；不依赖 Django settings，mcp_server.py 也能直接用
+  - lifespan()：ASGI 启动时预连上游（握手不算进第一轮对话的首字延迟），关停时关掉所有连接
+"""
+import asyncio
+import importlib.util
+import logging
+import os
+import threading
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# 每个 host 的连接池上限；ADP_MAX_CONNECTIONS / ADP_MAX_KEEPALIVE 是老名字，继续认
+MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", os.getenv("ADP_MAX_CONNECTIONS", "200")))
+MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", os.getenv("ADP_MAX_KEEPALIVE", "50")))
+KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60"))
+
+CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "30"))
+POOL_TIMEOUT = float(os.getenv("UPSTREAM_POOL_TIMEOUT", "10"))
+WARMUP_TIMEOUT = float(os.getenv("UPSTREAM_WARMUP_TIMEOUT", "5"))
+
+# 启动时预连的地址，逗号分隔；不配就用 lifespan() 调用方给的
+WARMUP_URLS = [u.strip() for u in os.getenv("UPSTREAM_WARMUP_URLS", "").split(",") if u.strip()]
+
+HTTP2 = os.getenv("UPSTREAM_HTTP2", "1") != "0" and importlib.util.find_spec("h2") is not None
+
+# 普通请求的默认超时
+DEFAULT_TIMEOUT = httpx.Timeout(CONNECT_TIMEOUT, read=READ_TIMEOUT, pool=POOL_TIMEOUT)
+# SSE 流式读不设读超时（ADP 思考可能很久），连接 / 排队照样有上限；按请求传 timeout=STREAM_TIMEOUT
+STREAM_TIMEOUT = httpx.Timeout(CONNECT_TIMEOUT, read=None, pool=POOL_TIMEOUT)
+
+_async_clients = weakref.WeakKeyDictionary()  # loop -> {origin: AsyncClient}
+_sync_clients = {}  # origin -> Client
+_sync_lock = threading.Lock()
+
+
+def origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _client_kwargs() -> dict:
+    return {
+        "timeout": DEFAULT_TIMEOUT,
+        "limits": httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        "http2": HTTP2,
+    }
+
+
+def get_async_client(url: str) -> httpx.AsyncClient:
+    """
+    url 所在 host 的共享 AsyncClient；不要 async with / aclose 它
+    """
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None:
+        clients = _async_clients[loop] = {}
+    key = origin(url)
+    client = clients.get(key)
+    if client is None or client.is_closed:
+        client = clients[key] = httpx.AsyncClient(**_client_kwargs())
+    return client
+
+
+def get_sync_client(url: str) -> httpx.Client:
+    """
+    同步视图 / 线程里用的共享 Client（httpx.Client 可以跨线程共用）
+    """
+    key = origin(url)
+    client = _sync_clients.get(key)
+    if client is None or client.is_closed:
+        with _sync_lock:
+            client = _sync_clients.get(key)
+            if client is None or client.is_closed:
+                client = _sync_clients[key] = httpx.Client(**_client_kwargs())
+    return client
+
+
+async def warmup(urls) -> list:
+    """
+    给每个 host 先打一个 HEAD，把连接（含 TLS）放进池子；返回成功预连的 origin
+    状态码无所谓（404/405 也算连上了），连不上只记日志
+    """
+    targets = list(dict.fromkeys(origin(u) for u in urls if u))
+
+    async def one(target):
+        try:
+            resp = await get_async_client(target).head(
+                target + "/", timeout=httpx.Timeout(WARMUP_TIMEOUT)
+            )
+            await resp.aclose()
+            return target
+        except httpx.HTTPError as e:
+            logger.warning("upstream warmup %s failed: %r", target, e)
+            return None
+
+    done = await asyncio.gather(*[one(t) for t in targets])
+    return [t for t in done if t]
+
+
+async def aclose_all():
+    """
+    关掉当前 loop 上的所有 AsyncClient
+    """
+    clients = _async_clients.pop(asyncio.get_running_loop(), None) or {}
+    for client in clients.values():
+        await client.aclose()
+
+
+def close_all():
+    with _sync_lock:
+        clients = list(_sync_clients.values())
+        _sync_clients.clear()
+    for client in clients:
+        client.close()
+
+
+def lifespan(app, warmup_urls=(), on_startup=(), on_shutdown=()):
+    """
+    给 ASGI app 套一层 lifespan：startup 预连上游（再跑 on_startup 里的协程函数），
+    shutdown 关连接池（先跑 on_shutdown 里的协程函数）
+    其余 scope（http / websocket）原样交给 app
+    """
+    async def application(scope, receive, send):
+        if scope["type"] != "lifespan":
+            return await app(scope, receive, send)
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                warmed = await warmup(WARMUP_URLS or warmup_urls)
+                logger.info("upstream warmup: %s (http2=%s)", warmed or "-", HTTP2)
+                for hook in on_startup:
+                    await hook()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for hook in on_shutdown:
+                    await hook()
+                await aclose_all()
+                close_all()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    return application
@@ -2,37 +2,26 @@
 import json
 import os
 import time
-import requests
-import redis
+import uuid
+from datetime import timedelta
 from django.http import StreamingHttpResponse
-from django.db.models import Min
+from django.utils import timezone
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Hotel, HotelRoomOffer
+from .hotel_cache import hotel_search_cache
+from .hotel_search import search_hotels, search_hotels_fuzzy
 from .serializers import HotelSearchSerializer, TencentSSESerializer
 from .throttles import ChatRateThrottle
-from .usage import UsageRecorder
+from .usage import UsageRecorder, usage_sink
+from .usage_rollup import stats_window, usage_stats
 from .permissions import HasValidApiKey
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from .auth import ApiKeyAuth
 from dotenv import load_dotenv
 load_dotenv()
-# ======================
-# Redis（cancel / lock）
-# ======================
-r = redis.Redis(
-    host=os.getenv("REDIS_HOST", "127.0.0.1"),
-    port=int(os.getenv("REDIS_PORT", 6379)),
-    db=1,
-    decode_responses=True,
-)
-
-def set_cancel(session_id: str, ttl=60):
-    r.setex(f"cancel:{session_id}", ttl, "1")
-
-def is_cancel(session_id: str) -> bool:
-    return r.get(f"cancel:{session_id}") == "1"
+# 会话中断走 Redis pub/sub 推送，见 cancel.py
+from .cancel import cancel_watch, request_cancel, until_cancelled
 
 
 # ======================================================
@@ -43,7 +32,8 @@ class HotelSearchAPIView(APIView):
     """
     POST /api/hotel/search/
     {
-      "hotel_name": ["北京贵宾楼饭店", "北京香江意舍酒店"]
+      "hotel_name": ["北京贵宾楼饭店", "北京香江意舍酒店"],
+      "match": "exact"      # 可选 "fuzzy"，配合 top_k / min_score
     }
     """
     authentication_classes = [ApiKeyAuth]
@@ -66,40 +56,15 @@ class HotelSearchAPIView(APIView):
 
             hotel_name_list = serializer.validated_data["hotel_name"]
             print('hotel_name_list',hotel_name_list)
-            result = []
-
-            for hotel_name in hotel_name_list:
-                hotel = Hotel.objects.filter(name=hotel_name.strip()).first()
-                if not hotel:
-                    continue
-
-                # 注意：你原来 hotel_id 有前导 0 的处理
-                hid = hotel.hotel_id[1:] if hotel.hotel_id and hotel.hotel_id.startswith("0") else hotel.hotel_id
-
-                offers_qs = HotelRoomOffer.objects.filter(hotel_id=hid)
-                min_price = offers_qs.aggregate(min_price=Min("room_offer_price"))["min_price"]
-
-                offers = [
-                    {
-                        "room_type": o.room_type,
-                        "offer_name": o.offer_name,
-                        "origin_price": float(o.room_price_origin) if o.room_price_origin else None,
-                        "offer_price": float(o.room_offer_price) if o.room_offer_price else None,
-                        "breakfast_policy": o.offer_breakfast_policy,
-                    }
-                    for o in offers_qs[:50]
-                ]
-
-                result.append(
-                    {
-                        "hotel_id": hotel.hotel_id,
-                        "name": hotel.name,
-                        "brand": hotel.brand,
-                        "business_area": hotel.business_area,
-                        "min_offer_price": float(min_price) if min_price else None,
-                        "offers": offers,
-                    }
+            # 批量查询：SQL 条数固定，不随 hotel_name 列表长度增长
+            if serializer.validated_data["match"] == "fuzzy":
+                result = search_hotels_fuzzy(
+                    hotel_name_list,
+                    top_k=serializer.validated_data["top_k"],
+                    min_score=serializer.validated_data["min_score"],
                 )
+            else:
+                result = search_hotels(hotel_name_list)
             print('result',result)
             return Response({"result": result}, status=status.HTTP_200_OK)
         except Exception:
@@ -109,13 +74,64 @@ class HotelSearchAPIView(APIView):
             recorder.commit()
 
 
+class HotelCacheStatsAPIView(APIView):
+    """
+    GET /api/hotel/cache/stats/
+    当前 worker 的酒店查询缓存命中情况（容量规划用）
+    """
+    authentication_classes = [ApiKeyAuth]
+    permission_classes = [HasValidApiKey]
+    def get(self, request):
+        return Response({"pid": os.getpid(), **hotel_search_cache.stats()})
+
+
+class UsageSinkStatsAPIView(APIView):
+    """
+    GET /api/usage/sink/stats/
+    当前 worker 的用量落库队列：积压 / 丢弃 / 已写入条数
+    """
+    authentication_classes = [ApiKeyAuth]
+    permission_classes = [HasValidApiKey]
+    def get(self, request):
+        return Response({"pid": os.getpid(), **usage_sink.stats()})
+
+
+class UsageStatsAPIView(APIView):
+    """
+    GET /api/usage/stats/?minutes=60&endpoint=chat_stream
+    当前 ApiClient 最近一段时间各接口的次数 / 失败数 / 延迟分位数 / token / 费用
+    只读 usage_rollup，不扫 usage_record
+    """
+    authentication_classes = [ApiKeyAuth]
+    permission_classes = [HasValidApiKey]
+    def get(self, request):
+        try:
+            minutes = int(request.query_params.get("minutes", 60))
+        except ValueError:
+            return Response({"detail": "minutes must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        minutes = max(1, min(minutes, 90 * 24 * 60))
+        until = timezone.now()
+        since = until - timedelta(minutes=minutes)
+        stats = usage_stats(
+            str(request.auth.id),
+            since,
+            until,
+            endpoint=request.query_params.get("endpoint") or None,
+        )
+        # 回给前端的是实际统计的整桶窗口
+        _, since, until = stats_window(since, until)
+        return Response({"since": since, "until": until, "endpoints": stats})
+
+
 # ======================================================
 # 2. 聊天流式接口（腾讯 / MCP SSE 代理）
 # ======================================================
 import json
 import traceback
-import requests
+import httpx
 from django.http import StreamingHttpResponse
+from .utils.sse import EventTap, aiter_sse, coalesce, iter_sse, sniff_type
+from .utils.upstream import STREAM_TIMEOUT, get_async_client, get_sync_client
 
 class ChatStreamAPIView(APIView):
     authentication_classes = [ApiKeyAuth]
@@ -127,11 +143,16 @@ class ChatStreamAPIView(APIView):
         serializer = TencentSSESerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         payload = serializer.validated_data
-        session_id = payload.get("session_id")
+        # 没传 session_id 就生成一个（通过第一条 session 事件和 X-Session-Id 头告诉前端，中断要用）
+        session_id = payload.get("session_id") or uuid.uuid4().hex
+        generated_session = not payload.get("session_id")
+        raw = payload.get("raw", False)
         recorder = UsageRecorder(
             client_id=str(request.auth.id),
             endpoint="chat_stream",
+            app=payload.get("app") or "",
         )
+        recorder.add_input_text(payload.get("content") or "")
         if payload.get("app") == 's':
             print('22222222')
             bot_app_key = os.getenv("SOUTUI_APP_KEY")
@@ -139,7 +160,7 @@ class ChatStreamAPIView(APIView):
             bot_app_key = os.getenv("DISNEY_APP_KEY")
         print(payload.get("session_id"))
         adp_payload = {
-            "session_id": payload.get("session_id"),
+            "session_id": session_id,
             "bot_app_key": bot_app_key,
             "visitor_biz_id": payload.get("visitor_biz_id"),
             "content": payload.get("content"),
@@ -156,7 +177,10 @@ class ChatStreamAPIView(APIView):
         def sse(obj: dict) -> bytes:
             return ("data: " + json.dumps(obj, ensure_ascii=False) + "\n\n").encode("utf-8")
 
-        def event_stream():
+        async def event_stream():
+            # async generator：ASGI 下不占 sync 线程，连接走进程内共享的 AsyncClient 连接池
+            # raw 模式转发过的 reply：先不解析，ADP 没给 token_stat 时才拿来估算输出 token
+            raw_replies = []
             try:
                 # ✅ 如果你已改成后端注入 bot_app_key，这里确保有值
                 # payload["bot_app_key"] = os.getenv("ADP_BOT_APP_KEY", "")
@@ -167,13 +191,17 @@ class ChatStreamAPIView(APIView):
                     "Accept-Encoding": "identity",
                 }
                 print("ADP OUT payload =", payload)
-                with requests.post(ADP_URL, json=adp_payload, headers=headers, stream=True, timeout=(10, None)) as resp:
+                if generated_session:
+                    yield sse({"type": "session", "session_id": session_id})
+                async with cancel_watch(session_id) as cancelled, get_async_client(ADP_URL).stream(
+                    "POST", ADP_URL, json=adp_payload, headers=headers, timeout=STREAM_TIMEOUT
+                ) as resp:
                     recorder.inc_tool(1)
 
                     # ✅ 上游非 2xx：把状态码+body（截断）透出来，别吞
                     if resp.status_code >= 400:
                         try:
-                            body = resp.text
+                            body = (await resp.aread()).decode("utf-8", "replace")
                         except Exception:
                             body = "<unable to read body>"
                         yield sse({
@@ -184,24 +212,42 @@ class ChatStreamAPIView(APIView):
                         })
                         return
 
-                    # ✅ 逐行转发
-                    for line in resp.iter_lines(decode_unicode=False):
-                        if is_cancel(session_id):
-                            yield sse({"type": "cancelled"})
-                            break
-
-                        if not line:
-                            continue
-
-                        # requests 会返回 b"data: {...}" 这种行
-                        # 你之前是 yield line + b"\n\n"：这会生成 "data: ...\n\n" ✅
-                        yield line + b"\n\n"
-
-            except requests.exceptions.RequestException as e:
+                    # 中断由 pub/sub 推过来 set cancelled，上游没数据时也立刻停
+                    if raw:
+                        # ✅ 原样透传上游字节：不切行不解码，只挑出 token_stat / reply 的 data 行算用量
+                        tap = EventTap(b"token_stat", b"reply")
+                        async for chunk in until_cancelled(resp.aiter_raw(), cancelled):
+                            yield chunk
+                            for data in tap.feed(chunk):
+                                kind = sniff_type(data)
+                                if kind == "reply":
+                                    raw_replies.append(data)
+                                elif kind == "token_stat":
+                                    try:
+                                        recorder.observe_adp_event(json.loads(data))
+                                    except ValueError:
+                                        pass
+                    else:
+                        # ✅ 按事件转发：和 adp_stream 共用 SSEParser，每个事件重新组成一个 "data: {...}\n\n"
+                        async for event in aiter_sse(until_cancelled(resp.aiter_raw(), cancelled)):
+                            yield b"data: " + event.data.replace(b"\n", b"\ndata: ") + b"\n\n"
+
+                            # 用量统计：只解析 reply / token_stat，其它事件原样透传不碰
+                            if event.type in ("reply", "token_stat"):
+                                try:
+                                    recorder.observe_adp_event(event.json())
+                                except ValueError:
+                                    pass
+
+                # 出了 async with 上游响应已经关掉（不再为后面生成的 token 付费），再告诉前端
+                if cancelled.is_set():
+                    yield sse({"type": "cancelled"})
+
+            except httpx.HTTPError as e:
                 recorder.mark_failed()
                 yield sse({
                     "type": "error",
-                    "stage": "requests",
+                    "stage": "requests",  # 前端按这个 stage 判断上游网络错误，保留原名
                     "message": str(e),
                 })
 
@@ -215,15 +261,29 @@ class ChatStreamAPIView(APIView):
                 })
 
             finally:
+                if recorder.stat_tokens is None:
+                    for data in raw_replies:
+                        try:
+                            recorder.observe_adp_event(json.loads(data))
+                        except ValueError:
+                            pass
                 recorder.commit()
 
-        return StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+        # 小事件合并成大块再交给 ASGI server，send 次数少一个量级；第一包不等
+        response = StreamingHttpResponse(coalesce(event_stream()), content_type="text/event-stream")
+        response["X-Session-Id"] = session_id
+        return response
 
 
 # ======================================================
 # 3. 中断当前会话
 # ======================================================
 class CancelSessionAPIView(APIView):
+    """
+    POST /api/session/cancel/
+    { "session_id": "..." }
+    返回 delivered：收到通知的 worker 数（0 = 这个会话当前没有在跑的流）
+    """
     authentication_classes = [ApiKeyAuth]
     permission_classes = [HasValidApiKey]
     def post(self, request):
@@ -232,8 +292,12 @@ class CancelSessionAPIView(APIView):
             endpoint="session_cancel",
         )
         try:
-            ...
-            return Response({"ok": True})
+            session_id = request.data.get("session_id")
+            if not session_id or not isinstance(session_id, str):
+                recorder.mark_failed()
+                return Response({"detail": "session_id is required"}, status=status.HTTP_400_BAD_REQUEST)
+            delivered = request_cancel(session_id)
+            return Response({"ok": True, "session_id": session_id, "delivered": delivered})
         except Exception:
             recorder.mark_failed()
             raise
@@ -272,6 +336,8 @@ def adp_chat_stream(request):
         "workflow_status": "disable",
         "tcadp_user_id": "",
     }
+    # "raw": true 时上游 SSE 原样透传
+    raw = bool(body.get("raw"))
 
     def event_stream():
         headers = {
@@ -280,29 +346,30 @@ def adp_chat_stream(request):
             "Accept-Encoding": "identity",
         }
 
-        with httpx.Client(timeout=None) as client:
-            with client.stream("POST", ADP_URL, headers=headers, json=payload) as resp:
-                resp.raise_for_status()
-
-                for line in resp.iter_lines():
-                    if not line:
-                        continue
-                    if not line.startswith(b"data:"):
-                        continue
-
-                    data_str = line[5:].decode("utf-8").strip()
-                    if data_str == "[DONE]":
-                        break
-
-                    try:
-                        obj = json.loads(data_str)
-                        if obj.get("type") == "reply":
-                            text = obj.get("payload", {}).get("content", "")
-                            if text:
-                                # ✅ SSE 标准格式
-                                yield f"data: {json.dumps({'delta': text['payload']['content']}, ensure_ascii=False)}\n\n"
-                    except Exception:
-                        continue
+        # 共享连接池，不再每次请求新建 Client（TCP+TLS 握手）
+        client = get_sync_client(ADP_URL)
+        with client.stream("POST", ADP_URL, headers=headers, json=payload, timeout=STREAM_TIMEOUT) as resp:
+            resp.raise_for_status()
+
+            if raw:
+                # ✅ 原样透传上游字节，不切行不解析（同步视图没法按时间合并；iter_raw 每块是一次 socket 读，本身就是批量的）
+                yield from resp.iter_raw()
+                return
+
+            # 只有 reply 事件要拆出 delta，其它事件不解析
+            for event in iter_sse(resp.iter_raw(), types=("reply",)):
+                if event.is_done:
+                    break
+
+                try:
+                    obj = event.json()
+                    if obj.get("type") == "reply":
+                        text = obj.get("payload", {}).get("content", "")
+                        if text:
+                            # ✅ SSE 标准格式
+                            yield f"data: {json.dumps({'delta': text}, ensure_ascii=False)}\n\n"
+                except Exception:
+                    continue
 
         yield "data: [DONE]\n\n"
 
@@ -324,19 +391,25 @@ from rest_framework.permissions import AllowAny
 class AdpChatFeedbackAPIView(APIView):
     """
     PATCH /api/chat/feedback/<int:pk>/
-    body: { "feedback": true }  或 { "feedback": false }
+    body: { "feedback": true, "created_at": "..." }  或 { "feedback": false, ... }
+    created_at 用 chat_saved 消息里的原值；不带也能改，但 MySQL 上要探所有月分区
     """
     authentication_classes = []      # ✅ 不跑 ApiKeyAuth
     permission_classes = [AllowAny]
     def patch(self, request, pk: int):
-        try:
-            obj = AdpChatSession.objects.get(pk=pk)
-        except AdpChatSession.DoesNotExist:
-            return Response({"detail": "not found"}, status=status.HTTP_404_NOT_FOUND)
-
-        serializer = AdpChatFeedbackSerializer(obj, data=request.data, partial=True)
+        serializer = AdpChatFeedbackSerializer(data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        data = serializer.validated_data
+
+        # 直接 UPDATE：save() 只按 pk 过滤，带不上分区列
+        qs = AdpChatSession.objects.filter(pk=pk)
+        if "created_at" in data:
+            qs = qs.filter(created_at=data["created_at"])
+        values = {"updated_at": timezone.now()}
+        if "feedback" in data:
+            values["feedback"] = data["feedback"]
+        if not qs.update(**values):
+            return Response({"detail": "not found"}, status=status.HTTP_404_NOT_FOUND)
         return JsonResponse({"code": 200,"message": "ok","data":[]})
 
 
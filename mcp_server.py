@@ -1,9 +1,12 @@
-import httpx
 from fastmcp import FastMCP
 import json
 import os
 from dotenv import load_dotenv
 load_dotenv()
+
+# 上游共享连接池（Django / ADP 各一个 host 池），不再每次调用新建 AsyncClient
+from api.utils.sse import aiter_sse
+from api.utils.upstream import STREAM_TIMEOUT, get_async_client
 print("=== ENV CHECK ===")
 print("ADP_BOT_APP_KEY:", repr(os.getenv("ADP_BOT_APP_KEY")))
 print("DJANGO_API_KEY:", repr(os.getenv("DJANGO_API_KEY")))
@@ -53,16 +56,15 @@ async def hotel_search(hotel_name: list[str]) -> dict:
     url = f"{DJANGO_BASE_URL}/api/hotel/search/"
     payload = {"hotel_name": hotel_name}
 
-    async with httpx.AsyncClient(timeout=20) as client:
-        resp = await client.post(url, json=payload, headers=build_headers())
+    resp = await get_async_client(url).post(url, json=payload, headers=build_headers(), timeout=20)
 
-        # 方便你调试：把非 2xx 的响应体打印出来
-        if resp.status_code >= 400:
-            raise RuntimeError(
-                f"Django API error {resp.status_code}: {resp.text}"
-            )
+    # 方便你调试：把非 2xx 的响应体打印出来
+    if resp.status_code >= 400:
+        raise RuntimeError(
+            f"Django API error {resp.status_code}: {resp.text}"
+        )
 
-        return resp.json()
+    return resp.json()
 
 @mcp.tool
 async def adp_chat_sse(
@@ -101,36 +103,30 @@ async def adp_chat_sse(
     events: list[dict] = []
 
     # stream=True：开始流式读取
-    async with httpx.AsyncClient(timeout=None) as client:
-        async with client.stream("POST", ADP_URL, headers=headers, json=payload) as resp:
-            resp.raise_for_status()
-
-            # 逐行读 SSE
-            async for line in resp.aiter_lines():
-                if not line:
-                    continue
-                # SSE 数据行通常长这样：data: {...}
-                if line.startswith("data:"):
-                    data_str = line[len("data:"):].strip()
-
-                    # 有些 SSE 会发 data: [DONE]
-                    if data_str == "[DONE]":
+    client = get_async_client(ADP_URL)
+    async with client.stream("POST", ADP_URL, headers=headers, json=payload, timeout=STREAM_TIMEOUT) as resp:
+        resp.raise_for_status()
+
+        # 共用的增量 SSE 解析：直接吃 bytes，只要 reply 事件（thought 等不解析）
+        async for event in aiter_sse(resp.aiter_raw(), types=("reply",)):
+            # 有些 SSE 会发 data: [DONE]
+            if event.is_done:
+                break
+
+            # 尝试解析 JSON
+            try:
+                obj = event.json()
+                events.append(obj)
+
+                # ⚠️ 这里的字段名取决于 ADP 实际返回结构
+                # 先做“兼容抽取”：常见是 obj["content"] / obj["delta"] / obj["answer"] 等
+                for key in ("delta", "content", "answer", "text", "message"):
+                    if isinstance(obj.get(key), str) and obj.get(key):
+                        chunks.append(obj[key])
                         break
-
-                    # 尝试解析 JSON
-                    try:
-                        obj = json.loads(data_str)
-                        events.append(obj)
-
-                        # ⚠️ 这里的字段名取决于 ADP 实际返回结构
-                        # 先做“兼容抽取”：常见是 obj["content"] / obj["delta"] / obj["answer"] 等
-                        for key in ("delta", "content", "answer", "text", "message"):
-                            if isinstance(obj.get(key), str) and obj.get(key):
-                                chunks.append(obj[key])
-                                break
-                    except json.JSONDecodeError:
-                        # 如果不是 JSON，就当作纯文本
-                        chunks.append(data_str)
+            except ValueError:
+                # 如果不是 JSON，就当作纯文本
+                chunks.append(event.text())
     final_text = "".join(chunks).strip()
     result=[]
     for index,item in enumerate(events):
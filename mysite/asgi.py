@@ -16,7 +16,13 @@ django.setup()
 import api.routing
 # application = get_asgi_application()
 django_asgi_app = get_asgi_application()
-application = ProtocolTypeRouter({
+from api.cancel import aclose_cancel_registry
+from api.hotel_index import warm_name_index
+from api.utils.upstream import lifespan
+from api.views import ADP_URL
+
+# lifespan：启动时预连 ADP（TLS 握手不算进第一轮对话）、建好酒店名索引，关停时关掉上游连接池和中断订阅
+application = lifespan(ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": URLRouter(api.routing.websocket_urlpatterns),
-})
+}), warmup_urls=[ADP_URL], on_startup=[warm_name_index], on_shutdown=[aclose_cancel_registry])
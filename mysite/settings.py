@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import json
 import os
 from pathlib import Path
 # import pymysql
@@ -109,6 +110,7 @@ DATABASES = {
         "PASSWORD": DB_PASSWORD,
         "OPTIONS": {
             "charset": "utf8mb4",
+            # 不开 local_infile：import_hotels --fast 的 LOAD DATA 自己单开一条连接（api/hotel_writers.py）
         },
     }
 }
@@ -204,6 +206,40 @@ CACHES = {
         },
     }
 }
+# 酒店查询缓存：L1 每个 worker 的 LRU 条数，L2 Redis 过期时间（秒）
+# 目录数据只在 import_hotels 时变化，导入完成会 bump catalog version 让两级缓存一起失效
+HOTEL_CACHE_LOCAL_SIZE = int(os.getenv("HOTEL_CACHE_LOCAL_SIZE", "4096"))
+HOTEL_CACHE_TIMEOUT = int(os.getenv("HOTEL_CACHE_TIMEOUT", str(24 * 3600)))
+# 模糊查询用的内存酒店名索引：每隔多少秒检查一次 catalog version 决定是否重建
+HOTEL_INDEX_REFRESH_SECONDS = int(os.getenv("HOTEL_INDEX_REFRESH_SECONDS", "30"))
+# API key 只存 HMAC-SHA256(pepper, key)；pepper 换了所有 key 都会失效
+API_KEY_PEPPER = os.getenv("API_KEY_PEPPER", SECRET_KEY)
+# ApiKeyAuth 的内存 key 表：每隔多少秒检查一次 Redis 里的版本号决定是否重载
+API_KEY_REFRESH_SECONDS = int(os.getenv("API_KEY_REFRESH_SECONDS", "5"))
+# ApiClient.last_seen_at / request_count 攒批写回的间隔（秒）
+API_ACTIVITY_FLUSH_SECONDS = int(os.getenv("API_ACTIVITY_FLUSH_SECONDS", "30"))
+# UsageRecord 异步落库：队列上限（满了丢弃并计数）、每批条数、最长攒批时间（毫秒）
+USAGE_BUFFER_SIZE = int(os.getenv("USAGE_BUFFER_SIZE", "10000"))
+USAGE_FLUSH_BATCH = int(os.getenv("USAGE_FLUSH_BATCH", "500"))
+USAGE_FLUSH_MS = int(os.getenv("USAGE_FLUSH_MS", "1000"))
+# 落库时同时增量更新 usage_rollup（/api/usage/stats/ 只读 rollup）
+USAGE_ROLLUPS_ENABLED = os.getenv("USAGE_ROLLUPS_ENABLED", "1") == "1"
+# 用量 sink 只增量合并这么多秒以内的记录（更晚的留给 rollup_usage 重算）；
+# rollup_usage 只重算早于 2 倍这个时间的整小时，两边永远不碰同一个桶
+USAGE_ROLLUP_LATE_SECONDS = int(os.getenv("USAGE_ROLLUP_LATE_SECONDS", "300"))
+# 分钟桶保留天数（retention 命令清理）；更早的统计只剩小时桶
+USAGE_ROLLUP_MINUTE_RETENTION_DAYS = int(os.getenv("USAGE_ROLLUP_MINUTE_RETENTION_DAYS", "7"))
+# 明细保留月数（含本月），retention 命令按月分区删除/归档；统计走 usage_rollup 不受影响
+USAGE_RETENTION_MONTHS = int(os.getenv("USAGE_RETENTION_MONTHS", "6"))
+CHAT_RETENTION_MONTHS = int(os.getenv("CHAT_RETENTION_MONTHS", "12"))
+# ADP 计费：每千 token 多少分，按应用（"s" 搜推 / "d" 迪士尼）配置，没配的走 default
+ADP_PRICE_TABLE = json.loads(os.getenv("ADP_PRICE_TABLE", "null")) or {
+    "default": {"in": 0.2, "out": 0.8},
+}
+# SSE 转发合并小包：第一包立即发，之后最多每 SSE_COALESCE_MS 毫秒 send 一次（0 = 不合并）
+SSE_COALESCE_MS = int(os.getenv("SSE_COALESCE_MS", "20"))
+SSE_COALESCE_MAX_BYTES = int(os.getenv("SSE_COALESCE_MAX_BYTES", "65536"))
+
 from corsheaders.defaults import default_headers
 
 # 允许前端流式（SSE）必要 header